@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Reports how CATEGORIZATION_RULES behave on the transactions stored in 'ofx_transactions'.
+
+Usage: python analyze_categorization_rules.py [--target_db local|remote] [--output FILE] [--no-timing]
+
+Lists malformed entries, rules shadowed by earlier ones, rules covered by a later rule with
+the same category, rules that never fire, and per-rule hit counts and evaluation cost.
+"""
+
+import argparse
+import os
+import sys
+
+# Add src to path to use existing connection system
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from backend.spending.rule_analysis import analyze_stored_transactions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the categorization rules against the stored transactions.")
+    parser.add_argument("--target_db", type=str, default="local", choices=["local", "remote"],
+                        help="The target database ('local' for SQLite, 'remote' for MySQL). Default is 'local'.")
+    parser.add_argument("--output", type=str, default=None, help="CSV file for the per-rule statistics.")
+    parser.add_argument("--no-timing", action="store_true", help="Skip timing each rule's evaluation.")
+    args = parser.parse_args()
+
+    analyze_stored_transactions(target_db=args.target_db, output_path=args.output, measure_cost=not args.no_timing)
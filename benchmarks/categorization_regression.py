@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Golden-file regression check and timing harness for transaction categorization.
+
+Usage: python benchmarks/categorization_regression.py [--update] [--repeat N] [--threshold RATIO]
+                                                      [--golden-dir DIR] [--ofx-dir DIR]
+
+Runs the get_categorized_transactions pipeline (parse, then categorize) over resources/files,
+with the parse cache and the persistent memo cache disabled, and compares every row's
+(id, main_category, sub_category) against the committed golden snapshot in benchmarks/golden/.
+Ids repeat across overlapping statements, so rows are keyed by (id, occurrence), the
+occurrence being the row's rank among the rows with the same id in pipeline order.
+
+Each stage is run --repeat times and its best wall time is kept. The throughput of every
+stage is compared against the timings recorded with the snapshot; a stage more than
+--threshold slower fails the check, as does any changed, missing or extra row. The exit
+status is 1 on failure. --update rewrites the snapshot and the timings from the current run,
+after a categorization change has been reviewed (timings are machine dependent, so record
+them on the machine the check runs on).
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+
+# Add src to path to use the project's modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+import pandas as pd
+
+import backend.spending.ofx_parser as ofx_parser
+from run_ofx_benchmark import _measure, _stage_result, _git_commit
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+GOLDEN_CATEGORIES_FILE = 'categorized_transactions.csv'
+GOLDEN_TIMINGS_FILE = 'categorization_timings.json'
+GOLDEN_COLUMNS = [ofx_parser.COLUMN_ID, 'occurrence', ofx_parser.COLUMN_MAIN_CATEGORY, ofx_parser.COLUMN_SUB_CATEGORY]
+DEFAULT_THROUGHPUT_THRESHOLD = 0.25
+MAX_REPORTED_ROWS = 50
+
+
+def _best_run(stage_function, repeat: int) -> tuple:
+    """Runs stage_function repeat times and returns (its last result, best wall seconds)."""
+    best_seconds = None
+    result = None
+    for _ in range(repeat):
+        result, wall_seconds, _ = _measure(stage_function, measure_memory=False)
+        best_seconds = wall_seconds if best_seconds is None else min(best_seconds, wall_seconds)
+    return result, best_seconds
+
+
+def run_pipeline(ofx_dir: str, repeat: int = 3) -> tuple:
+    """
+    Parses and categorizes the statements in ofx_dir the way get_categorized_transactions
+    does, timing each stage. Returns (the categorized DataFrame, per-stage results).
+    """
+    ofx_parser.USE_OFX_PARSE_CACHE = False
+    ofx_parser.USE_MEMO_CATEGORY_CACHE = False
+    stages = {}
+
+    print("Stage 1/2: parse...")
+    raw_df, parse_seconds = _best_run(lambda: ofx_parser.parse_ofx_files_to_dataframe(ofx_dir), repeat)
+    stages['parse'] = _stage_result(parse_seconds, None, len(raw_df))
+
+    print("Stage 2/2: categorization...")
+    categorized_df, categorize_seconds = _best_run(lambda: ofx_parser._categorize_raw_transactions(raw_df), repeat)
+    stages['categorization'] = _stage_result(categorize_seconds, None, len(categorized_df))
+
+    stages['total'] = _stage_result(parse_seconds + categorize_seconds, None, len(categorized_df))
+    return categorized_df, stages
+
+
+def to_golden_rows(categorized_df: pd.DataFrame) -> pd.DataFrame:
+    """Keys the categorized rows by (id, occurrence) and keeps the columns of the snapshot."""
+    golden_df = categorized_df[[ofx_parser.COLUMN_ID, ofx_parser.COLUMN_MAIN_CATEGORY,
+                                ofx_parser.COLUMN_SUB_CATEGORY]].astype(str).reset_index(drop=True)
+    golden_df['occurrence'] = golden_df.groupby(ofx_parser.COLUMN_ID).cumcount()
+    return golden_df[GOLDEN_COLUMNS].sort_values([ofx_parser.COLUMN_ID, 'occurrence'], ignore_index=True)
+
+
+def diff_golden_rows(golden_df: pd.DataFrame, current_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the rows whose categories differ between the snapshot and the current run, with
+    golden_/current_ category columns and a 'change' column ('changed', 'missing' or 'extra').
+    """
+    key_columns = [ofx_parser.COLUMN_ID, 'occurrence']
+    merged = golden_df.merge(current_df, on=key_columns, how='outer', suffixes=('_golden', '_current'),
+                             indicator=True)
+    changed = ((merged['_merge'] == 'both')
+               & ((merged[f'{ofx_parser.COLUMN_MAIN_CATEGORY}_golden'] != merged[f'{ofx_parser.COLUMN_MAIN_CATEGORY}_current'])
+                  | (merged[f'{ofx_parser.COLUMN_SUB_CATEGORY}_golden'] != merged[f'{ofx_parser.COLUMN_SUB_CATEGORY}_current'])))
+    merged['change'] = np.select([changed, merged['_merge'] == 'left_only', merged['_merge'] == 'right_only'],
+                                 ['changed', 'missing', 'extra'], default='')
+    return merged[merged['change'] != ''].drop(columns='_merge').reset_index(drop=True)
+
+
+def compare_timings(stages: dict, baseline: dict, threshold: float = DEFAULT_THROUGHPUT_THRESHOLD) -> list:
+    """Prints each stage's throughput against baseline and returns the stages slower than the threshold allows."""
+    regressions = []
+    print(f"\nThroughput against {baseline.get('version', {}).get('git_commit', '?')} "
+          f"({baseline.get('created_at', '?')}):")
+    for stage, result in stages.items():
+        baseline_rate = baseline.get('stages', {}).get(stage, {}).get('transactions_per_second')
+        current_rate = result['transactions_per_second']
+        if not baseline_rate or not current_rate:
+            print(f"  {stage:<16} {current_rate or 0:>12.0f} txn/s  (no baseline)")
+            continue
+        ratio = current_rate / baseline_rate
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(stage)
+        print(f"  {stage:<16} {baseline_rate:>12.0f} -> {current_rate:>12.0f} txn/s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def _write_golden(golden_dir: str, golden_df: pd.DataFrame, stages: dict):
+    os.makedirs(golden_dir, exist_ok=True)
+    golden_df.to_csv(os.path.join(golden_dir, GOLDEN_CATEGORIES_FILE), index=False)
+    timings = {
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'version': {
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+        },
+        'stages': stages,
+    }
+    with open(os.path.join(golden_dir, GOLDEN_TIMINGS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(timings, f, indent=2, ensure_ascii=False)
+    print(f"Golden snapshot ({len(golden_df)} rows) and timings written to {golden_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check categorization results and speed against a golden snapshot.")
+    parser.add_argument("--update", action="store_true", help="Rewrite the golden snapshot and timings from this run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best wall time is kept. Default is 3.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THROUGHPUT_THRESHOLD,
+                        help=f"Throughput drop ratio that fails the check. Default is {DEFAULT_THROUGHPUT_THRESHOLD}.")
+    parser.add_argument("--golden-dir", type=str, default=GOLDEN_DIR, help="Directory of the golden snapshot.")
+    parser.add_argument("--ofx-dir", type=str, default=ofx_parser.BASE_OFX_FILES_PATH,
+                        help="Statements to categorize. Default is resources/files.")
+    args = parser.parse_args()
+
+    categorized_df, stages = run_pipeline(args.ofx_dir, repeat=max(args.repeat, 1))
+    current_df = to_golden_rows(categorized_df)
+    for stage, stage_result in stages.items():
+        print(f"  {stage:<16} {stage_result['wall_seconds']:>10.3f}s  "
+              f"{stage_result['transactions_per_second'] or 0:>12.0f} txn/s")
+
+    if args.update:
+        _write_golden(args.golden_dir, current_df, stages)
+        return
+
+    categories_path = os.path.join(args.golden_dir, GOLDEN_CATEGORIES_FILE)
+    if not os.path.exists(categories_path):
+        print(f"Error: golden snapshot not found: {categories_path}. Run with --update to create it.")
+        sys.exit(1)
+    golden_df = pd.read_csv(categories_path, dtype=str, keep_default_na=False)
+    golden_df['occurrence'] = golden_df['occurrence'].astype(int)
+    differences = diff_golden_rows(golden_df, current_df)
+    print(f"\nCategories: {len(current_df)} rows checked against {len(golden_df)} golden rows.")
+    if differences.empty:
+        print("  No differences.")
+    else:
+        print(f"  {differences['change'].value_counts().to_dict()}")
+        with pd.option_context('display.max_colwidth', 40, 'display.width', 200):
+            print(differences.head(MAX_REPORTED_ROWS).to_string(index=False))
+        if len(differences) > MAX_REPORTED_ROWS:
+            print(f"  ... {len(differences) - MAX_REPORTED_ROWS} more.")
+
+    regressions = []
+    timings_path = os.path.join(args.golden_dir, GOLDEN_TIMINGS_FILE)
+    if os.path.exists(timings_path):
+        with open(timings_path, encoding='utf-8') as f:
+            regressions = compare_timings(stages, json.load(f), args.threshold)
+    else:
+        print(f"Warning: no golden timings at {timings_path}; throughput not checked.")
+
+    if not differences.empty or regressions:
+        print("\nFAILED: " + "; ".join(
+            ([f"{len(differences)} categorization differences"] if not differences.empty else [])
+            + ([f"throughput regression in {', '.join(regressions)}"] if regressions else [])))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic Nubank-style OFX statements for benchmarking the spending pipeline.
+
+Usage: python benchmarks/ofx_generator.py OUTPUT_DIR [--months N] [--transactions-per-month N] [--seed N]
+
+OUTPUT_DIR gets the same layout as resources/files: credit_card/nubank-YYYY-MM.ofx and
+nuconta/nubank-YYYY-MM.ofx. Like the real exports:
+- credit card files declare CHARSET:1252 but are written in UTF-8 (mojibake memos),
+  Nuconta files declare UTF-8;
+- consecutive credit card statements overlap by a few days, so the same transactions
+  appear in two files;
+- installment purchases reuse one FITID for every "Parcela k/n" and international
+  purchases share their FITID with an 'IOF de "..."' charge.
+
+Memos are partly built from CATEGORIZATION_RULES so categorization hits its rules at a
+realistic rate. Only one month is kept in memory, so millions of transactions can be written.
+"""
+
+import argparse
+import calendar
+import os
+import random
+import sys
+import uuid
+from datetime import date, timedelta
+
+# Add src to path to use the project's modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from backend.spending.categorization_rules import CATEGORIZATION_RULES
+
+CREDIT_CARD_SHARE = 0.7
+INSTALLMENT_PROBABILITY = 0.05
+INTERNATIONAL_PROBABILITY = 0.03
+RULE_MEMO_PROBABILITY = 0.8
+IOF_RATE = 0.0438
+
+_ACCENTED_MERCHANTS = ['Padaria São Jorge', 'Farmácia Drogasil', 'Transação de NuTag', 'Açaí Concept',
+                       'Café Pelé Ltda', 'Panificadora Pão Dourado', 'Nova Ótica Visão', 'Restaurante Sírio Jacó Ltda']
+_INTERNATIONAL_MERCHANTS = ['Netflix.Com', 'Leetcode.Com', 'Steamgames.Com', 'Openai *Chatgpt Subscr', 'Github, Inc.']
+_NAMES = ['Maria Silva Souza', 'João Pereira Lima', 'Ana Paula Gonçalves', 'José Antônio Ribeiro', 'Lúcia Fernandes']
+_BANKS = ['NU PAGAMENTOS - IP (0260)', 'ITAÚ UNIBANCO S.A. (0341)', 'BCO BRADESCO S.A. (0237)', 'CAIXA ECONOMICA FEDERAL (0104)']
+
+_HEADER = '''OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:{encoding}
+CHARSET:{charset}
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+<OFX>
+<SIGNONMSGSRSV1>
+<SONRS>
+<STATUS>
+<CODE>0</CODE>
+<SEVERITY>INFO</SEVERITY>
+</STATUS>
+<DTSERVER>{server_date}000000[0:GMT]</DTSERVER>
+<LANGUAGE>POR</LANGUAGE>
+<FI>
+<ORG>NU PAGAMENTOS S.A.</ORG>
+<FID>260</FID>
+</FI>
+</SONRS>
+</SIGNONMSGSRSV1>
+'''
+_CREDIT_CARD_OPEN = '''<CREDITCARDMSGSRSV1>
+<CCSTMTTRNRS>
+<TRNUID>1001</TRNUID>
+<STATUS>
+<CODE>0</CODE>
+<SEVERITY>INFO</SEVERITY>
+</STATUS>
+<CCSTMTRS>
+<CURDEF>BRL</CURDEF>
+<CCACCTFROM>
+<ACCTID>{account_id}</ACCTID>
+</CCACCTFROM>
+<BANKTRANLIST>
+<DTSTART>{start}000000[-3:BRT]</DTSTART>
+<DTEND>{end}000000[-3:BRT]</DTEND>
+'''
+_CREDIT_CARD_CLOSE = '''</BANKTRANLIST>
+<LEDGERBAL>
+<BALAMT>{balance:.2f}</BALAMT>
+<DTASOF>{end}000000[-3:BRT]</DTASOF>
+</LEDGERBAL>
+</CCSTMTRS>
+</CCSTMTTRNRS>
+</CREDITCARDMSGSRSV1>
+</OFX>
+'''
+_NUCONTA_OPEN = '''<BANKMSGSRSV1>
+<STMTTRNRS>
+<TRNUID>1</TRNUID>
+<STATUS>
+<CODE>0</CODE>
+<SEVERITY>INFO</SEVERITY>
+</STATUS>
+<STMTRS>
+<CURDEF>BRL</CURDEF>
+<BANKACCTFROM>
+<BANKID>0260</BANKID>
+<BRANCHID>1</BRANCHID>
+<ACCTID>{account_id}</ACCTID>
+<ACCTTYPE>CHECKING</ACCTTYPE>
+</BANKACCTFROM>
+<BANKTRANLIST>
+<DTSTART>{start}000000[-3:BRT]</DTSTART>
+<DTEND>{end}000000[-3:BRT]</DTEND>
+'''
+_NUCONTA_CLOSE = '''</BANKTRANLIST>
+<LEDGERBAL>
+<BALAMT>{balance:.2f}</BALAMT>
+<DTASOF>{end}000000[-3:BRT]</DTASOF>
+</LEDGERBAL>
+</STMTRS>
+</STMTTRNRS>
+</BANKMSGSRSV1>
+</OFX>
+'''
+_TRANSACTION = '''<STMTTRN>
+<TRNTYPE>{type}</TRNTYPE>
+<DTPOSTED>{day}000000[-3:BRT]</DTPOSTED>
+<TRNAMT>{amount:.2f}</TRNAMT>
+<FITID>{fitid}</FITID>
+<MEMO>{memo}</MEMO>
+</STMTTRN>
+'''
+
+
+def _is_cp1252_safe(memo: str) -> bool:
+    """
+    Whether the UTF-8 bytes of memo can be decoded as cp1252, which the credit card
+    files declare. Real exports never contain e.g. 'Á' (C3 81): 0x81 is undefined in cp1252.
+    """
+    try:
+        memo.encode('utf-8').decode('cp1252')
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _rule_memos() -> list:
+    """Memos that match a categorization rule: its keywords joined and title-cased."""
+    memos = []
+    for rule in CATEGORIZATION_RULES:
+        keywords = rule[0]
+        if isinstance(keywords, list) and keywords and all(isinstance(keyword, str) for keyword in keywords):
+            memo = ' '.join(keywords).title()
+            if _is_cp1252_safe(memo):
+                memos.append(memo)
+    return memos
+
+
+def _escape(memo: str) -> str:
+    return memo.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class _StatementFactory:
+    """Draws FITIDs, memos and amounts from one seeded random generator."""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.rule_memos = _rule_memos()
+
+    def fitid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def day_in(self, first_day: date, last_day: date) -> date:
+        return first_day + timedelta(days=self.rng.randint(0, (last_day - first_day).days))
+
+    def amount(self, low: float, high: float) -> float:
+        return round(self.rng.uniform(low, high), 2)
+
+    def card_merchant(self) -> str:
+        if self.rng.random() < RULE_MEMO_PROBABILITY:
+            return self.rng.choice(self.rule_memos)
+        if self.rng.random() < 0.5:
+            return self.rng.choice(_ACCENTED_MERCHANTS)
+        return f"Loja {self.rng.randint(1, 50000)}"
+
+    def nuconta_memo(self) -> tuple:
+        """Returns (memo, signed amount) for a checking account transaction."""
+        name = self.rng.choice(_NAMES)
+        bank = self.rng.choice(_BANKS)
+        document = f"•••.{self.rng.randint(100, 999)}.{self.rng.randint(100, 999)}-••"
+        kind = self.rng.random()
+        if kind < 0.35:
+            return f"Transferência enviada pelo Pix - {name} - {document} - {bank}", -self.amount(5, 2000)
+        if kind < 0.6:
+            return f"Transferência Recebida - {name} - {document} - {bank}", self.amount(10, 5000)
+        if kind < 0.75:
+            return f"Pagamento de boleto efetuado - {self.rng.choice(self.rule_memos).upper()}", -self.amount(30, 3000)
+        if kind < 0.85:
+            return f"Compra no débito - {self.card_merchant()}", -self.amount(5, 400)
+        if kind < 0.92:
+            return "Aplicação RDB", -self.amount(100, 5000)
+        return "Resgate RDB", self.amount(100, 5000)
+
+
+def _month_bounds(year: int, month: int) -> tuple:
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _add_months(year: int, month: int, count: int) -> tuple:
+    index = year * 12 + (month - 1) + count
+    return index // 12, index % 12 + 1
+
+
+def _write_statement(path: str, encoding: str, charset: str, open_template: str, close_template: str,
+                     account_id: str, start: date, end: date, transactions: list):
+    balance = sum(amount for _, _, amount, _ in transactions)
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(_HEADER.format(encoding=encoding, charset=charset, server_date=end.strftime('%Y%m%d')))
+        f.write(open_template.format(account_id=account_id, start=start.strftime('%Y%m%d'), end=end.strftime('%Y%m%d')))
+        for fitid, day, amount, memo in transactions:
+            f.write(_TRANSACTION.format(type='CREDIT' if amount > 0 else 'DEBIT', day=day.strftime('%Y%m%d'),
+                                        amount=amount, fitid=fitid, memo=_escape(memo)))
+        f.write(close_template.format(balance=balance, end=end.strftime('%Y%m%d')))
+
+
+def generate_ofx_corpus(output_dir: str, months: int = 12, transactions_per_month: int = 500, seed: int = 0,
+                        start_year: int = 2023, start_month: int = 1, overlap_days: int = 3) -> dict:
+    """
+    Writes months credit card and Nuconta statements with about transactions_per_month
+    transactions each month (plus overlap, installment and IOF rows) under output_dir.
+    Returns a summary with the file, transaction and byte counts.
+    """
+    factory = _StatementFactory(seed)
+    card_dir = os.path.join(output_dir, 'credit_card')
+    nuconta_dir = os.path.join(output_dir, 'nuconta')
+    os.makedirs(card_dir, exist_ok=True)
+    os.makedirs(nuconta_dir, exist_ok=True)
+    card_account, nuconta_account = factory.fitid(), f"{factory.rng.randint(1000000, 9999999)}-{factory.rng.randint(0, 9)}"
+
+    card_per_month = int(transactions_per_month * CREDIT_CARD_SHARE)
+    nuconta_per_month = transactions_per_month - card_per_month
+    pending_installments = []   # [fitid, merchant, installment amount, next installment, installment count, day of month]
+    previous_card_month = []
+    transactions_written = 0
+
+    for month_index in range(months):
+        year, month = _add_months(start_year, start_month, month_index)
+        first_day, last_day = _month_bounds(year, month)
+
+        card_month = []
+        for _ in range(card_per_month):
+            day = factory.day_in(first_day, last_day)
+            fitid = factory.fitid()
+            roll = factory.rng.random()
+            if roll < INSTALLMENT_PROBABILITY:
+                count = factory.rng.choice([2, 3, 4, 6, 10, 12])
+                pending_installments.append([fitid, factory.card_merchant(), -factory.amount(20, 800), 1, count, day.day])
+            elif roll < INSTALLMENT_PROBABILITY + INTERNATIONAL_PROBABILITY:
+                merchant = factory.rng.choice(_INTERNATIONAL_MERCHANTS)
+                amount = -factory.amount(10, 300)
+                card_month.append((fitid, day, amount, merchant))
+                card_month.append((fitid, day, round(amount * IOF_RATE, 2), f'IOF de "{merchant}"'))
+            else:
+                card_month.append((fitid, day, -factory.amount(3, 600), factory.card_merchant()))
+
+        still_pending = []
+        for installment in pending_installments:
+            fitid, merchant, amount, number, count, day_of_month = installment
+            day = date(year, month, min(day_of_month, last_day.day))
+            card_month.append((fitid, day, amount, f"{merchant} - Parcela {number}/{count}"))
+            if number < count:
+                installment[3] = number + 1
+                still_pending.append(installment)
+        pending_installments = still_pending
+        card_month.sort(key=lambda transaction: transaction[1])
+
+        # The statement starts overlap_days before the month, repeating the previous statement's last days
+        statement_start = first_day - timedelta(days=overlap_days)
+        overlap = [transaction for transaction in previous_card_month if transaction[1] >= statement_start]
+        card_statement = overlap + card_month
+        _write_statement(os.path.join(card_dir, f"nubank-{year:04d}-{month:02d}.ofx"), 'USASCII', '1252',
+                         _CREDIT_CARD_OPEN, _CREDIT_CARD_CLOSE, card_account, statement_start, last_day,
+                         list(reversed(card_statement)))
+        previous_card_month = card_month
+
+        nuconta_month = []
+        for _ in range(nuconta_per_month):
+            memo, amount = factory.nuconta_memo()
+            nuconta_month.append((factory.fitid(), factory.day_in(first_day, last_day), amount, memo))
+        nuconta_month.sort(key=lambda transaction: transaction[1])
+        _write_statement(os.path.join(nuconta_dir, f"nubank-{year:04d}-{month:02d}.ofx"), 'UTF-8', 'NONE',
+                         _NUCONTA_OPEN, _NUCONTA_CLOSE, nuconta_account, first_day, last_day, nuconta_month)
+
+        transactions_written += len(card_statement) + len(nuconta_month)
+
+    total_bytes = sum(os.path.getsize(os.path.join(directory, name))
+                      for directory in (card_dir, nuconta_dir) for name in os.listdir(directory))
+    return {
+        'files': months * 2,
+        'transactions': transactions_written,
+        'bytes': total_bytes,
+        'months': months,
+        'transactions_per_month': transactions_per_month,
+        'seed': seed,
+        'overlap_days': overlap_days,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Nubank-style OFX statements.")
+    parser.add_argument("output_dir", type=str, help="Directory that receives credit_card/ and nuconta/.")
+    parser.add_argument("--months", type=int, default=12, help="Number of monthly statements per account. Default is 12.")
+    parser.add_argument("--transactions-per-month", type=int, default=500,
+                        help="Transactions drawn per month across both accounts. Default is 500.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default is 0.")
+    args = parser.parse_args()
+
+    summary = generate_ofx_corpus(args.output_dir, months=args.months,
+                                  transactions_per_month=args.transactions_per_month, seed=args.seed)
+    print(f"Wrote {summary['transactions']} transactions in {summary['files']} files "
+          f"({summary['bytes'] / 1024 / 1024:.1f} MiB) to {args.output_dir}")
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the spending ingestion pipeline on synthetic OFX statements.
+
+Usage: python benchmarks/run_ofx_benchmark.py [--months N] [--transactions-per-month N] [--seed N]
+                                              [--corpus DIR] [--output FILE] [--compare FILE]
+
+Stages measured (wall time, peak traced memory, throughput):
+1. parse            - parse_ofx_files_to_dataframe, with the on-disk parse cache disabled
+2. encoding_repair  - per-file encoding detection and memo repair
+3. categorization   - _categorize_transactions_internal, with the persistent memo cache disabled
+4. db_write         - upsert_ofx_transactions into a fresh SQLite database
+
+Wall times come from a plain run of each stage; peak memory comes from a second run under
+tracemalloc, which would otherwise slow the first one down. Results are written as JSON
+(benchmarks/results/ by default). --compare prints the change against an earlier result
+and flags stages that got more than --threshold slower.
+"""
+
+import argparse
+import contextlib
+import gc
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Add src to path to use the project's modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+import pandas as pd
+
+import backend.spending.ofx_parser as ofx_parser
+from backend.spending.ofx_encoding import detect_ofx_encoding, repair_memos
+from backend.spending.ofx_reader import read_ofx_transaction_columns, UnsupportedOfxError
+from backend.spending.ofx_writer import upsert_ofx_transactions
+from ofx_generator import generate_ofx_corpus
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def _measure(stage_function, measure_memory: bool) -> tuple:
+    """Runs stage_function and returns (its result, wall seconds, peak traced MiB or None)."""
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        result = stage_function()
+        wall_seconds = time.perf_counter() - start_time
+
+        peak_mib = None
+        if measure_memory:
+            gc.collect()
+            tracemalloc.start()
+            stage_function()
+            peak_mib = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+    return result, wall_seconds, peak_mib
+
+
+def _stage_result(wall_seconds: float, peak_mib, transactions: int, input_bytes: int = None) -> dict:
+    result = {
+        'wall_seconds': round(wall_seconds, 6),
+        'peak_memory_mib': round(peak_mib, 3) if peak_mib is not None else None,
+        'transactions': int(transactions),
+        'transactions_per_second': round(transactions / wall_seconds, 1) if wall_seconds > 0 else None,
+    }
+    if input_bytes is not None:
+        result['mib_per_second'] = round(input_bytes / 1024 / 1024 / wall_seconds, 3) if wall_seconds > 0 else None
+    return result
+
+
+def _load_memos(corpus_dir: str) -> list:
+    """Reads every statement's raw memos with the detected encoding, outside the timed stage."""
+    file_memos = []
+    for file_path in sorted(glob.glob(os.path.join(corpus_dir, '*', '*.ofx'))):
+        encoding, _ = detect_ofx_encoding(file_path)
+        try:
+            memos = read_ofx_transaction_columns(file_path, encoding)['memo']
+        except (UnsupportedOfxError, UnicodeDecodeError):
+            memos = []
+        file_memos.append((file_path, memos))
+    return file_memos
+
+
+def _repair_all_encodings(file_memos: list) -> int:
+    """Detects the encoding of every file and repairs its memos; returns the number of memos."""
+    repaired = 0
+    for file_path, memos in file_memos:
+        _, mode = detect_ofx_encoding(file_path)
+        repaired += len(repair_memos(memos, mode))
+    return repaired
+
+
+def _write_to_fresh_db(db_path: str, categorized_df: pd.DataFrame) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return upsert_ofx_transactions(conn, categorized_df, replace_all=True)
+    finally:
+        conn.close()
+
+
+def run_benchmark(corpus_dir: str, measure_memory: bool = True) -> dict:
+    """Runs every stage on the statements in corpus_dir and returns the per-stage results."""
+    ofx_parser.USE_OFX_PARSE_CACHE = False
+    ofx_parser.USE_MEMO_CATEGORY_CACHE = False
+    corpus_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(corpus_dir, '*', '*.ofx')))
+    stages = {}
+
+    print("Stage 1/4: parse...")
+    raw_df, wall_seconds, peak_mib = _measure(lambda: ofx_parser.parse_ofx_files_to_dataframe(corpus_dir), measure_memory)
+    stages['parse'] = _stage_result(wall_seconds, peak_mib, len(raw_df), corpus_bytes)
+
+    print("Stage 2/4: encoding repair...")
+    file_memos = _load_memos(corpus_dir)
+    repaired, wall_seconds, peak_mib = _measure(lambda: _repair_all_encodings(file_memos), measure_memory)
+    stages['encoding_repair'] = _stage_result(wall_seconds, peak_mib, repaired)
+
+    print("Stage 3/4: categorization...")
+    categorized_df, wall_seconds, peak_mib = _measure(
+        lambda: ofx_parser._categorize_transactions_internal(raw_df.copy(), None), measure_memory)
+    stages['categorization'] = _stage_result(wall_seconds, peak_mib, len(categorized_df))
+    stages['categorization']['uncategorized_share'] = round(
+        float((categorized_df[ofx_parser.COLUMN_MAIN_CATEGORY] == 'Não Categorizado').mean()), 4)
+
+    print("Stage 4/4: DB write...")
+    db_dir = tempfile.mkdtemp(prefix='ofx-bench-db-')
+    try:
+        written, wall_seconds, peak_mib = _measure(
+            lambda: _write_to_fresh_db(os.path.join(db_dir, 'bench.db'), categorized_df), measure_memory)
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+    stages['db_write'] = _stage_result(wall_seconds, peak_mib, written)
+    return stages
+
+
+def compare_results(current: dict, baseline: dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> list:
+    """Prints the wall time change of each stage against baseline and returns the regressed stage names."""
+    regressions = []
+    print(f"\nComparison against {baseline.get('version', {}).get('git_commit', '?')} "
+          f"({baseline.get('created_at', '?')}):")
+    if baseline.get('dataset', {}).get('transactions') != current['dataset']['transactions']:
+        print("Warning: the baseline was measured on a different dataset; ratios are not comparable.")
+    for stage, result in current['stages'].items():
+        baseline_stage = baseline.get('stages', {}).get(stage)
+        if not baseline_stage or not baseline_stage.get('wall_seconds'):
+            print(f"  {stage:<16} {result['wall_seconds']:>10.3f}s  (no baseline)")
+            continue
+        ratio = result['wall_seconds'] / baseline_stage['wall_seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(stage)
+        print(f"  {stage:<16} {baseline_stage['wall_seconds']:>10.3f}s -> {result['wall_seconds']:>10.3f}s  "
+              f"x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OFX parsing, encoding repair, categorization and DB write.")
+    parser.add_argument("--months", type=int, default=12, help="Statements per account to generate. Default is 12.")
+    parser.add_argument("--transactions-per-month", type=int, default=2000,
+                        help="Transactions generated per month across both accounts. Default is 2000.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator. Default is 0.")
+    parser.add_argument("--corpus", type=str, default=None,
+                        help="Use the statements already in this directory instead of generating them.")
+    parser.add_argument("--keep-corpus", action="store_true", help="Do not delete the generated statements.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run of each stage.")
+    parser.add_argument("--output", type=str, default=None, help="JSON result file. Default is benchmarks/results/.")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier JSON result to compare against.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f"Slowdown ratio flagged as a regression. Default is {DEFAULT_REGRESSION_THRESHOLD}.")
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus
+    dataset = {'source': corpus_dir}
+    generated_dir = None
+    if corpus_dir is None:
+        generated_dir = tempfile.mkdtemp(prefix='ofx-bench-corpus-')
+        corpus_dir = generated_dir
+        print(f"Generating {args.months} months x {args.transactions_per_month} transactions in {corpus_dir}...")
+        start_time = time.perf_counter()
+        dataset = generate_ofx_corpus(corpus_dir, months=args.months,
+                                      transactions_per_month=args.transactions_per_month, seed=args.seed)
+        dataset['generation_seconds'] = round(time.perf_counter() - start_time, 3)
+        dataset['source'] = 'synthetic'
+    else:
+        ofx_files = glob.glob(os.path.join(corpus_dir, '*', '*.ofx'))
+        dataset.update({'files': len(ofx_files), 'bytes': sum(os.path.getsize(path) for path in ofx_files)})
+
+    try:
+        stages = run_benchmark(corpus_dir, measure_memory=not args.no_memory)
+    finally:
+        if generated_dir and not args.keep_corpus:
+            shutil.rmtree(generated_dir, ignore_errors=True)
+    dataset['transactions'] = stages['parse']['transactions']
+
+    result = {
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'version': {
+            'git_commit': _git_commit(),
+            'ofx_parser_version': ofx_parser.OFX_PARSER_VERSION,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'dataset': dataset,
+        'stages': stages,
+    }
+
+    for stage, stage_result in stages.items():
+        memory = f"{stage_result['peak_memory_mib']:.1f} MiB" if stage_result['peak_memory_mib'] is not None else "n/a"
+        print(f"  {stage:<16} {stage_result['wall_seconds']:>10.3f}s  {stage_result['transactions_per_second'] or 0:>12.0f} txn/s  "
+              f"peak {memory}")
+
+    output_path = args.output
+    if output_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(RESULTS_DIR, f"ofx-{result['version']['git_commit']}-"
+                                                f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(result, json.load(f), args.threshold)
+
+
+if __name__ == "__main__":
+    main()
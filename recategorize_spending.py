@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Recategorizes the transactions already in 'ofx_transactions' after CATEGORIZATION_RULES changes.
+
+Usage: python recategorize_spending.py [--target_db local|remote] [--dry-run]
+
+Only the transactions the rule changes can affect are re-evaluated, from their stored memo,
+and only those whose category changed are updated; no OFX file is parsed.
+"""
+
+import argparse
+import os
+import sys
+
+# Add src to path to use existing connection system
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from backend.spending.recategorization import recategorize_spending
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recategorize stored transactions after the categorization rules change.")
+    parser.add_argument("--target_db", type=str, default="local", choices=["local", "remote"],
+                        help="The target database ('local' for SQLite, 'remote' for MySQL). Default is 'local'.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report how many transactions would change without writing them.")
+    args = parser.parse_args()
+
+    recategorize_spending(target_db=args.target_db, dry_run=args.dry_run)
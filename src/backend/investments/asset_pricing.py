@@ -2,6 +2,8 @@ import yfinance as yf
 import pandas as pd
 from datetime import datetime, date, timedelta
 
+from sql.bulk_load import bulk_load, dataframe_to_rows, ON_CONFLICT_IGNORE
+
 def get_missing_data_ranges(conn):
     """
     Analyze local database to determine what asset price data is missing.
@@ -95,7 +97,7 @@ def update_asset_price(conn):
     
     print(f"\n🔄 Updating {len(tickers_to_update)} tickers...")
     
-    cursor = conn.cursor()
+    new_price_rows = []
     successful_tickers = []
     failed_tickers = []
 
@@ -146,19 +148,9 @@ def update_asset_price(conn):
                 successful_tickers.append(ticker)
                 continue
             
-            values = [tuple(x) for x in df.to_records(index=False)]
-            
-            print(f"💾 Inserting {len(values)} new price records for {ticker}...")
-            cursor.executemany(
-                """
-                INSERT OR IGNORE INTO asset_price(ticker, quote_date, open_price, close_price)
-                VALUES (?, ?, ?, ?)
-                """,
-                values
-            )
-            
-            rows_affected = cursor.rowcount if cursor.rowcount != -1 else len(values)
-            print(f"✅ Successfully added {rows_affected} new records for {ticker}")
+            values = dataframe_to_rows(df)
+            print(f"📥 Fetched {len(values)} new price records for {ticker}")
+            new_price_rows.extend(values)
             successful_tickers.append(ticker)
             
         except Exception as yf_error:
@@ -185,8 +177,9 @@ def update_asset_price(conn):
                 print(f"❌ Failed to download data for {ticker}: {error_msg}")
                 failed_tickers.append((ticker, f"Download error: {error_msg}"))
     
-    print("\n💾 Committing changes to database...")
-    conn.commit()
+    print(f"\n💾 Inserting {len(new_price_rows)} new price records and committing...")
+    bulk_load(conn, "asset_price", ["ticker", "quote_date", "open_price", "close_price"], new_price_rows,
+              on_conflict=ON_CONFLICT_IGNORE)
     
     # Summary report
     print("\n" + "="*60)
@@ -0,0 +1,121 @@
+'''
+Prefix-product valuation of fixed income lots (everything but Tesouro Selic).
+
+A lot earns, on every day of its index series from its purchase through its due date,
+the daily rate (1 + pre_rate)^(1/252) - 1 + post_rate * (factor - 1) + 1. Every lot with
+the same (financial_index, post_rate, pre_rate) therefore shares one cumulative curve C,
+the cumulative product of that rate, and a lot entering on day s is worth
+value * C[t] / C[s - 1] on day t. FactorCurves builds each curve once; value_lots sums the
+lots of a series with difference arrays (each lot adds value / C[s - 1] from its first day
+to its due date), so a series costs O(lots + days) array operations whatever the number
+of lots.
+
+IPCA is published monthly as a percentage: it is spread over the CDI days of each month as
+1 + ipca / 100 / 21.
+'''
+import itertools
+
+import numpy as np
+
+IPCA_BUSINESS_DAYS_PER_MONTH = 21
+BUSINESS_DAYS_PER_YEAR = 252
+
+
+def _as_days(dates) -> np.ndarray:
+    return np.array([str(value)[:10] for value in dates], dtype='datetime64[D]')
+
+
+def daily_index_factors(index_rows: list) -> dict:
+    """
+    Turns index_series rows (financial_index, date, factor), sorted by index and date, into
+    {financial_index: (days, daily factors)}. IPCA takes the days of the CDI series from
+    its first month on, each with the daily factor of the last month started.
+    """
+    series = {}
+    for financial_index, rows in itertools.groupby(index_rows, key=lambda row: row[0]):
+        _, dates, factors = zip(*rows)
+        series[financial_index] = (_as_days(dates), np.array(factors, dtype=float))
+    if 'ipca' in series:
+        ipca_months, ipca_rates = series.pop('ipca')
+        cdi_days = series.get('cdi', (np.empty(0, dtype='datetime64[D]'), None))[0]
+        days = cdi_days[cdi_days >= ipca_months[0]]
+        month_positions = np.searchsorted(ipca_months, days, side='right') - 1
+        series['ipca'] = (days, 1 + ipca_rates[month_positions] / 100 / IPCA_BUSINESS_DAYS_PER_MONTH)
+    return series
+
+
+class FactorCurves:
+    """The cumulative daily rate curves of the index series, built on first use and kept."""
+
+    def __init__(self, index_factors: dict):
+        self.index_factors = index_factors
+        self._curves = {}
+
+    def get(self, financial_index: str, post_rate: float, pre_rate: float):
+        """Returns (days, cumulative rate) for the combination, or None if the index has no series."""
+        key = (financial_index, post_rate, pre_rate)
+        if key not in self._curves:
+            if financial_index not in self.index_factors:
+                self._curves[key] = None
+            else:
+                days, factors = self.index_factors[financial_index]
+                daily_rates = (1.0 + pre_rate) ** (1.0 / BUSINESS_DAYS_PER_YEAR) - 1 + (post_rate * (factors - 1) + 1)
+                self._curves[key] = (days, np.cumprod(daily_rates))
+        return self._curves[key]
+
+
+def value_lots(curves: FactorCurves, lots: list, due_date, days: np.ndarray) -> tuple:
+    """
+    Values the lots of one series (an asset and due date) on the given calendar days (sorted
+    datetime64[D]); each day takes the values of the last index day on or before it. lots
+    are (purchase_date, financial_index, value, pre_rate, post_rate, is_pgbl, tax_rate) tuples.
+
+    Returns (first index day any lot is valued on, or None; deposit values; gross values;
+    tax values, each lot being taxed at its own rate on its gain, or on its whole value if
+    it is PGBL).
+    """
+    deposit_values = np.zeros(len(days))
+    gross_values = np.zeros(len(days))
+    tax_values = np.zeros(len(days))
+    first_day = None
+    due_day = np.datetime64(str(due_date)[:10], 'D')
+    curve_groups = {}
+    for purchase_date, financial_index, value, pre_rate, post_rate, is_pgbl, tax_rate in lots:
+        curve_groups.setdefault((financial_index, post_rate, pre_rate), []).append(
+            (purchase_date, value, bool(is_pgbl), tax_rate))
+
+    for (financial_index, post_rate, pre_rate), curve_lots in curve_groups.items():
+        curve = curves.get(financial_index, post_rate, pre_rate)
+        if curve is None:
+            continue
+        curve_days, cumulative = curve
+        starts = np.searchsorted(curve_days, _as_days([lot[0] for lot in curve_lots]))
+        end = np.searchsorted(curve_days, due_day, side='right')
+        valued = starts < end
+        if not valued.any():
+            continue
+        starts = starts[valued]
+        values = np.array([lot[1] for lot in curve_lots], dtype=float)[valued]
+        is_pgbl = np.array([lot[2] for lot in curve_lots], dtype=bool)[valued]
+        tax_rates = np.array([lot[3] for lot in curve_lots], dtype=float)[valued]
+        window_start = starts.min()
+        first_day = curve_days[window_start] if first_day is None else min(first_day, curve_days[window_start])
+
+        # Every lot of the series is valued from its first index day through the due date:
+        # its value / C[s - 1] joins the running sum at its start and stays to the end
+        window = slice(window_start, end)
+        window_size = end - window_start
+        lot_positions = starts - window_start
+        weights = values / np.where(starts > 0, cumulative[starts - 1], 1.0)
+        gross = cumulative[window] * np.bincount(lot_positions, weights=weights, minlength=window_size).cumsum()
+        deposits = np.bincount(lot_positions, weights=values, minlength=window_size).cumsum()
+        # Regular lots are taxed on their gain, PGBL ones on their whole value
+        tax = (cumulative[window] * np.bincount(lot_positions, weights=weights * tax_rates, minlength=window_size).cumsum()
+               - np.bincount(lot_positions, weights=np.where(is_pgbl, 0.0, values) * tax_rates, minlength=window_size).cumsum())
+
+        positions = np.searchsorted(curve_days[window], days, side='right') - 1
+        covered = positions >= 0
+        deposit_values[covered] += deposits[positions[covered]]
+        gross_values[covered] += gross[positions[covered]]
+        tax_values[covered] += tax[positions[covered]]
+    return first_day, deposit_values, gross_values, tax_values
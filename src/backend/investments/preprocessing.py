@@ -1,9 +1,38 @@
-from datetime import datetime, timedelta
+'''
+Builds the derived investment tables from the raw ones.
+
+Every derived table is keyed by an asset (or is global) and by date, and a row only
+depends on source rows of the same asset on or before its date (its month, for the
+monthly tables). preprocess_data therefore works from "dirty" maps, {asset: first date
+to recompute}: each stage deletes and recomputes only the rows of the listed assets on
+or after their date, and returns the dirty map of its own output for the stages that
+read it. The maps start from the source changes found by source_changes.py; a full
+rebuild is the same code run with every asset dirty from MIN_DATE.
+'''
+import contextlib
+import itertools
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
 
 from .constants import NU_PRICES
+from .fixed_income_valuation import FactorCurves, daily_index_factors, value_lots
+from .source_changes import (clear_source_digests, detect_source_changes, load_built_tables, save_built_tables,
+                             save_source_digests)
+from .stage_scheduler import PipelineStage, run_stages
+from .tesouro_selic import tesouro_selic_daily_balances
+from sql.bulk_load import bulk_load, is_sqlite, ON_CONFLICT_IGNORE
 
+MIN_DATE = '0001-01-01'
+DIRTY_KEYS_TABLE = 'preprocess_dirty_keys'
+STAGED_ROWS_TABLE = 'preprocess_staged_rows'
+# A stage waiting for another's write lock waits up to this long
+SQLITE_BUSY_TIMEOUT_SECONDS = 300
 
-def _prepare_date_dimension_and_nu_prices(cursor):
+
+def _prepare_date_dimension_and_nu_prices(conn):
     print("Defining date range for 'dates' table (2018-01-01 to today)...")
     start_date_obj = datetime(2018, 1, 1)
     end_date_obj = datetime.today()
@@ -16,56 +45,178 @@ def _prepare_date_dimension_and_nu_prices(cursor):
     print(f"Created date list with {len(date_list)} dates.")
 
     print(f"Inserting {len(NU_PRICES)} NU price records into asset_price...")
-    cursor.executemany(
-        """
-        INSERT OR IGNORE INTO asset_price(ticker, quote_date, open_price, close_price)
-        VALUES(?, ?, ?, ?)
-        """, NU_PRICES)
-    print(f"Processed {cursor.rowcount if cursor.rowcount != -1 else len(NU_PRICES)} NU price records.")
+    bulk_load(conn, "asset_price", ["ticker", "quote_date", "open_price", "close_price"], NU_PRICES,
+              on_conflict=ON_CONFLICT_IGNORE, commit=False)
 
     print(f"Inserting {len(date_list)} records into 'dates' table...")
-    cursor.executemany(
-        "INSERT OR IGNORE INTO dates(date) VALUES(?)",
-        date_list
-    )
-    print(f"Processed {cursor.rowcount if cursor.rowcount != -1 else len(date_list)} records for 'dates' table.")
+    bulk_load(conn, "dates", ["date"], date_list, on_conflict=ON_CONFLICT_IGNORE, commit=False)
 
 
-def _populate_daily_asset_price(cursor):
-    print("Deleting from daily_asset_price...")
-    cursor.execute("DELETE FROM daily_asset_price")
-    print("Populating daily_asset_price...")
-    cursor.execute(
-        """
-        INSERT OR IGNORE INTO daily_asset_price(ticker, date, price)
-        WITH date_range AS
-        (
-            SELECT
-                ticker,
-                quote_date,
-                LEAD(quote_date) OVER(PARTITION BY ticker ORDER BY quote_date) as next_date,
-                close_price
-            FROM asset_price ap
-        )
-        SELECT
-            ticker,
-            COALESCE(d.date, quote_date) as date,
-            close_price as price
-        FROM date_range dr
-        LEFT JOIN dates d
-        ON d.date >= dr.quote_date AND d.date < dr.next_date
-        """
-    )
-    print(f"Populated daily_asset_price. Rows affected: {cursor.rowcount}")
+def _merge_dirty(*dirty_maps) -> dict:
+    """Combines dirty maps, keeping the earliest date of each key. None (everything dirty) wins."""
+    merged = {}
+    for dirty in dirty_maps:
+        if dirty is None:
+            return None
+        for key, from_date in dirty.items():
+            if key not in merged or from_date < merged[key]:
+                merged[key] = from_date
+    return merged
 
 
-def _populate_variable_income_daily_balance(cursor):
-    print("Deleting from variable_income_daily_balance...")
-    cursor.execute("DELETE FROM variable_income_daily_balance")
-    print("Populating variable_income_daily_balance...")
-    cursor.execute(
-        """
-        INSERT INTO variable_income_daily_balance
+def _spread(keys, from_date) -> dict:
+    """Marks every key dirty from from_date; nothing when from_date is None."""
+    return {} if from_date is None else {key: from_date for key in keys}
+
+
+def _distinct(cursor, query: str) -> list:
+    cursor.execute(query)
+    return [row[0] for row in cursor.fetchall() if row[0] is not None]
+
+
+def _max_date(cursor, table: str):
+    cursor.execute(f"SELECT MAX(date) FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def _month_before(from_date: str) -> str:
+    """First day of the month before the one of from_date ('YYYY-MM-DD')."""
+    if from_date <= MIN_DATE:
+        return MIN_DATE
+    first_of_month = date.fromisoformat(from_date[:10]).replace(day=1)
+    return (first_of_month - timedelta(days=1)).replace(day=1).isoformat()
+
+
+def _set_dirty_keys(cursor, dirty: dict):
+    """Loads dirty into the temporary table the stage queries join on (key, from_date)."""
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {DIRTY_KEYS_TABLE} (key VARCHAR(100) PRIMARY KEY, from_date DATE)")
+    cursor.execute(f"DELETE FROM {DIRTY_KEYS_TABLE}")
+    cursor.executemany(f"INSERT INTO {DIRTY_KEYS_TABLE} VALUES (?, ?)", sorted(dirty.items()))
+
+
+def _dirty_rows_condition(table: str, key_column: str, date_expression: str) -> str:
+    """WHERE condition matching the rows of table on or after the from_date of their dirty key."""
+    return (f"EXISTS (SELECT 1 FROM {DIRTY_KEYS_TABLE} k "
+            f"WHERE k.key = {table}.{key_column} AND {date_expression} >= k.from_date)")
+
+
+def _is_autocommit(conn) -> bool:
+    return conn.isolation_level is None if is_sqlite(conn) else conn.autocommit
+
+
+@contextlib.contextmanager
+def _write_transaction(conn):
+    """
+    On an autocommit connection (a stage run in parallel) runs the block in a transaction
+    of its own, taking SQLite's write lock up front; otherwise the block joins the
+    caller's transaction.
+    """
+    if not _is_autocommit(conn):
+        yield
+        return
+    conn.cursor().execute("BEGIN IMMEDIATE" if is_sqlite(conn) else "START TRANSACTION")
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _replace_rows(conn, table: str, delete_condition: str, select_sql: str, params: tuple = (),
+                  insert_sql: str = None) -> int:
+    """
+    Deletes the rows of table matching delete_condition and inserts the rows of select_sql
+    (params are bound to both). The new rows are computed into a temporary table first, so
+    the write lock is only held while they are swapped in. Returns the inserted row count.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGED_ROWS_TABLE}")
+    cursor.execute(f"CREATE TEMP TABLE {STAGED_ROWS_TABLE} AS {select_sql}", params)
+    with _write_transaction(conn):
+        cursor.execute(f"DELETE FROM {table} WHERE {delete_condition}", params)
+        print(f"Deleted {cursor.rowcount} rows from {table}.")
+        cursor.execute(f"{insert_sql or f'INSERT INTO {table}'} SELECT * FROM {STAGED_ROWS_TABLE}")
+        inserted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {STAGED_ROWS_TABLE}")
+    return inserted
+
+
+def _forward_fill_prices(quote_dates: tuple, prices: tuple, last_day) -> tuple:
+    """
+    As-of fill of one ticker's quotes (sorted by date): every calendar day from the first
+    quote through last_day (or the last quote, if later) gets the price of the last quote
+    on or before it. Returns (days as 'YYYY-MM-DD', prices).
+    """
+    quote_days = np.array([str(quote_date)[:10] for quote_date in quote_dates], dtype='datetime64[D]')
+    end_day = quote_days[-1] if last_day is None else max(quote_days[-1], np.datetime64(str(last_day)[:10], 'D'))
+    days = np.arange(quote_days[0], end_day + 1)
+    day_prices = np.array(prices, dtype=float)[np.searchsorted(quote_days, days, side='right') - 1]
+    return days.astype(str), day_prices
+
+
+def _populate_daily_asset_price(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, "SELECT ticker FROM asset_price UNION SELECT ticker FROM daily_asset_price"),
+                        MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    # The days after the previous quote are filled with it up to the next one, so they change too
+    cursor.execute(f"""
+        SELECT k.key, k.from_date, (SELECT MAX(p.quote_date) FROM asset_price p WHERE p.ticker = k.key AND p.quote_date < k.from_date)
+        FROM {DIRTY_KEYS_TABLE} k
+    """)
+    dirty = {ticker: previous_quote_date or from_date for ticker, from_date, previous_quote_date in cursor.fetchall()}
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating daily_asset_price for {len(dirty)} tickers...")
+    cursor.execute(f"""
+        SELECT ap.ticker, ap.quote_date, ap.close_price
+        FROM asset_price ap
+        INNER JOIN {DIRTY_KEYS_TABLE} k
+        ON k.key = ap.ticker AND ap.quote_date >= k.from_date
+        ORDER BY ap.ticker, ap.quote_date
+    """)
+    quotes = cursor.fetchall()
+    last_day = _max_date(cursor, "dates")
+    price_rows = []
+    for ticker, ticker_quotes in itertools.groupby(quotes, key=lambda quote: quote[0]):
+        _, quote_dates, prices = zip(*ticker_quotes)
+        days, day_prices = _forward_fill_prices(quote_dates, prices, last_day)
+        price_rows.extend(zip(itertools.repeat(ticker), days.tolist(), day_prices.tolist()))
+
+    with _write_transaction(conn):
+        cursor.execute("DELETE FROM daily_asset_price WHERE " + _dirty_rows_condition(
+            "daily_asset_price", "ticker", "daily_asset_price.date"))
+        print(f"Deleted {cursor.rowcount} rows from daily_asset_price.")
+        rows = bulk_load(conn, "daily_asset_price", ["ticker", "date", "price"], price_rows, commit=False)
+    print(f"Populated daily_asset_price. Rows affected: {rows}")
+    return dirty
+
+
+def _populate_variable_income_daily_balance(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, "SELECT ticker FROM variable_income_operations "
+                                          "UNION SELECT ticker FROM variable_income_daily_balance"), MIN_DATE)
+    else:
+        # The currency of a ticker applies to all its rows, so a change rebuilds them all
+        dirty = _merge_dirty(dirty, _spread(_distinct(cursor, """
+            SELECT DISTINCT v.ticker
+            FROM variable_income_daily_balance v
+            INNER JOIN (SELECT ticker, MAX(currency) AS currency FROM variable_income_operations GROUP BY ticker) c
+            ON c.ticker = v.ticker
+            WHERE v.currency IS NOT c.currency
+        """), MIN_DATE))
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating variable_income_daily_balance for {len(dirty)} tickers...")
+    rows = _replace_rows(
+        conn, "variable_income_daily_balance",
+        _dirty_rows_condition("variable_income_daily_balance", "ticker", "variable_income_daily_balance.date"),
+        f"""
         WITH dolar AS(
             SELECT date, price as dolar_price
             FROM daily_asset_price
@@ -77,7 +228,7 @@ def _populate_variable_income_daily_balance(cursor):
             GROUP BY ticker
         ),
         operation AS (
-            SELECT 	
+            SELECT
                 ticker,
                 currency,
                 operation_date,
@@ -86,22 +237,34 @@ def _populate_variable_income_daily_balance(cursor):
             FROM variable_income_operations o
             GROUP BY ticker, currency, operation_date, operation_type
         ),
+        opening AS (
+            -- Amount held before from_date: the operations on priced days before it
+            SELECT k.key AS ticker, k.from_date, COALESCE(SUM(o.amount), 0) AS amount
+            FROM {DIRTY_KEYS_TABLE} k
+            LEFT JOIN daily_asset_price p
+            ON p.ticker = k.key AND p.date < k.from_date
+            LEFT JOIN operation o
+            ON p.ticker = o.ticker AND p.date = o.operation_date
+            GROUP BY k.key, k.from_date
+        ),
         balance AS (
             SELECT
                 p.ticker,
                 p.date,
                 p.price,
                 d.dolar_price,
-                c.currency, 
+                c.currency,
                 o.amount as amount_change,
-                SUM(COALESCE(o.amount, 0)) OVER(PARTITION BY p.ticker ORDER BY p.date) AS amount
+                op.amount + SUM(COALESCE(o.amount, 0)) OVER(PARTITION BY p.ticker ORDER BY p.date) AS amount
             FROM daily_asset_price p
+            INNER JOIN opening op
+            ON op.ticker = p.ticker AND p.date >= op.from_date
             LEFT JOIN operation o
             ON p.ticker = o.ticker AND p.date = o.operation_date
             LEFT JOIN dolar d
             ON d.date = p.date
             INNER JOIN currency c
-            ON c.ticker = p.ticker 
+            ON c.ticker = p.ticker
         )
         SELECT
             b.ticker,
@@ -113,201 +276,178 @@ def _populate_variable_income_daily_balance(cursor):
             b.amount,
             CASE WHEN b.currency = "dolar" THEN (b.price * b.dolar_price) * b.amount ELSE b.price * b.amount END as value
         FROM balance b
-        WHERE b.amount <> 0;
+        WHERE b.amount <> 0
         """
     )
-    print(f"Populated variable_income_daily_balance. Rows affected: {cursor.rowcount}")
+    print(f"Populated variable_income_daily_balance. Rows affected: {rows}")
+    return dirty
 
 
-def _populate_fixed_income_non_tesouro_selic(cursor):
-    print("Deleting from fixed_income_daily_balance (this step only handles non-Tesouro Selic)...")
-    # Note: This deletion might be too broad if _process_tesouro_selic_operations appends.
-    # Consider if Tesouro Selic data should be deleted here or specifically before its insertion.
-    # For now, assuming this is the primary population step for the table before Tesouro Selic.
-    cursor.execute("DELETE FROM fixed_income_daily_balance")
-    print("Populating fixed_income_daily_balance (Part 1: Non-Tesouro Selic)...")
-    cursor.execute(
-        """
-         INSERT INTO fixed_income_daily_balance
-         WITH base_ipca AS(
-                SELECT 
-                    financial_index,
-                    date,
-                    COALESCE(lead(date) OVER (PARTITION BY financial_index ORDER BY date), "2099-01-01") AS next_date,
-                factor
-            FROM index_series
-            WHERE financial_index = "ipca"
-        ), daily_indexes AS(
-            SELECT 
-                ipca.financial_index,
-                i.date,
-                1 + ipca.factor/100/21 AS factor
-            FROM index_series i
-            INNER JOIN base_ipca ipca
-            ON i.date >= ipca.date and i.date < ipca.next_date
-            WHERE i.financial_index = "cdi"
-            UNION
-            SELECT financial_index, date, factor
-            FROM index_series 
-            WHERE financial_index <> "ipca"
-        ), daily_rates AS (
-            SELECT 
-                i.date,
-                i.factor,
-                op.asset,
-                op.purchase_date,
-                op.value,
-                op.pre_rate,
-                op.post_rate,
-                op.due_date,
-                op.tax_rate,
-                op.is_pgbl,
-                pow((1.0 + pre_rate),(1.0/252)) -1 as daily_pre_rate,
-                (op.post_rate * (i.factor - 1) + 1) as daily_post_rate,
-                pow((1.0 + pre_rate),(1.0/252)) -1 + (op.post_rate * (i.factor - 1) + 1) as total_daily_rate,
-                EXP(SUM(LN(pow((1.0 + pre_rate),(1.0/252)) -1  + (op.post_rate * (i.factor - 1) + 1))) OVER (PARTITION BY op.asset, op.purchase_date ORDER BY i.date)) AS cumulative_daily_rate
-            FROM fixed_income_operations op
-            INNER JOIN daily_indexes i
-            ON op.financial_index = i.financial_index
-            AND i.date BETWEEN op.purchase_date AND op.due_date
-            WHERE op.asset NOT LIKE "%Tesouro Selic%"
-        ), grouped AS (
-            SELECT 
-                asset,
-                due_date,
-                date,
-                tax_rate,
-                SUM(value) as deposit_value,
-                SUM(cumulative_daily_rate * value) AS gross_value,
-                SUM(CASE WHEN is_pgbl THEN cumulative_daily_rate * value * tax_rate ELSE (cumulative_daily_rate * value - value) * tax_rate END) AS tax_value,
-                SUM(cumulative_daily_rate * value - CASE WHEN is_pgbl THEN cumulative_daily_rate * value * tax_rate ELSE (cumulative_daily_rate * value - value) * tax_rate END) AS net_value
-            FROM daily_rates
-            GROUP BY asset, date, due_date, tax_rate
-        ), values_range AS(
-             SELECT 
-                asset,
-                due_date,
-                date,
-                COALESCE (lead(date) OVER (PARTITION BY asset ORDER BY date), due_date) next_date,
-                tax_rate,
-                deposit_value,
-                gross_value,
-                tax_value,
-                net_value
-            FROM grouped
-        )
-        SELECT r.asset, r.due_date, d.date, r.tax_rate, r.deposit_value, r.gross_value, r.tax_value, r.net_value
-        FROM dates d
-        INNER JOIN values_range r
-        ON d.date >= r.date and d.date < next_date 
-        ORDER BY d.date DESC
-        """
-    )
-    print(f"Populated fixed_income_daily_balance (Part 1). Rows affected: {cursor.rowcount}")
+def _is_tesouro_selic(asset: str) -> bool:
+    """Mirrors the SQL filter asset LIKE "%Tesouro Selic%" (case-insensitive for ASCII in SQLite)."""
+    return 'tesouro selic' in asset.lower()
 
 
-def _process_tesouro_selic_operations(cursor):
-    print("Fetching Tesouro Selic operations for manual processing...")
-    cursor.execute("""
-        WITH operations AS (
-            SELECT
-                asset,
-                purchase_date,
-                due_date,
-                COALESCE (lead(purchase_date) OVER (PARTITION BY asset ORDER BY purchase_date), due_date) AS next_date,
-                CASE operation_type WHEN "buy" THEN quotas ELSE quotas * -1 END quotas,
-                CASE operation_type WHEN "buy" THEN value ELSE value * -1 END value
-            FROM fixed_income_operations
-            WHERE asset like "%Tesouro Selic%"
-        )
-        SELECT asset, i.date, due_date, i.factor, quotas, value
-        FROM index_series i
-        INNER JOIN operations o
-        ON i.date >= o.purchase_date and i.date < o.next_date 
-        WHERE i.financial_index = "cdi"
-        ORDER BY asset, i.date
+def _series_tax_rate(lots: list) -> float:
+    """The tax rate of a series' lots, or their deposit-weighted mean rate when they differ."""
+    tax_rates = [lot[-1] for lot in lots]
+    deposits = [abs(lot[2]) for lot in lots]
+    if len(set(tax_rates)) == 1 or not any(deposits):
+        return tax_rates[0]
+    return float(np.average(tax_rates, weights=deposits))
+
+
+def _populate_fixed_income_non_tesouro_selic(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        # This step only handles non-Tesouro Selic; those rows are written by _process_tesouro_selic_operations
+        dirty = _spread(_distinct(cursor, 'SELECT asset FROM fixed_income_operations WHERE asset NOT LIKE "%Tesouro Selic%" '
+                                          'UNION SELECT asset FROM fixed_income_daily_balance '
+                                          'WHERE asset NOT LIKE "%Tesouro Selic%"'), MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating fixed_income_daily_balance (Part 1: Non-Tesouro Selic) for {len(dirty)} assets...")
+    cursor.execute(f"""
+        SELECT asset, due_date, purchase_date, financial_index, value, pre_rate, post_rate, is_pgbl, tax_rate
+        FROM fixed_income_operations
+        WHERE asset NOT LIKE "%Tesouro Selic%"
+        AND asset IN (SELECT key FROM {DIRTY_KEYS_TABLE})
+        ORDER BY asset, due_date
     """)
-    all_rows = cursor.fetchall()
-    print(f"Fetched {len(all_rows)} rows for Tesouro Selic processing.")
+    operations = cursor.fetchall()
+    cursor.execute("SELECT financial_index, date, factor FROM index_series ORDER BY financial_index, date")
+    curves = FactorCurves(daily_index_factors(cursor.fetchall()))
+    cursor.execute("SELECT date FROM dates WHERE date >= ? ORDER BY date", (min(dirty.values()),))
+    calendar_days = np.array([str(day)[:10] for day, in cursor.fetchall()], dtype='datetime64[D]')
+
+    balance_rows = []
+    # One row per (asset, due_date, date), the primary key: lots with different tax rates
+    # are each taxed at their own rate
+    for (asset, due_date), series_operations in itertools.groupby(operations, key=lambda operation: operation[:2]):
+        lots = [operation[2:] for operation in series_operations]
+        tax_rate = _series_tax_rate(lots)
+        # Each index day's values hold until the next one, the last until the due date
+        days = calendar_days[(calendar_days >= np.datetime64(dirty[asset][:10], 'D'))
+                             & (calendar_days < np.datetime64(str(due_date)[:10], 'D'))]
+        first_day, deposit_values, gross_values, tax_values = value_lots(curves, lots, due_date, days)
+        if first_day is None:
+            continue
+        valued = days >= first_day
+        gross_values = gross_values[valued]
+        tax_values = tax_values[valued]
+        balance_rows.extend(zip(
+            itertools.repeat(asset), itertools.repeat(due_date), days[valued].astype(str).tolist(),
+            itertools.repeat(tax_rate), deposit_values[valued].tolist(), gross_values.tolist(), tax_values.tolist(),
+            (gross_values - tax_values).tolist()))
+
+    with _write_transaction(conn):
+        cursor.execute("DELETE FROM fixed_income_daily_balance WHERE " + _dirty_rows_condition(
+            "fixed_income_daily_balance", "asset", "fixed_income_daily_balance.date"))
+        print(f"Deleted {cursor.rowcount} rows from fixed_income_daily_balance.")
+        rows = bulk_load(conn, "fixed_income_daily_balance",
+                         ["asset", "due_date", "date", "tax_rate", "deposit_value", "gross_value", "tax_value", "net_value"],
+                         balance_rows, commit=False)
+    print(f"Populated fixed_income_daily_balance (Part 1). Rows affected: {rows}")
+    return dirty
+
+
+def _process_tesouro_selic_operations(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, 'SELECT asset FROM fixed_income_operations WHERE asset LIKE "%Tesouro Selic%" '
+                                          'UNION SELECT asset FROM fixed_income_daily_balance '
+                                          'WHERE asset LIKE "%Tesouro Selic%"'), MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Fetching Tesouro Selic operations of {len(dirty)} assets...")
+    cursor.execute(f"""
+        SELECT
+            asset,
+            purchase_date,
+            due_date,
+            CASE operation_type WHEN "buy" THEN quotas ELSE quotas * -1 END quotas,
+            CASE operation_type WHEN "buy" THEN value ELSE value * -1 END value
+        FROM fixed_income_operations
+        WHERE asset like "%Tesouro Selic%"
+        AND asset IN (SELECT key FROM {DIRTY_KEYS_TABLE})
+        ORDER BY asset, purchase_date
+    """)
+    operations = cursor.fetchall()
+    cursor.execute('SELECT date, factor FROM index_series WHERE financial_index = "cdi" ORDER BY date')
+    cdi_rows = cursor.fetchall()
+    cdi_dates = np.array([cdi_date for cdi_date, _ in cdi_rows], dtype=object)
+    cdi_text_dates = cdi_dates.astype(str)
+    cdi_factors = np.array([factor for _, factor in cdi_rows], dtype=float)
+    print(f"Fetched {len(operations)} operations and {len(cdi_dates)} CDI factors for Tesouro Selic processing.")
 
-    previous_asset = ""
-    quota_balance = 0
-    balance = 0
     compound_values = []
-    previous_purchase_value = 0
-    print("Processing Tesouro Selic data to calculate compounded values...")
-    for i, (asset, date_val, due_date_val, factor, quota, value) in enumerate(all_rows):
-        if asset != previous_asset:
-            previous_asset = asset
-            quota_balance = quota
-            balance = value
-            previous_purchase_value = value
-        else:
-            if previous_purchase_value != value:
-                balance = balance + value
-                previous_purchase_value = value
-                quota_balance += quota
-
-            if quota_balance > 0:
-                new_balance = balance * factor
-                balance = new_balance
-            else:
-                balance = 0
-
-        if (balance > 0):
-            compound_values.append(
-                (previous_asset, due_date_val, date_val, 0.0, previous_purchase_value, balance, 0, balance))
+    for asset, asset_operations in itertools.groupby(operations, key=lambda operation: operation[0]):
+        positions, due_dates, deposit_values, balances = tesouro_selic_daily_balances(
+            cdi_text_dates, cdi_factors, [operation[1:] for operation in asset_operations])
+        # Earlier days are still computed; they were needed only to carry the balance
+        stored = cdi_text_dates[positions] >= dirty[asset]
+        compound_values.extend(zip(
+            itertools.repeat(asset), due_dates[stored].tolist(), cdi_dates[positions[stored]].tolist(),
+            itertools.repeat(0.0), deposit_values[stored].tolist(), balances[stored].tolist(), itertools.repeat(0),
+            balances[stored].tolist()))
     print(f"Finished processing Tesouro Selic data. {len(compound_values)} compounded values to insert.")
 
-    if compound_values:
-        print("Inserting compounded Tesouro Selic values into fixed_income_daily_balance...")
-        # This appends to fixed_income_daily_balance. Ensure previous step doesn't conflict.
-        cursor.executemany(
-            """
-            INSERT INTO fixed_income_daily_balance(asset, due_date, date, tax_rate, deposit_value, gross_value, tax_value, net_value)
-            VALUES(?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            compound_values
-        )
-        print(
-            f"Inserted {cursor.rowcount if cursor.rowcount != -1 else len(compound_values)} Tesouro Selic compounded records.")
-    else:
-        print("No Tesouro Selic compounded values to insert.")
+    with _write_transaction(conn):
+        cursor.execute("DELETE FROM fixed_income_daily_balance WHERE " + _dirty_rows_condition(
+            "fixed_income_daily_balance", "asset", "fixed_income_daily_balance.date"))
+        print(f"Deleted {cursor.rowcount} rows from fixed_income_daily_balance.")
+        if compound_values:
+            print("Inserting compounded Tesouro Selic values into fixed_income_daily_balance...")
+            bulk_load(conn, "fixed_income_daily_balance",
+                      ["asset", "due_date", "date", "tax_rate", "deposit_value", "gross_value", "tax_value", "net_value"],
+                      compound_values, commit=False)
+        else:
+            print("No Tesouro Selic compounded values to insert.")
+    return dirty
 
 
-def _populate_fgts_daily_balance(cursor):
-    print("Deleting from fgts_daily_balance...")
-    cursor.execute("DELETE FROM fgts_daily_balance")
-    print("Populating fgts_daily_balance...")
-    cursor.execute("""
-    INSERT INTO fgts_daily_balance
+def _populate_fgts_daily_balance(conn, since: str = MIN_DATE) -> str:
+    """Recomputes the days on or after since (every day by default); None skips the stage."""
+    if since is None:
+        return since
+    print(f"Populating fgts_daily_balance (from {since})...")
+    rows = _replace_rows(conn, "fgts_daily_balance", "date >= ?", """
     WITH fgts_by_company AS(
         SELECT strftime('%Y', date) as year, strftime('%m', date) as month, company, max(balance) as balance
-        FROM fgts_operations    
+        FROM fgts_operations
         GROUP BY strftime('%Y', date), strftime('%m', date), company
      ), fgts_by_date AS (
         SELECT date(year || '-' || printf('%02d', month) || '-01') AS date, sum(balance) as balance, count(*) as companies
-        FROM fgts_by_company    
+        FROM fgts_by_company
         GROUP BY date
         HAVING count(*) > 1
     ), fgts_range AS (
         SELECT date, COALESCE(LEAD(date) OVER (ORDER BY date), "2099-01-01") as next_date, balance
-        FROM fgts_by_date 
+        FROM fgts_by_date
     )
     SELECT d.date, f.balance
     FROM dates d
     INNER JOIN fgts_range f
     ON d.date >= f.date and d.date < f.next_date
-""")
-    print(f"Populated fgts_daily_balance. Rows affected: {cursor.rowcount}")
+    WHERE d.date >= ?
+""", (since,))
+    print(f"Populated fgts_daily_balance. Rows affected: {rows}")
+    return since
 
 
-def _populate_daily_balance_summary(cursor):
-    print("Deleting from daily_balance...")
-    cursor.execute("DELETE FROM daily_balance")
-    print("Populating daily_balance...")
-    cursor.execute("""
-    INSERT INTO daily_balance
+def _populate_daily_balance_summary(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, "SELECT ticker FROM variable_income_daily_balance "
+                                          "UNION SELECT asset FROM fixed_income_daily_balance "
+                                          "UNION SELECT asset FROM daily_balance"), MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating daily_balance for {len(dirty)} assets...")
+    rows = _replace_rows(conn, "daily_balance", _dirty_rows_condition("daily_balance", "asset", "daily_balance.date"), f"""
     WITH daily_balances_cte AS
     (
         SELECT
@@ -315,29 +455,41 @@ def _populate_daily_balance_summary(cursor):
             date,
             value,
             'equity' as type
-        FROM variable_income_daily_balance
+        FROM variable_income_daily_balance v
+        INNER JOIN {DIRTY_KEYS_TABLE} k
+        ON k.key = v.ticker AND v.date >= k.from_date
         WHERE date <= (SELECT max(date) FROM fixed_income_daily_balance)
         UNION
+        -- An asset holds one series per due date: its balance is their sum
         SELECT
             asset as ticker,
             date,
-            net_value as value,
+            SUM(net_value) as value,
             'fixed_income' as type
-        FROM fixed_income_daily_balance
+        FROM fixed_income_daily_balance f
+        INNER JOIN {DIRTY_KEYS_TABLE} k
+        ON k.key = f.asset AND f.date >= k.from_date
         WHERE date <= (SELECT max(date) FROM variable_income_daily_balance)
+        GROUP BY asset, date
     )
     SELECT ticker, date, value, type
     FROM daily_balances_cte
 """)
-    print(f"Populated daily_balance. Rows affected: {cursor.rowcount}")
+    print(f"Populated daily_balance. Rows affected: {rows}")
+    return dirty
 
 
-def _populate_operations_summary(cursor):
-    print("Deleting from operations...")
-    cursor.execute("DELETE FROM operations")
-    print("Populating operations...")
-    cursor.execute("""
-    INSERT INTO operations
+def _populate_operations_summary(conn, dirty: dict = None) -> dict:
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, "SELECT asset FROM fixed_income_operations "
+                                          "UNION SELECT ticker FROM variable_income_operations "
+                                          "UNION SELECT asset FROM operations"), MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating operations for {len(dirty)} assets...")
+    rows = _replace_rows(conn, "operations", _dirty_rows_condition("operations", "asset", "operations.operation_date"), f"""
     WITH all_operations AS(
         SELECT
             asset,
@@ -361,28 +513,39 @@ def _populate_operations_summary(cursor):
         o.currency,
         d.price as dolar_price
     FROM all_operations o
+    INNER JOIN {DIRTY_KEYS_TABLE} k
+    ON k.key = o.asset AND o.operation_date >= k.from_date
     LEFT JOIN daily_asset_price d
     ON d.ticker = "BRL=X" AND d.date = o.operation_date
     ORDER BY operation_date DESC
 """)
-    print(f"Populated operations. Rows affected: {cursor.rowcount}")
+    print(f"Populated operations. Rows affected: {rows}")
+    return dirty
 
 
-def _populate_financial_returns(cursor):
-    print("Deleting from financial_returns...")
-    cursor.execute("DELETE FROM financial_returns")
-    print("Populating financial_returns...")
-    cursor.execute("""
-    INSERT INTO financial_returns
+def _populate_financial_returns(conn, dirty: dict = None) -> dict:
+    """dirty holds the first day of the first month to recompute of each asset."""
+    cursor = conn.cursor()
+    if dirty is None:
+        dirty = _spread(_distinct(cursor, "SELECT asset FROM daily_balance UNION SELECT asset FROM operations "
+                                          "UNION SELECT asset FROM financial_returns"), MIN_DATE)
+    if not dirty:
+        return dirty
+    _set_dirty_keys(cursor, dirty)
+    print(f"Populating financial_returns for {len(dirty)} assets...")
+    rows = _replace_rows(conn, "financial_returns", _dirty_rows_condition(
+        "financial_returns", "asset", "printf('%04d-%02d-01', financial_returns.year, financial_returns.month)"), f"""
     WITH deposits AS
     (
         SELECT asset, CAST(strftime('%Y', operation_date) AS INTEGER) AS year, CAST(strftime('%m', operation_date) AS INTEGER) AS month, sum(value) deposit
         FROM operations
+        WHERE asset IN (SELECT key FROM {DIRTY_KEYS_TABLE})
         GROUP BY asset, strftime('%Y', operation_date), strftime('%m', operation_date)
     ),
     balance_by_asset AS (
         SELECT asset, date, SUM(value) as value
         FROM daily_balance
+        WHERE asset IN (SELECT key FROM {DIRTY_KEYS_TABLE})
         GROUP BY asset, date
     ),
     balance AS (
@@ -410,22 +573,27 @@ def _populate_financial_returns(cursor):
         s.lag_value as month_start_value,
         s.next_value as month_end_value,
         s.deposit,
-        s.next_value - s.lag_value as net_increase, 
+        s.next_value - s.lag_value as net_increase,
         s.next_value - s.lag_value - s.deposit as profit,
         (s.next_value - s.lag_value - s.deposit) / s.lag_value * 100 as relative_return
     FROM summary s
-    WHERE s.next_value IS NOT NULL 
+    INNER JOIN {DIRTY_KEYS_TABLE} k
+    ON k.key = s.asset AND printf('%04d-%02d-01', s.year, s.month) >= k.from_date
+    WHERE s.next_value IS NOT NULL
     ORDER by s.year DESC, s.month DESC
 """)
-    print(f"Populated financial_returns. Rows affected: {cursor.rowcount}")
-
-
-def _populate_summary_returns(cursor):
-    print("Deleting from summary_returns...")
-    cursor.execute("DELETE FROM summary_returns")
-    print("Populating summary_returns...")
-    cursor.execute("""
-    INSERT INTO summary_returns
+    print(f"Populated financial_returns. Rows affected: {rows}")
+    return dirty
+
+
+def _populate_summary_returns(conn, since: str = MIN_DATE) -> str:
+    """Recomputes the months starting on or after since (every month by default); None skips the stage."""
+    if since is None:
+        return since
+    print(f"Populating summary_returns (from {since})...")
+    # The moving averages look back up to 12 months, so the whole series is computed and filtered
+    rows = _replace_rows(conn, "summary_returns", "printf('%04d-%02d-01', year, month) >= ?", """
+    SELECT * FROM (
     WITH summary AS (
         SELECT
             year,
@@ -438,7 +606,7 @@ def _populate_summary_returns(cursor):
         GROUP BY year, month
     )
     SELECT
-        year, 
+        year,
         month,
         month_end_value,
         total_deposit,
@@ -460,30 +628,241 @@ def _populate_summary_returns(cursor):
     GROUP BY
         year,
         month,
-        total_deposit, 
-        total_profit, 
+        total_deposit,
+        total_profit,
         total_return,
         month_end_value
-""")
-    print(f"Populated summary_returns. Rows affected: {cursor.rowcount}")
-
-
-def preprocess_data(conn):
+    )
+    WHERE printf('%04d-%02d-01', year, month) >= ?
+""", (since,))
+    print(f"Populated summary_returns. Rows affected: {rows}")
+    return since
+
+
+def _derived_tables() -> list:
+    return sorted({table for stage in PREPROCESS_STAGES for table in stage.writes})
+
+
+def _derived_tables_with_rows(cursor) -> dict:
+    has_rows = {}
+    for table in _derived_tables():
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+        has_rows[table] = bool(cursor.fetchone()[0])
+    return has_rows
+
+
+def _needs_full_rebuild(conn) -> bool:
+    """
+    True when a derived table was never recorded as built, or had rows when it was last
+    built and is empty now (dropped or cleared since). A table built empty may stay empty.
+    """
+    built_tables = load_built_tables(conn)
+    for table, has_rows in _derived_tables_with_rows(conn.cursor()).items():
+        if table not in built_tables:
+            print(f"'{table}' was not recorded as built.")
+            return True
+        if built_tables[table] and not has_rows:
+            print(f"'{table}' is empty but had rows when it was last built.")
+            return True
+    return False
+
+
+def _fixed_income_dirty(cursor, changes: dict, dates_since) -> tuple:
+    """Returns the dirty maps of the non-Tesouro Selic and of the Tesouro Selic assets."""
+    index_since = dict(changes['index_series'])
+    cdi_since = index_since.get('cdi')
+    if cdi_since is not None:
+        # Daily IPCA factors are laid over the CDI dates
+        index_since['ipca'] = min(index_since.get('ipca', cdi_since), cdi_since)
+    cursor.execute("SELECT DISTINCT asset, financial_index FROM fixed_income_operations")
+    asset_indexes = cursor.fetchall()
+
+    non_selic_dirty, selic_dirty = {}, {}
+    for asset, from_date in changes['fixed_income_operations'].items():
+        (selic_dirty if _is_tesouro_selic(asset) else non_selic_dirty)[asset] = from_date
+    for asset, financial_index in asset_indexes:
+        if _is_tesouro_selic(asset):
+            # Compounded over the CDI dates of index_series, without the 'dates' table
+            selic_dirty = _merge_dirty(selic_dirty, _spread([asset], cdi_since))
+        else:
+            non_selic_dirty = _merge_dirty(non_selic_dirty, _spread([asset], index_since.get(financial_index)),
+                                           _spread([asset], dates_since))
+    return non_selic_dirty, selic_dirty
+
+
+def _plan_stages(cursor, changes: dict) -> dict:
+    """Turns the source changes into the dirty maps the first stages start from."""
+    dates_since = changes['dates'].get('')
+    non_selic_dirty, selic_dirty = _fixed_income_dirty(cursor, changes, dates_since)
+    # FGTS balances are monthly: a change reaches back to the first day of its month
+    fgts_change = changes['fgts_operations'].get('')
+    return {
+        'changes': changes,
+        'price_dirty': _merge_dirty(changes['asset_price'], _spread(
+            _distinct(cursor, "SELECT ticker FROM asset_price UNION SELECT ticker FROM daily_asset_price"), dates_since)),
+        'non_selic_dirty': non_selic_dirty,
+        'selic_dirty': selic_dirty,
+        'fgts_since': min([since for since in (fgts_change and fgts_change[:8] + '01', dates_since) if since],
+                          default=None),
+        'previous_equity_end': _max_date(cursor, "variable_income_daily_balance"),
+        'previous_fixed_income_end': _max_date(cursor, "fixed_income_daily_balance"),
+    }
+
+
+# Stage functions take (conn, plan, dependency results) and return the stage's dirty map;
+# plan is None when every derived table is rebuilt.
+
+def _variable_income_stage(conn, plan: dict, results: dict) -> dict:
+    if plan is None:
+        return _populate_variable_income_daily_balance(conn)
+    price_dirty = results['daily_asset_price']
+    # Every balance row carries the dollar price of its day
+    return _populate_variable_income_daily_balance(conn, _merge_dirty(
+        plan['changes']['variable_income_operations'], price_dirty, _spread(_distinct(
+            conn.cursor(), "SELECT ticker FROM variable_income_operations UNION SELECT ticker FROM variable_income_daily_balance"),
+            price_dirty.get('BRL=X'))))
+
+
+def _daily_balance_stage(conn, plan: dict, results: dict) -> dict:
+    if plan is None:
+        return _populate_daily_balance_summary(conn)
+    cursor = conn.cursor()
+    dirty = _merge_dirty(results['variable_income_daily_balance'], results['fixed_income_daily_balance'],
+                         results['tesouro_selic_daily_balance'])
+    # Each type of balance is cut at the last day of the other, so moving that day touches every asset
+    all_assets = _distinct(cursor, "SELECT asset FROM daily_balance UNION SELECT ticker FROM variable_income_daily_balance "
+                                   "UNION SELECT asset FROM fixed_income_daily_balance")
+    for previous_end, table in ((plan['previous_equity_end'], "variable_income_daily_balance"),
+                                (plan['previous_fixed_income_end'], "fixed_income_daily_balance")):
+        current_end = _max_date(cursor, table)
+        if current_end != previous_end:
+            dirty = _merge_dirty(dirty, _spread(
+                all_assets, min([end for end in (previous_end, current_end) if end is not None], default=MIN_DATE)))
+    return _populate_daily_balance_summary(conn, dirty)
+
+
+def _operations_stage(conn, plan: dict, results: dict) -> dict:
+    if plan is None:
+        return _populate_operations_summary(conn)
+    changes = plan['changes']
+    # Every operation row carries the dollar price of its day
+    return _populate_operations_summary(conn, _merge_dirty(
+        changes['fixed_income_operations'], changes['variable_income_operations'],
+        _spread(_distinct(conn.cursor(), "SELECT asset FROM operations"), results['daily_asset_price'].get('BRL=X'))))
+
+
+def _financial_returns_stage(conn, plan: dict, results: dict) -> dict:
+    if plan is None:
+        return _populate_financial_returns(conn)
+    # A month's row also needs the first value of the next month
+    return _populate_financial_returns(conn, {
+        asset: _month_before(from_date)
+        for asset, from_date in _merge_dirty(results['daily_balance'], results['operations']).items()})
+
+
+def _summary_returns_stage(conn, plan: dict, results: dict) -> str:
+    if plan is None:
+        return _populate_summary_returns(conn)
+    return _populate_summary_returns(conn, min(results['financial_returns'].values(), default=None))
+
+
+PREPROCESS_STAGES = [
+    PipelineStage('daily_asset_price',
+                  lambda conn, plan, results: _populate_daily_asset_price(conn, plan and plan['price_dirty']),
+                  reads=['asset_price', 'dates'], writes=['daily_asset_price']),
+    PipelineStage('variable_income_daily_balance', _variable_income_stage,
+                  reads=['daily_asset_price', 'variable_income_operations'], writes=['variable_income_daily_balance']),
+    PipelineStage('fixed_income_daily_balance',
+                  lambda conn, plan, results: _populate_fixed_income_non_tesouro_selic(conn, plan and plan['non_selic_dirty']),
+                  reads=['fixed_income_operations', 'index_series', 'dates'], writes=['fixed_income_daily_balance']),
+    PipelineStage('tesouro_selic_daily_balance',
+                  lambda conn, plan, results: _process_tesouro_selic_operations(conn, plan and plan['selic_dirty']),
+                  reads=['fixed_income_operations', 'index_series'], writes=['fixed_income_daily_balance']),
+    PipelineStage('fgts_daily_balance',
+                  lambda conn, plan, results: _populate_fgts_daily_balance(conn, MIN_DATE if plan is None else plan['fgts_since']),
+                  reads=['fgts_operations', 'dates'], writes=['fgts_daily_balance']),
+    PipelineStage('daily_balance', _daily_balance_stage,
+                  reads=['variable_income_daily_balance', 'fixed_income_daily_balance'], writes=['daily_balance']),
+    PipelineStage('operations', _operations_stage,
+                  reads=['fixed_income_operations', 'variable_income_operations', 'daily_asset_price'], writes=['operations']),
+    PipelineStage('financial_returns', _financial_returns_stage,
+                  reads=['daily_balance', 'operations'], writes=['financial_returns']),
+    PipelineStage('summary_returns', _summary_returns_stage,
+                  reads=['financial_returns'], writes=['summary_returns']),
+]
+
+
+def _sqlite_connection_factory(conn):
+    """
+    Returns a function opening autocommit connections to conn's SQLite file, after switching
+    the file to WAL mode so stages can read while another one writes. None if conn is not
+    an SQLite file database.
+    """
+    if not is_sqlite(conn):
+        return None
+    database_path = next((file for _, name, file in conn.execute("PRAGMA database_list").fetchall() if name == 'main'), '')
+    if not database_path:
+        return None
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=WAL")
+    return lambda: sqlite3.connect(database_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+
+
+def _run_stage_on_new_connection(connect, stage: PipelineStage, plan: dict, results: dict):
+    stage_conn = connect()
+    try:
+        result = stage.function(stage_conn, plan, results)
+        stage_conn.commit()
+        return result
+    finally:
+        stage_conn.close()
+
+
+def preprocess_data(conn, incremental: bool = True, parallel: bool = False, max_workers: int = None, connect=None):
+    """
+    Rebuilds the derived investment tables. With incremental=True only the rows affected by
+    source changes since the last run (see source_changes.py) are recomputed; the first
+    run, or one that finds a derived table emptied since it was built, rebuilds everything.
+
+    The stages of PREPROCESS_STAGES run in dependency order (see stage_scheduler.py). With
+    parallel=True independent stages run at the same time on up to max_workers threads
+    (defaults to the CPU count), each on a new autocommit connection from connect (by
+    default, to conn's SQLite file in WAL mode) that commits the stage's rows itself.
+    Otherwise every stage runs on conn and everything is committed together at the end.
+    """
     print("Starting data preprocessing (preprocess_data)...")
     cursor = conn.cursor()
     print("Database cursor obtained for preprocessing.")
 
-    _prepare_date_dimension_and_nu_prices(cursor)
-    _populate_daily_asset_price(cursor)
-    _populate_variable_income_daily_balance(cursor)
-    _populate_fixed_income_non_tesouro_selic(cursor)
-    _process_tesouro_selic_operations(cursor)
-    _populate_fgts_daily_balance(cursor)
-    _populate_daily_balance_summary(cursor)
-    _populate_operations_summary(cursor)
-    _populate_financial_returns(cursor)
-    _populate_summary_returns(cursor)
+    _prepare_date_dimension_and_nu_prices(conn)
+    changes, current_digests = detect_source_changes(conn)
+    if changes is not None and (not incremental or _needs_full_rebuild(conn)):
+        changes = None
+    if changes is None:
+        print("Rebuilding every derived table...")
+    plan = None if changes is None else _plan_stages(cursor, changes)
+
+    if parallel and connect is None:
+        connect = _sqlite_connection_factory(conn)
+        if connect is None:
+            print("Parallel preprocessing needs an SQLite file or a connect function. Running the stages sequentially.")
+    if parallel and connect is not None:
+        # The stage connections must see the dates and NU prices
+        conn.commit()
+        workers = min(max_workers or os.cpu_count() or 1, len(PREPROCESS_STAGES))
+        try:
+            run_stages(PREPROCESS_STAGES,
+                       lambda stage, results: _run_stage_on_new_connection(connect, stage, plan, results), workers)
+        except Exception:
+            # The stages that finished are committed; without digests the next run rebuilds everything
+            clear_source_digests(conn)
+            conn.commit()
+            raise
+    else:
+        run_stages(PREPROCESS_STAGES, lambda stage, results: stage.function(conn, plan, results))
 
+    save_source_digests(conn, current_digests, full=changes is None)
+    save_built_tables(conn, _derived_tables_with_rows(cursor))
     print("Committing preprocessed data changes...")
     conn.commit()
     print("Data preprocessing finished.")
@@ -0,0 +1,153 @@
+'''
+Change tracking for the tables preprocess_data derives everything from.
+
+Each source table is summarized as one digest per (key, date): the sum of the row hashes
+of that key and date, key being the asset the rows belong to (or '' for tables without
+one). The digests of the last preprocessing run are kept in 'preprocess_source_digest';
+comparing them with the current ones gives, per source and key, the earliest date whose
+rows were added, removed or changed. preprocessing.py turns these dates into the rows of
+each derived table it has to recompute.
+
+The same table records, under BUILT_TABLES_SOURCE, whether each derived table had rows
+when it was last built: a table that had rows and is empty now was dropped or cleared
+since, while one that was empty (e.g. fgts_daily_balance with a single company) may stay so.
+'''
+import numpy as np
+import pandas as pd
+
+from sql.bulk_load import bulk_load, placeholder, ON_CONFLICT_UPDATE
+from sql.schema import get_primary_key_columns, get_table_ddl
+
+DIGEST_TABLE = 'preprocess_source_digest'
+DIGEST_COLUMNS = ['source_table', 'source_key', 'date', 'digest']
+# source_table of the rows recording, per derived table (source_key), whether it had rows (digest 1) when built
+BUILT_TABLES_SOURCE = 'built_derived_tables'
+# Source table -> (key column or None, date column)
+SOURCE_TABLES = {
+    'asset_price': ('ticker', 'quote_date'),
+    'variable_income_operations': ('ticker', 'operation_date'),
+    'fixed_income_operations': ('asset', 'purchase_date'),
+    'index_series': ('financial_index', 'date'),
+    'fgts_operations': (None, 'date'),
+    'dates': (None, 'date'),
+}
+
+
+def compute_source_digests(conn, table: str) -> pd.DataFrame:
+    """Returns the current digests of table as a DataFrame with source_key, date and digest columns."""
+    key_column, date_column = SOURCE_TABLES[table]
+    rows_df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    if rows_df.empty:
+        return pd.DataFrame({'source_key': pd.Series(dtype=object), 'date': pd.Series(dtype=object),
+                             'digest': pd.Series(dtype=np.int64)})
+    # Hashing the text form keeps the digest independent of how the driver types the values
+    row_hashes = pd.util.hash_pandas_object(rows_df.astype(str), index=False).to_numpy(dtype=np.uint64)
+    groups = pd.DataFrame({
+        'source_key': rows_df[key_column].astype(str) if key_column else '',
+        'date': rows_df[date_column].astype(str).str[:10],
+    })
+    codes, distinct_groups = pd.MultiIndex.from_frame(groups).factorize()
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+    # Unsigned sums wrap around, so the digest does not depend on the order of the rows
+    digests = np.add.reduceat(row_hashes[order], starts)
+    return pd.DataFrame({
+        'source_key': distinct_groups.get_level_values(0)[codes[order][starts]],
+        'date': distinct_groups.get_level_values(1)[codes[order][starts]],
+        'digest': digests.view(np.int64),
+    })
+
+
+def _ensure_digest_table(conn):
+    if get_primary_key_columns(conn, DIGEST_TABLE) is None:
+        print(f"Table '{DIGEST_TABLE}' not found. Creating it from the declared DDL...")
+        conn.cursor().execute(get_table_ddl(DIGEST_TABLE))
+        conn.commit()
+
+
+def _load_stored_digests(conn, table: str) -> pd.DataFrame:
+    return pd.read_sql(f"SELECT source_key, date, digest FROM {DIGEST_TABLE} WHERE source_table = {placeholder(conn)}",
+                       conn, params=(table,))
+
+
+def _compare_digests(current_df: pd.DataFrame, stored_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the (source_key, date) groups whose digest differs, with the current digest
+    ('digest', NA for groups that are gone) and the stored one ('digest_stored').
+    """
+    current_df = current_df.astype({'digest': 'Int64'})
+    stored_df = stored_df.astype({'digest': 'Int64'})
+    merged = current_df.merge(stored_df, on=['source_key', 'date'], how='outer', suffixes=('', '_stored'))
+    # A group missing on either side compares as NA, which counts as changed
+    return merged[(merged['digest'] != merged['digest_stored']).fillna(True).to_numpy(dtype=bool)]
+
+
+def detect_source_changes(conn):
+    """
+    Compares every source table with the digests of the last run. Returns
+    (changes, current digests): changes maps each source table to {key: earliest changed
+    date, 'YYYY-MM-DD'} and is None when no run was recorded yet.
+    """
+    _ensure_digest_table(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {DIGEST_TABLE}")
+    has_stored_digests = cursor.fetchone()[0] > 0
+
+    changes = {}
+    current_digests = {}
+    for table in SOURCE_TABLES:
+        current_digests[table] = compute_source_digests(conn, table)
+        changed = _compare_digests(current_digests[table], _load_stored_digests(conn, table))
+        changes[table] = changed.groupby('source_key')['date'].min().to_dict()
+        if changes[table] and has_stored_digests:
+            print(f"'{table}': {len(changed)} changed (key, date) groups, earliest {min(changes[table].values())}.")
+    return (changes if has_stored_digests else None), current_digests
+
+
+def save_source_digests(conn, current_digests: dict, full: bool = False):
+    """
+    Records current_digests as the state the derived tables were computed from, writing
+    only the groups that changed (every group when full is True). The caller commits.
+    """
+    cursor = conn.cursor()
+    for table, current_df in current_digests.items():
+        if full:
+            cursor.execute(f"DELETE FROM {DIGEST_TABLE} WHERE source_table = {placeholder(conn)}", (table,))
+            changed = current_df
+        else:
+            changed = _compare_digests(current_df, _load_stored_digests(conn, table))
+            removed = changed[changed['digest'].isna()]
+            cursor.executemany(
+                f"DELETE FROM {DIGEST_TABLE} WHERE source_table = {placeholder(conn)} "
+                f"AND source_key = {placeholder(conn)} AND date = {placeholder(conn)}",
+                [(table, source_key, date) for source_key, date in removed[['source_key', 'date']].itertuples(index=False)])
+            changed = changed[changed['digest'].notna()]
+        rows = [(table, source_key, date, int(digest)) for source_key, date, digest in
+                changed[['source_key', 'date', 'digest']].itertuples(index=False, name=None)]
+        if rows:
+            bulk_load(conn, DIGEST_TABLE, DIGEST_COLUMNS, rows, on_conflict=ON_CONFLICT_UPDATE,
+                      key_columns=['source_table', 'source_key', 'date'], commit=False)
+
+
+def clear_source_digests(conn):
+    """
+    Forgets the recorded digests and built tables, so the next preprocess_data run rebuilds
+    every derived table. The caller commits.
+    """
+    conn.cursor().execute(f"DELETE FROM {DIGEST_TABLE}")
+
+
+def load_built_tables(conn) -> dict:
+    """Returns {derived table: whether it had rows when last built} for the tables recorded by save_built_tables."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT source_key, digest FROM {DIGEST_TABLE} WHERE source_table = {placeholder(conn)}",
+                   (BUILT_TABLES_SOURCE,))
+    return {table: bool(had_rows) for table, had_rows in cursor.fetchall()}
+
+
+def save_built_tables(conn, built_tables: dict):
+    """Records {derived table: whether it has rows} after a run. The caller commits."""
+    rows = [(BUILT_TABLES_SOURCE, table, '', int(has_rows)) for table, has_rows in built_tables.items()]
+    if rows:
+        bulk_load(conn, DIGEST_TABLE, DIGEST_COLUMNS, rows, on_conflict=ON_CONFLICT_UPDATE,
+                  key_columns=['source_table', 'source_key', 'date'], commit=False)
@@ -0,0 +1,111 @@
+'''
+Dependency-aware scheduler for the preprocess_data stages.
+
+Each PipelineStage declares the tables it reads and writes. A stage waits for every
+earlier stage (in declaration order) that writes a table it reads or writes, or that
+reads a table it writes; the declaration order is therefore always a valid sequential
+order, and stages without such a conflict may run at the same time. run_stages prints
+when each stage starts and ends (seconds since the run started) and the critical path:
+the chain of stages, each waiting on the one before it, that ended last.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class PipelineStage:
+    """A named unit of work and the tables it reads and writes."""
+
+    def __init__(self, name: str, function, reads: list = (), writes: list = ()):
+        self.name = name
+        self.function = function
+        self.reads = set(reads)
+        self.writes = set(writes)
+
+    def __repr__(self):
+        return f"PipelineStage({self.name!r})"
+
+
+def stage_dependencies(stages: list) -> dict:
+    """Returns {stage name: set of names of the earlier stages it has to wait for}."""
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names: {names}")
+    dependencies = {}
+    for position, stage in enumerate(stages):
+        dependencies[stage.name] = {
+            earlier.name for earlier in stages[:position]
+            if earlier.writes & (stage.reads | stage.writes) or earlier.reads & stage.writes
+        }
+    return dependencies
+
+
+def _critical_path(dependencies: dict, timings: dict) -> list:
+    """Walks back from the stage that ended last through the dependency that ended last."""
+    path = []
+    name = max(timings, key=lambda stage_name: timings[stage_name][1], default=None)
+    while name is not None:
+        path.append(name)
+        name = max(dependencies[name], key=lambda stage_name: timings[stage_name][1], default=None)
+    return path[::-1]
+
+
+def run_stages(stages: list, run_stage, max_workers: int = 1) -> dict:
+    """
+    Runs run_stage(stage, dependency_results) for every stage once its dependencies have
+    finished, on up to max_workers threads (max_workers=1 runs them in the calling
+    thread, in declaration order). dependency_results maps the names of the stage's
+    dependencies to what run_stage returned for them. Returns {stage name: result}.
+
+    If a stage fails, no further stage is started; the ones already running are waited
+    for and the first error is raised.
+    """
+    dependencies = stage_dependencies(stages)
+    results = {}
+    timings = {}
+    run_start = time.perf_counter()
+
+    def run_timed(stage, dependency_results):
+        started = time.perf_counter() - run_start
+        print(f"[stage {stage.name}] started at +{started:.3f}s")
+        result = run_stage(stage, dependency_results)
+        ended = time.perf_counter() - run_start
+        print(f"[stage {stage.name}] ended at +{ended:.3f}s ({ended - started:.3f}s)")
+        return result, started, ended
+
+    def finish(stage, outcome):
+        results[stage.name], started, ended = outcome
+        timings[stage.name] = (started, ended)
+
+    pending = list(stages)
+    if max_workers <= 1:
+        for stage in pending:
+            finish(stage, run_timed(stage, {name: results[name] for name in dependencies[stage.name]}))
+    else:
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for stage in [stage for stage in pending if dependencies[stage.name] <= results.keys()]:
+                        pending.remove(stage)
+                        dependency_results = {name: results[name] for name in dependencies[stage.name]}
+                        running[executor.submit(run_timed, stage, dependency_results)] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        finish(stage, future.result())
+                    except Exception as e:
+                        print(f"[stage {stage.name}] failed: {e}")
+                        error = error or e
+        if error is not None:
+            raise error
+
+    total_seconds = time.perf_counter() - run_start
+    stage_seconds = sum(ended - started for started, ended in timings.values())
+    critical_path = _critical_path(dependencies, timings)
+    print(f"Ran {len(timings)} stages in {total_seconds:.3f}s ({stage_seconds:.3f}s of stage time, "
+          f"{max_workers} worker(s)). Critical path: {' -> '.join(critical_path)}")
+    return results
@@ -0,0 +1,63 @@
+'''
+Vectorized daily balances of Tesouro Selic bonds.
+
+A bond's operations are signed cash-flow lots (sells negative) compounded by the daily CDI
+factor: lot k, entering on day s_k, is worth value_k * C[t] / C[s_k - 1] on day t, C being
+the cumulative product of the factors. The balance of a day is C[t] times the prefix sum of
+value_k / C[s_k - 1] over the lots entered so far, so every day of an asset comes out of one
+cumprod and one cumsum, however many lots it has.
+
+As in the original day-by-day loop, a lot is compounded on the day it enters (except the
+first one), and the balance drops to zero while the quota balance is not positive; lots
+entered before that no longer count.
+'''
+import numpy as np
+
+
+def tesouro_selic_daily_balances(cdi_dates: np.ndarray, cdi_factors: np.ndarray, operations: list) -> tuple:
+    """
+    Daily balances of one asset. cdi_dates (sorted, as text) and cdi_factors are the CDI
+    series; operations are (purchase_date, due_date, signed quotas, signed value) tuples
+    sorted by purchase date. Operations entering on the same CDI day are combined.
+
+    Returns (date positions in the CDI series, due dates, deposit values, balances) for
+    the days with a positive balance, the deposit value being the combined value of the
+    last operations entered.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0), np.empty(0))
+    if not operations:
+        return empty
+    purchase_dates, due_dates, quotas, values = (np.array(column) for column in zip(*operations))
+    starts = np.searchsorted(cdi_dates, purchase_dates.astype(str))
+    # The last operation runs until its due date, the others until the next purchase
+    first_day = starts[0]
+    end_day = max(np.searchsorted(cdi_dates, str(due_dates[-1])), starts[-1])
+    day_count = end_day - first_day
+    entered = starts < end_day
+    if day_count <= 0:
+        return empty
+
+    lot_days = starts[entered] - first_day
+    group_days, group_starts = np.unique(lot_days, return_index=True)
+    group_values = np.add.reduceat(values[entered].astype(float), group_starts)
+    group_quotas = np.add.reduceat(quotas[entered].astype(float), group_starts)
+    group_due_dates = due_dates[entered][np.append(group_starts[1:], entered.sum()) - 1]
+
+    factors = cdi_factors[first_day:end_day].astype(float)
+    factors[0] = 1.0
+    cumulative = np.cumprod(factors)
+    cumulative_before = np.concatenate(([1.0], cumulative[:-1]))
+
+    active = np.cumsum(group_quotas) > 0
+    weights = np.where(active, group_values / cumulative_before[group_days], 0.0)
+    weight_sums = np.cumsum(weights)
+    # Lots entered up to the last group with no quotas left were zeroed with it
+    last_closed = np.maximum.accumulate(np.where(active, -1, np.arange(len(group_days))))
+    weight_sums -= np.where(last_closed >= 0, weight_sums[last_closed], 0.0)
+
+    day_groups = np.searchsorted(group_days, np.arange(day_count), side='right') - 1
+    balances = np.where(active[day_groups], cumulative * weight_sums[day_groups], 0.0)
+    positive = balances > 0
+    day_groups = day_groups[positive]
+    return (np.flatnonzero(positive) + first_day, group_due_dates[day_groups],
+            group_values[day_groups], balances[positive])
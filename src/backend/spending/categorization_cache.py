@@ -0,0 +1,78 @@
+'''
+Persistent cache of categorization results per distinct memo.
+
+Maps every lower-cased memo already categorized to the index of the first rule it matches
+(NO_MATCH for none), so memos seen in earlier runs are not matched again. The rule index
+gives main_category and sub_category through the rule list, so the cache is only valid
+for the exact rule list it was built with: it is stored as a compressed NumPy archive
+named after the rules fingerprint (CompiledRuleSet.fingerprint) in
+resources/cache/categorization, and archives of other fingerprints are deleted when a new
+one is written.
+'''
+import os
+import tempfile
+
+import numpy as np
+
+MEMO_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resources", "cache", "categorization")
+# Past this size the cache starts over with the memos of the current run
+MEMO_CACHE_MAX_ENTRIES = 500_000
+
+_CACHE_PREFIX = 'memo_rules.'
+_CACHE_SUFFIX = '.npz'
+
+
+def _cache_path(rules_fingerprint: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{_CACHE_PREFIX}{rules_fingerprint}{_CACHE_SUFFIX}")
+
+
+def load_memo_cache(rules_fingerprint: str, cache_dir: str = MEMO_CACHE_DIR) -> dict:
+    """Returns {lower-cased memo: rule index} cached for these rules, or an empty dict."""
+    cache_path = _cache_path(rules_fingerprint, cache_dir)
+    try:
+        with np.load(cache_path, allow_pickle=False) as archive:
+            return dict(zip(archive['memo'].tolist(), archive['rule_index'].tolist()))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable memo category cache {cache_path}: {e}")
+        return {}
+
+
+def store_memo_cache(memo_cache: dict, rules_fingerprint: str, cache_dir: str = MEMO_CACHE_DIR,
+                     max_entries: int = MEMO_CACHE_MAX_ENTRIES, keep_memos: list = None) -> bool:
+    """
+    Writes memo_cache for these rules and deletes the caches of other rule lists. When it
+    holds more than max_entries memos, only keep_memos (the memos of the current run) are
+    written. Returns True if the cache was written.
+    """
+    if len(memo_cache) > max_entries and keep_memos is not None:
+        memo_cache = {memo: memo_cache[memo] for memo in keep_memos if memo in memo_cache}
+    temp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written to a temporary file first so a reader never sees a partial cache
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, memo=np.array(list(memo_cache.keys()), dtype=str),
+                                rule_index=np.array(list(memo_cache.values()), dtype=np.int64))
+        cache_path = _cache_path(rules_fingerprint, cache_dir)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        print(f"Warning: Could not write the memo category cache: {e}")
+        # Stale cache cleanup only matches finished caches, so a leftover temporary file would stay
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        return False
+
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        if file_name.startswith(_CACHE_PREFIX) and file_name.endswith(_CACHE_SUFFIX) and path != cache_path:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not delete stale memo category cache {path}: {e}")
+    return True
@@ -0,0 +1,177 @@
+'''
+Compiled form of CATEGORIZATION_RULES.
+
+Checking every rule against a memo costs O(rules x keywords) substring scans. Here every
+distinct keyword of the rule list is compiled once into an Aho-Corasick automaton, so a
+memo is scanned a single time and yields the set of keywords it contains as a bitmask.
+Each rule keeps the mask of its own keywords and is indexed under its rarest keyword
+(its anchor); a memo only checks the rules anchored on keywords it contains, in rule
+order, and the first one whose mask is fully present wins.
+
+The semantics of the original loop are kept exactly: matching is on the lower-cased memo
+and keywords, every keyword of a rule must be a substring of the memo, and the first
+matching rule in list order wins. Empty keywords match any memo, and a rule without
+(non-empty) keywords matches every memo.
+'''
+import hashlib
+import json
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .categorization_rules import CATEGORIZATION_RULES
+
+NO_MATCH = -1
+
+
+class CompiledRuleSet:
+    """Categorization rules compiled into a keyword automaton plus per-rule keyword bitmasks."""
+
+    def __init__(self, rules: list):
+        self.rules = list(rules)
+        self.rule_fingerprints = [rule_fingerprint(keywords, category) for keywords, category in self.rules]
+        # Changes whenever a keyword, category or the order of the rules changes
+        self.fingerprint = hashlib.sha256(''.join(self.rule_fingerprints).encode('ascii')).hexdigest()
+        self.categories = [category for _, category in self.rules]
+        self.keywords = []
+        keyword_ids = {}
+        self.rule_masks = []
+        rule_keyword_ids = []
+        for keywords, _ in self.rules:
+            ids = set()
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if not keyword:
+                    continue   # '' is in every string
+                if keyword not in keyword_ids:
+                    keyword_ids[keyword] = len(self.keywords)
+                    self.keywords.append(keyword)
+                ids.add(keyword_ids[keyword])
+            rule_keyword_ids.append(ids)
+            self.rule_masks.append(sum(1 << keyword_id for keyword_id in ids))
+
+        # Each rule is anchored on its keyword shared by the fewest rules
+        rules_per_keyword = [0] * len(self.keywords)
+        for ids in rule_keyword_ids:
+            for keyword_id in ids:
+                rules_per_keyword[keyword_id] += 1
+        self._rules_by_anchor = [[] for _ in self.keywords]
+        self._first_unconditional_rule = None
+        for rule_index, ids in enumerate(rule_keyword_ids):
+            if not ids:
+                if self._first_unconditional_rule is None:
+                    self._first_unconditional_rule = rule_index
+                continue
+            anchor = min(ids, key=lambda keyword_id: (rules_per_keyword[keyword_id], keyword_id))
+            self._rules_by_anchor[anchor].append(rule_index)
+
+        self._transitions, self._outputs = _build_automaton(self.keywords)
+
+    def keyword_mask(self, text: str) -> int:
+        """Returns the bitmask of the keywords found in text (already lower-cased), in one pass."""
+        transitions = self._transitions
+        outputs = self._outputs
+        state = 0
+        mask = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            mask |= outputs[state]
+        return mask
+
+    def match(self, memo: str) -> int:
+        """Returns the index of the first rule matching memo (case-insensitively), or NO_MATCH."""
+        return self.match_lowered(memo.lower())
+
+    def match_lowered(self, memo: str) -> int:
+        """Returns the index of the first rule matching memo, which is already lower-cased, or NO_MATCH."""
+        mask = self.keyword_mask(memo)
+        best = self._first_unconditional_rule
+        rule_masks = self.rule_masks
+        remaining = mask
+        while remaining:
+            lowest_bit = remaining & -remaining
+            remaining ^= lowest_bit
+            for rule_index in self._rules_by_anchor[lowest_bit.bit_length() - 1]:
+                if best is not None and rule_index >= best:
+                    break
+                if mask & rule_masks[rule_index] == rule_masks[rule_index]:
+                    best = rule_index
+                    break
+        return NO_MATCH if best is None else best
+
+    def match_all(self, memos: list, memo_cache: dict = None) -> np.ndarray:
+        """
+        Returns the index of the first rule matching each memo (NO_MATCH where none does).
+
+        Memos are reduced to their distinct lower-cased forms, which is all matching looks
+        at, so every distinct memo is matched once and the results are mapped back. Distinct
+        memos found in memo_cache ({lower-cased memo: rule index}) are not matched at all;
+        the others are added to it.
+        """
+        if memo_cache is None:
+            memo_cache = {}
+        codes, distinct_memos = pd.factorize(pd.Series(memos, dtype=object).str.lower())
+        distinct_rules = np.empty(len(distinct_memos), dtype=np.int64)
+        for position, memo in enumerate(distinct_memos):
+            rule_index = memo_cache.get(memo)
+            if rule_index is None:
+                rule_index = memo_cache[memo] = self.match_lowered(memo)
+            distinct_rules[position] = rule_index
+        return distinct_rules[codes]
+
+    def categorize(self, memo: str):
+        """Returns the (main_category, sub_category) of the first rule matching memo, or None."""
+        rule_index = self.match(memo)
+        return None if rule_index == NO_MATCH else self.categories[rule_index]
+
+
+def rule_fingerprint(keywords: list, category) -> str:
+    """Returns the SHA-256 hex digest identifying a rule by its keywords and category."""
+    return hashlib.sha256(json.dumps([list(keywords), list(category)], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _build_automaton(keywords: list) -> tuple:
+    """
+    Builds the Aho-Corasick automaton of keywords as a complete transition table: one dict
+    per state (missing characters go back to the root) and the keyword bitmask each state
+    reports, failure-link outputs included.
+    """
+    transitions = [{}]
+    outputs = [0]
+    for keyword_id, keyword in enumerate(keywords):
+        state = 0
+        for char in keyword:
+            next_state = transitions[state].get(char)
+            if next_state is None:
+                next_state = len(transitions)
+                transitions.append({})
+                outputs.append(0)
+                transitions[state][char] = next_state
+            state = next_state
+        outputs[state] |= 1 << keyword_id
+
+    trie_children = [list(state_transitions.items()) for state_transitions in transitions]
+    failure = [0] * len(transitions)
+    queue = deque(child for _, child in trie_children[0])
+    while queue:
+        state = queue.popleft()
+        outputs[state] |= outputs[failure[state]]
+        # The failure state is shallower, so its transitions are already complete
+        for char, target in transitions[failure[state]].items():
+            transitions[state].setdefault(char, target)
+        for char, child in trie_children[state]:
+            failure[child] = transitions[failure[state]].get(char, 0)
+            queue.append(child)
+    return transitions, outputs
+
+
+_default_rule_set = None
+
+
+def get_default_rule_set() -> CompiledRuleSet:
+    """Returns CATEGORIZATION_RULES compiled, building it on first use."""
+    global _default_rule_set
+    if _default_rule_set is None:
+        _default_rule_set = CompiledRuleSet(CATEGORIZATION_RULES)
+    return _default_rule_set
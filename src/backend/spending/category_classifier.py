@@ -0,0 +1,188 @@
+'''
+Naive-Bayes fallback for the transactions no rule or user category covers.
+
+A multinomial naive-Bayes model over memo tokens (lower-cased words of two or more
+letters, each counted once per memo) is trained on the stored transactions that already
+have a category from CATEGORIZATION_RULES or a user override (user_categories.py), and
+predicts a (main_category, sub_category) pair for the 'Não Categorizado' ones in one
+batched NumPy pass. Predictions at or above MIN_PREDICTION_CONFIDENCE replace 'Não Categorizado' and
+their posterior probability is stored in 'ofx_transactions.category_confidence', which is
+NULL for every category that was not predicted. Predictions are refreshed on every run,
+so they follow the rules and user categories as these grow.
+'''
+import re
+
+import numpy as np
+import pandas as pd
+
+from .ofx_parser import (_upsert_transaction_categories, COLUMN_ID, COLUMN_MEMO, COLUMN_MAIN_CATEGORY,
+                         COLUMN_SUB_CATEGORY, COLUMN_RULE_INDEX, COLUMN_CATEGORY_CONFIDENCE)
+from .ofx_writer import OFX_TRANSACTIONS_TABLE, ensure_ofx_transactions_schema
+from .user_categories import ensure_user_categories_table, USER_CATEGORY_JOIN
+from sql.bulk_load import bulk_load, ON_CONFLICT_UPDATE
+
+UNCATEGORIZED = 'Não Categorizado'
+# Predictions below this posterior probability leave the transaction uncategorized
+MIN_PREDICTION_CONFIDENCE = 0.7
+# Additive smoothing of the token counts; small because most categories have few memos
+SMOOTHING_ALPHA = 0.05
+# Tokens must appear in at least this many distinct training memos to be used as features
+MIN_TOKEN_MEMOS = 2
+
+_TOKEN_PATTERN = re.compile(r'[^\W\d_]{2,}')
+
+
+def _tokenize(memos, vocabulary: dict, grow: bool) -> tuple:
+    """
+    Returns the token ids of memos as one flat array plus the offset where each memo starts.
+    Tokens missing from vocabulary are added when grow is True and dropped otherwise.
+    """
+    token_ids = []
+    offsets = np.empty(len(memos), dtype=np.int64)
+    for position, memo in enumerate(memos):
+        offsets[position] = len(token_ids)
+        for token in set(_TOKEN_PATTERN.findall(memo.lower())):
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                if not grow:
+                    continue
+                token_id = vocabulary[token] = len(vocabulary)
+            token_ids.append(token_id)
+    return np.array(token_ids, dtype=np.int64), offsets
+
+
+class NaiveBayesCategoryClassifier:
+    """Multinomial naive Bayes over memo tokens, predicting category pairs."""
+
+    def __init__(self, alpha: float = SMOOTHING_ALPHA):
+        self.alpha = alpha
+        self.vocabulary = {}
+        self.categories = []
+        self._log_prior = None
+        self._log_likelihood = None
+
+    def fit(self, memos: list, categories: list):
+        """Trains on memos and their (main_category, sub_category) pairs. Returns self."""
+        category_codes, category_index = pd.factorize(pd.Series(categories, dtype=object))
+        self.categories = list(category_index)
+        # Identical memos share their tokens; only their count per category matters
+        pairs = pd.DataFrame({'memo': memos, 'category': category_codes})
+        weighted = pairs.groupby(['memo', 'category'], sort=False).size().reset_index(name='count')
+        distinct_memos, memo_codes = np.unique(weighted['memo'].to_numpy(dtype=object), return_inverse=True)
+
+        # Tokens found in a single distinct memo say nothing beyond that memo and are dropped
+        vocabulary = {}
+        token_ids, _ = _tokenize(distinct_memos, vocabulary, grow=True)
+        memo_frequency = np.bincount(token_ids, minlength=len(vocabulary))
+        kept_tokens = [token for token, token_id in vocabulary.items() if memo_frequency[token_id] >= MIN_TOKEN_MEMOS]
+        self.vocabulary = {token: token_id for token_id, token in enumerate(kept_tokens)}
+        token_ids, offsets = _tokenize(distinct_memos, self.vocabulary, grow=False)
+        tokens_per_memo = np.diff(np.append(offsets, len(token_ids)))
+        row_tokens = tokens_per_memo[memo_codes]
+        # One (category, token) pair per token of each weighted (memo, category) row
+        row_starts = offsets[memo_codes]
+        flat_rows = np.repeat(np.arange(len(weighted)), row_tokens)
+        within = np.arange(len(flat_rows)) - np.repeat(np.cumsum(row_tokens) - row_tokens, row_tokens)
+        token_counts = np.zeros((len(self.categories), len(self.vocabulary)))
+        np.add.at(token_counts, (weighted['category'].to_numpy()[flat_rows], token_ids[row_starts[flat_rows] + within]),
+                  weighted['count'].to_numpy()[flat_rows])
+
+        category_counts = np.bincount(category_codes, minlength=len(self.categories))
+        self._log_prior = np.log(category_counts / category_counts.sum())
+        smoothed = token_counts + self.alpha
+        log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        # Trailing zero column: every memo gets at least one (neutral) token for reduceat
+        self._log_likelihood = np.hstack([log_likelihood, np.zeros((len(self.categories), 1))])
+        return self
+
+    def predict(self, memos: list) -> tuple:
+        """Returns the predicted category index of each memo and its posterior probability."""
+        if not len(memos):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        token_ids, offsets = _tokenize(memos, self.vocabulary, grow=False)
+        neutral_token = len(self.vocabulary)
+        # Insert the neutral token at the start of every memo so no segment is empty
+        token_ids = np.insert(token_ids, offsets, neutral_token)
+        offsets = offsets + np.arange(len(offsets))
+        scores = np.add.reduceat(self._log_likelihood[:, token_ids], offsets, axis=1) + self._log_prior[:, None]
+        scores -= scores.max(axis=0)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=0)
+        predicted = probabilities.argmax(axis=0)
+        return predicted, probabilities[predicted, np.arange(len(memos))]
+
+
+def _load_stored_transactions(conn) -> pd.DataFrame:
+    """Reads the stored transactions with their user category, if any, joined in as user_main/user_sub."""
+    ensure_ofx_transactions_schema(conn)
+    ensure_user_categories_table(conn)
+    query = (f"SELECT t.{COLUMN_ID}, t.{COLUMN_MEMO}, t.{COLUMN_MAIN_CATEGORY}, t.{COLUMN_SUB_CATEGORY}, "
+             f"t.{COLUMN_RULE_INDEX}, t.{COLUMN_CATEGORY_CONFIDENCE}, u.{COLUMN_MAIN_CATEGORY} AS user_main, "
+             f"u.{COLUMN_SUB_CATEGORY} AS user_sub FROM {OFX_TRANSACTIONS_TABLE} t {USER_CATEGORY_JOIN}")
+    return pd.read_sql(query, conn)
+
+
+def classify_uncategorized_transactions(conn, min_confidence: float = MIN_PREDICTION_CONFIDENCE,
+                                        commit: bool = True) -> int:
+    """
+    Trains the classifier on the categorized stored transactions and (re)predicts the ones
+    no rule matched and no user category covers. Only rows whose category or confidence
+    changed are written. Returns the number of rows updated.
+    """
+    stored_df = _load_stored_transactions(conn)
+    if stored_df.empty:
+        return 0
+
+    # User categories win, and count as training data, exactly as in _categorize_transactions_internal
+    has_user_category = stored_df['user_main'].notna().to_numpy()
+    main_categories = np.where(has_user_category, stored_df['user_main'], stored_df[COLUMN_MAIN_CATEGORY]).astype(object)
+    sub_categories = np.where(has_user_category, stored_df['user_sub'], stored_df[COLUMN_SUB_CATEGORY]).astype(object)
+
+    memos = stored_df[COLUMN_MEMO]
+    has_memo = (memos.notna() & (memos.astype(str) != '')).to_numpy()
+    predicted_before = stored_df[COLUMN_CATEGORY_CONFIDENCE].notna().to_numpy()
+    unmatched = ~(stored_df[COLUMN_RULE_INDEX] >= 0).to_numpy()
+    uncategorized = (main_categories == UNCATEGORIZED) & (sub_categories == UNCATEGORIZED)
+    targets = unmatched & ~has_user_category & (uncategorized | predicted_before)
+    training = has_memo & ~targets & ~uncategorized & ~pd.isna(main_categories) & ~pd.isna(sub_categories)
+    if not training.any() or not targets.any():
+        print("No categorized transactions to train on or no uncategorized transactions to predict.")
+        return 0
+
+    classifier = NaiveBayesCategoryClassifier().fit(
+        memos[training].astype(str).tolist(), list(zip(main_categories[training], sub_categories[training])))
+    new_main = np.full(len(stored_df), UNCATEGORIZED, dtype=object)
+    new_sub = np.full(len(stored_df), UNCATEGORIZED, dtype=object)
+    new_confidence = np.full(len(stored_df), np.nan)
+    predictable = targets & has_memo
+    predicted, confidence = classifier.predict(memos[predictable].astype(str).tolist())
+    confident = confidence >= min_confidence
+    predicted_positions = np.flatnonzero(predictable)[confident]
+    predicted_categories = [classifier.categories[category_code] for category_code in predicted[confident]]
+    new_main[predicted_positions] = [main for main, _ in predicted_categories]
+    new_sub[predicted_positions] = [sub for _, sub in predicted_categories]
+    new_confidence[predicted_positions] = confidence[confident]
+    print(f"Classifier trained on {int(training.sum())} transactions ({len(classifier.categories)} categories, "
+          f"{len(classifier.vocabulary)} tokens); {len(predicted_positions)} of {int(targets.sum())} uncategorized "
+          f"transactions predicted with confidence >= {min_confidence}.")
+
+    old_confidence = stored_df[COLUMN_CATEGORY_CONFIDENCE].to_numpy(dtype=float)
+    changed = targets & ((new_main != stored_df[COLUMN_MAIN_CATEGORY].to_numpy(dtype=object))
+                         | (new_sub != stored_df[COLUMN_SUB_CATEGORY].to_numpy(dtype=object))
+                         | ~np.isclose(new_confidence, old_confidence, equal_nan=True))
+    if not changed.any():
+        return 0
+    updated_df = pd.DataFrame({
+        COLUMN_ID: stored_df[COLUMN_ID].to_numpy(dtype=object)[changed],
+        COLUMN_MAIN_CATEGORY: new_main[changed],
+        COLUMN_SUB_CATEGORY: new_sub[changed],
+        COLUMN_CATEGORY_CONFIDENCE: new_confidence[changed],
+    })
+    _upsert_transaction_categories(conn, updated_df)
+    rows = [(transaction_id, main, sub, None if np.isnan(score) else float(score))
+            for transaction_id, main, sub, score in updated_df.itertuples(index=False, name=None)]
+    bulk_load(conn, OFX_TRANSACTIONS_TABLE, list(updated_df.columns), rows, on_conflict=ON_CONFLICT_UPDATE,
+              key_columns=[COLUMN_ID], commit=False)
+    if commit:
+        conn.commit()
+    return len(rows)
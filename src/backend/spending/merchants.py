@@ -0,0 +1,153 @@
+'''
+Merchant normalization and the interned 'merchants' table.
+
+Nubank memos carry noise that keeps the same counterparty from grouping: installment
+suffixes ("Parcela 3/10"), CPFs and CNPJs, bank/agency/account tails of transfers,
+PIX end-to-end ids and dates. normalize_merchant strips it and returns a canonical
+merchant key (lower-cased, without accents). Each distinct key is stored once in
+'merchants' under an integer merchant_id, which 'ofx_transactions.merchant_id'
+references, so per-merchant aggregates are GROUP BYs on an integer column.
+
+Categorization keeps matching the full memo: rules may test the parts removed here
+(e.g. a CNPJ), so running them on merchant keys would change their results.
+'''
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from .ofx_writer import OFX_TRANSACTIONS_TABLE, ensure_ofx_transactions_schema
+from sql.bulk_load import bulk_load, placeholder, ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE
+from sql.schema import get_primary_key_columns, get_table_ddl
+
+MERCHANTS_TABLE = 'merchants'
+MERCHANT_COLUMNS = ['merchant_id', 'merchant_key']
+MAX_MERCHANT_KEY_LENGTH = 255
+
+# Transfers: "<direction> - <counterparty> - <CPF/CNPJ> - <bank> (<code>) Agencia: <n> Conta: <n>"
+_TRANSFER_PREFIX = re.compile(r'^(?:transferencia (?:enviada|recebida)|pix)\b')
+_NOISE_PATTERNS = [
+    re.compile(r'\s*-?\s*parcela\s*\d+\s*/\s*\d+'),                # installments: "- Parcela 3/10"
+    re.compile(r'\s*-?\s*agencia:\s*\d+\s*conta:\s*[\d-]+'),      # agency/account
+    re.compile(r'(?<=\*)(?=(?:[a-z]*\d){3})[\da-z]+'),               # order ids after a processor prefix: "Audible*P934c6dl3"
+    re.compile(r'\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}'),          # CNPJ
+    re.compile(r'[\d•]{0,3}\.[\d•]{3}\.[\d•]{3}-[\d•]{0,2}'),    # CPF, masked or not
+    re.compile(r'\b[a-z]?\d[\da-z]{15,}\b'),                       # PIX end-to-end and other long ids
+    re.compile(r'\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b'),              # dates
+    re.compile(r'\b\d{5,}\b'),                                      # other long numbers
+]
+_SEPARATOR_RUNS = re.compile(r'(?:\s*-\s*){2,}')
+_STAR_SPACING = re.compile(r'\s*\*\s*')
+
+
+def normalize_merchant(memo) -> str:
+    """Returns the canonical merchant key of a memo, or '' when nothing is left of it."""
+    if memo is None or pd.isna(memo):
+        return ''
+    key = str(memo)
+    if 'Ã' in key:
+        # cp1252 mojibake the parser's repair heuristic leaves in place (e.g. "TransaÃ§Ã£o")
+        try:
+            key = key.encode('cp1252').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    key = unicodedata.normalize('NFKD', key.lower())
+    key = ''.join(char for char in key if not unicodedata.combining(char))
+    for pattern in _NOISE_PATTERNS:
+        key = pattern.sub(' ', key)
+    key = _STAR_SPACING.sub('*', key)
+    key = ' '.join(key.replace('"', ' ').split())
+    key = _SEPARATOR_RUNS.sub(' - ', key).strip(' -*.,;:')
+    if _TRANSFER_PREFIX.match(key):
+        # Only the direction and the counterparty identify the merchant of a transfer
+        key = ' - '.join(key.split(' - ')[:2])
+    return key[:MAX_MERCHANT_KEY_LENGTH]
+
+
+def normalize_merchants(memos) -> list:
+    """normalize_merchant over a sequence of memos, normalizing each distinct memo once."""
+    codes, distinct_memos = pd.factorize(pd.Series(memos, dtype=object))
+    keys = np.array([normalize_merchant(memo) for memo in distinct_memos] + [''], dtype=object)
+    return keys[codes].tolist()   # missing memos have code -1, the trailing ''
+
+
+class MerchantRegistry:
+    """In-memory view of 'merchants' that hands out merchant ids, interning new keys."""
+
+    def __init__(self):
+        self.ids = {}          # merchant_key -> merchant_id
+        self.new_entries = []
+
+    def load(self, conn):
+        """Loads every merchant, creating the table if it is missing. Returns self."""
+        if get_primary_key_columns(conn, MERCHANTS_TABLE) is None:
+            print(f"Table '{MERCHANTS_TABLE}' not found. Creating it from the declared DDL...")
+            conn.cursor().execute(get_table_ddl(MERCHANTS_TABLE))
+            conn.commit()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT merchant_key, merchant_id FROM {MERCHANTS_TABLE}")
+        self.ids = dict(cursor.fetchall())
+        self.new_entries = []
+        return self
+
+    def intern(self, keys) -> list:
+        """Returns the merchant id of each key (None for ''), assigning ids to unseen keys."""
+        next_id = max(self.ids.values(), default=0) + 1
+        merchant_ids = []
+        for key in keys:
+            if not key:
+                merchant_ids.append(None)
+                continue
+            merchant_id = self.ids.get(key)
+            if merchant_id is None:
+                merchant_id = self.ids[key] = next_id
+                self.new_entries.append((next_id, key))
+                next_id += 1
+            merchant_ids.append(merchant_id)
+        return merchant_ids
+
+    def save(self, conn):
+        """Inserts the merchants interned since load. The caller commits."""
+        if self.new_entries:
+            bulk_load(conn, MERCHANTS_TABLE, MERCHANT_COLUMNS, self.new_entries, on_conflict=ON_CONFLICT_IGNORE,
+                      commit=False)
+        self.new_entries = []
+
+
+def assign_merchant_ids(transactions_df: pd.DataFrame, registry: MerchantRegistry) -> pd.DataFrame:
+    """Adds a 'merchant_id' column (nullable integers) computed from the memo column."""
+    merchant_ids = registry.intern(normalize_merchants(transactions_df['memo']))
+    transactions_df['merchant_id'] = pd.array(merchant_ids, dtype='Int64')
+    return transactions_df
+
+
+def backfill_merchant_ids(conn, registry: MerchantRegistry) -> int:
+    """
+    Sets merchant_id on the stored transactions that have none yet (stored before merchants
+    existed) and saves the new merchants. The caller commits. Returns the number of rows updated.
+    """
+    ensure_ofx_transactions_schema(conn)
+    missing_df = pd.read_sql(f"SELECT id, memo FROM {OFX_TRANSACTIONS_TABLE} WHERE merchant_id IS NULL", conn)
+    missing_df = assign_merchant_ids(missing_df, registry)
+    missing_df = missing_df[missing_df['merchant_id'].notna()]
+    registry.save(conn)
+    if missing_df.empty:
+        return 0
+    print(f"Assigning merchants to {len(missing_df)} stored transactions...")
+    rows = [(transaction_id, int(merchant_id)) for transaction_id, merchant_id in
+            missing_df[['id', 'merchant_id']].itertuples(index=False, name=None)]
+    return bulk_load(conn, OFX_TRANSACTIONS_TABLE, ['id', 'merchant_id'], rows, on_conflict=ON_CONFLICT_UPDATE,
+                     key_columns=['id'], commit=False)
+
+
+def load_merchant_spending(conn, start_date: str = None) -> pd.DataFrame:
+    """
+    Returns the number of transactions and total amount of each merchant (since start_date,
+    'YYYY-MM-DD', if given), largest total first.
+    """
+    where = f"WHERE t.date >= {placeholder(conn)} " if start_date else ""
+    query = (f"SELECT m.merchant_id, m.merchant_key, COUNT(*) AS transactions, SUM(t.amount) AS total_amount "
+             f"FROM {OFX_TRANSACTIONS_TABLE} t JOIN {MERCHANTS_TABLE} m ON m.merchant_id = t.merchant_id "
+             f"{where}GROUP BY m.merchant_id, m.merchant_key ORDER BY ABS(SUM(t.amount)) DESC")
+    return pd.read_sql(query, conn, params=(start_date,) if start_date else None)
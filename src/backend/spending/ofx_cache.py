@@ -0,0 +1,151 @@
+'''
+On-disk cache of parsed OFX statements.
+
+Each statement's parsed transactions (memos already repaired) are stored as a compressed
+NumPy archive named after the file's SHA-256 content hash and the parser version, in
+resources/cache/ofx. A rebuild of 'ofx_transactions' then only has to hash unchanged
+statements instead of parsing them again.
+
+Bumping OFX_PARSER_VERSION in ofx_parser.py invalidates every entry at once; entries of
+other versions are deleted by evict_ofx_cache, which also keeps the directory under
+OFX_CACHE_MAX_BYTES by removing the least recently used entries.
+'''
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+OFX_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resources", "cache", "ofx")
+OFX_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHED_COLUMNS = ['id', 'date', 'type', 'amount', 'memo']
+
+_CACHE_SUFFIX = '.npz'
+
+
+def _cache_file_name(content_hash: str, parser_version: str) -> str:
+    return f"{content_hash}.v{parser_version}{_CACHE_SUFFIX}"
+
+
+def _parser_version_of(file_name: str) -> str:
+    """Returns the parser version encoded in a cache file name, or None for foreign files."""
+    if not file_name.endswith(_CACHE_SUFFIX) or '.v' not in file_name:
+        return None
+    return file_name[:-len(_CACHE_SUFFIX)].split('.v', 1)[1]
+
+
+def load_cached_transactions(content_hash: str, parser_version: str, cache_dir: str = OFX_CACHE_DIR):
+    """Returns the cached DataFrame of a statement, or None on a cache miss."""
+    cache_path = os.path.join(cache_dir, _cache_file_name(content_hash, parser_version))
+    try:
+        with np.load(cache_path, allow_pickle=False) as archive:
+            df = pd.DataFrame({
+                'id': archive['id'].tolist(),
+                'date': pd.Series(archive['date']),
+                'type': archive['type'].tolist(),
+                'amount': archive['amount'],
+                'memo': archive['memo'].tolist(),
+            })
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable OFX cache entry {cache_path}: {e}")
+        return None
+
+    try:
+        # The modification time drives the least-recently-used eviction
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return df
+
+
+def store_cached_transactions(transactions_df: pd.DataFrame, content_hash: str, parser_version: str,
+                              cache_dir: str = OFX_CACHE_DIR) -> bool:
+    """
+    Stores a statement's parsed DataFrame. Empty frames and frames whose text columns are
+    not all strings (which the archive could not round-trip exactly) are not cached.
+    Returns True if the entry was written.
+    """
+    if transactions_df.empty or list(transactions_df.columns) != CACHED_COLUMNS:
+        return False
+    text_columns = {col: transactions_df[col].tolist() for col in ('id', 'type', 'memo')}
+    if not all(isinstance(value, str) for values in text_columns.values() for value in values):
+        return False
+
+    temp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written to a temporary file first so parallel workers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(
+                f,
+                date=transactions_df['date'].to_numpy(),
+                amount=transactions_df['amount'].to_numpy(dtype='float64'),
+                **{col: np.array(values, dtype=str) for col, values in text_columns.items()},
+            )
+        os.replace(temp_path, os.path.join(cache_dir, _cache_file_name(content_hash, parser_version)))
+        return True
+    except Exception as e:
+        print(f"Warning: Could not write OFX cache entry for {content_hash}: {e}")
+        # Eviction only counts finished entries, so a leftover temporary file would never be deleted
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        return False
+
+
+def evict_ofx_cache(parser_version: str, max_bytes: int = OFX_CACHE_MAX_BYTES, cache_dir: str = OFX_CACHE_DIR) -> int:
+    """
+    Deletes entries written by other parser versions, then the least recently used entries
+    until the cache fits in max_bytes. Returns the number of files deleted.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    stale_paths = []
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        version = _parser_version_of(file_name)
+        if version is None:
+            continue
+        if version != parser_version:
+            stale_paths.append(path)
+        else:
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        stale_paths.append(path)
+        total_bytes -= size
+
+    removed = 0
+    for path in stale_paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            print(f"Warning: Could not delete OFX cache entry {path}: {e}")
+    if removed:
+        print(f"Evicted {removed} OFX cache entries; {total_bytes / 1024:.1f} KiB kept in {cache_dir}.")
+    return removed
+
+
+def clear_ofx_cache(cache_dir: str = OFX_CACHE_DIR) -> int:
+    """Deletes every cache entry, whatever its parser version. Returns the number of files deleted."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for file_name in os.listdir(cache_dir):
+        if _parser_version_of(file_name) is not None:
+            os.remove(os.path.join(cache_dir, file_name))
+            removed += 1
+    print(f"Cleared {removed} OFX cache entries from {cache_dir}.")
+    return removed
@@ -0,0 +1,169 @@
+'''
+Cross-statement de-duplication of parsed OFX transactions.
+
+Monthly statements overlap around their closing dates, so the same transaction can be
+found in two files. The 'ofx_transaction_index' table remembers every transaction already
+stored in 'ofx_transactions' by (account_type, id, fingerprint, occurrence), where the
+fingerprint hashes its account type, date, amount and normalized memo.
+
+Statements legitimately repeat rows: Nubank reuses one FITID for every installment of a
+purchase and for its IOF charge, sometimes with identical date, amount and memo, and a
+card payment has the same FITID in the credit card and the Nuconta statements. So a row of
+a statement is only a duplicate when the index already holds as many copies of it:
+
+- by id: the k-th row of the file with a given (account_type, id, fingerprint) is dropped
+  when the index holds at least k of them;
+- by fingerprint, for statements with unstable ids: the k-th row of the file with an id the
+  index never saw is dropped when the index holds at least k rows with its fingerprint.
+
+Kept rows whose id is already taken in 'ofx_transactions' (whose primary key is id) are
+stored as '<id>:<first 8 chars of fingerprint>', plus ':<occurrence>' for repeated rows.
+Every kept row also carries its original FITID in 'source_id', which user category
+overrides keyed by FITID are matched on (see user_categories.py).
+The index is loaded into dicts once per run, which makes each check O(1).
+'''
+import hashlib
+from collections import Counter
+
+import pandas as pd
+
+from sql.bulk_load import bulk_load, ON_CONFLICT_REPLACE
+from sql.schema import get_table_ddl
+
+INDEX_TABLE = 'ofx_transaction_index'
+INDEX_COLUMNS = ['account_type', 'id', 'fingerprint', 'occurrence', 'stored_id', 'source_file']
+
+
+def normalize_memo(memo) -> str:
+    """Lower-cases a memo and collapses its whitespace, so case/spacing changes between statements do not matter."""
+    if memo is None or pd.isna(memo):
+        return ''
+    return ' '.join(str(memo).lower().split())
+
+
+def compute_transaction_fingerprints(transactions_df: pd.DataFrame) -> list:
+    """Returns the SHA-1 fingerprint of (account_type, date, amount, normalized memo) for every row of transactions_df."""
+    account_types = transactions_df['account_type'].astype(str)
+    days = pd.to_datetime(transactions_df['date']).dt.strftime('%Y-%m-%d')
+    amounts = transactions_df['amount'].astype(float).map('{:.2f}'.format)
+    memos = transactions_df['memo'].map(normalize_memo)
+    return [hashlib.sha1(f"{account_type}|{day}|{amount}|{memo}".encode('utf-8')).hexdigest()
+            for account_type, day, amount, memo in zip(account_types, days, amounts, memos)]
+
+
+class TransactionDedupIndex:
+    """In-memory view of 'ofx_transaction_index' used to drop duplicates while files are ingested."""
+
+    def __init__(self):
+        self.occurrences = Counter()         # (account_type, id, fingerprint) -> rows stored
+        self.fingerprint_counts = Counter()  # (account_type, fingerprint) -> rows stored, any id
+        self.known_ids = set()               # (account_type, id)
+        self.used_ids = set()                # ids taken in 'ofx_transactions', across account types
+        self.new_entries = []
+
+    def load(self, conn):
+        """Loads every indexed transaction. A missing table is created and leaves the index empty."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {', '.join(INDEX_COLUMNS)} FROM {INDEX_TABLE}")
+            rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Warning: Could not read '{INDEX_TABLE}' ({e}). Creating it from the declared DDL...")
+            conn.rollback()
+            cursor.execute(get_table_ddl(INDEX_TABLE))
+            conn.commit()
+            rows = []
+
+        for account_type_name, transaction_id, fingerprint, occurrence, stored_id, _ in rows:
+            self._register(account_type_name, transaction_id, fingerprint, stored_id)
+        print(f"Loaded {len(rows)} previously ingested transactions from '{INDEX_TABLE}'.")
+        return self
+
+    def __len__(self):
+        return sum(self.occurrences.values())
+
+    def _register(self, account_type_name: str, transaction_id: str, fingerprint: str, stored_id: str) -> int:
+        """Adds one stored row to the in-memory index and returns its occurrence number."""
+        self.occurrences[(account_type_name, transaction_id, fingerprint)] += 1
+        self.fingerprint_counts[(account_type_name, fingerprint)] += 1
+        self.known_ids.add((account_type_name, transaction_id))
+        self.used_ids.add(stored_id)
+        return self.occurrences[(account_type_name, transaction_id, fingerprint)]
+
+    def _new_stored_id(self, transaction_id: str, fingerprint: str, occurrence: int) -> str:
+        """Returns the first of id, id:fingerprint, id:fingerprint:occurrence that is not taken yet."""
+        for candidate in (transaction_id, f"{transaction_id}:{fingerprint[:8]}",
+                          f"{transaction_id}:{fingerprint[:8]}:{occurrence}"):
+            if candidate not in self.used_ids:
+                return candidate
+        return f"{transaction_id}:{fingerprint}:{occurrence}"
+
+    def filter_file(self, transactions_df: pd.DataFrame, account_type_name: str, source_file: str) -> tuple:
+        """
+        Drops the rows of one statement that were already ingested and registers the others.
+        Returns (kept rows with their stored ids and their FITID as source_id, removed by id,
+        removed by fingerprint).
+        """
+        if transactions_df.empty:
+            return transactions_df, 0, 0
+
+        keep_mask = []
+        stored_ids = []
+        removed_by_id = removed_by_fingerprint = 0
+        id_counts = Counter()
+        fingerprint_counts = Counter()
+
+        fingerprints = compute_transaction_fingerprints(transactions_df)
+        for transaction_id, fingerprint in zip(transactions_df['id'], fingerprints):
+            id_key = (account_type_name, transaction_id, fingerprint)
+            fingerprint_key = (account_type_name, fingerprint)
+            id_counts[id_key] += 1
+            fingerprint_counts[fingerprint_key] += 1
+
+            if id_counts[id_key] <= self.occurrences[id_key]:
+                removed_by_id += 1
+                keep_mask.append(False)
+            elif (account_type_name, transaction_id) not in self.known_ids and \
+                    fingerprint_counts[fingerprint_key] <= self.fingerprint_counts[fingerprint_key]:
+                removed_by_fingerprint += 1
+                keep_mask.append(False)
+            else:
+                stored_id = self._new_stored_id(transaction_id, fingerprint, self.occurrences[id_key] + 1)
+                occurrence = self._register(account_type_name, transaction_id, fingerprint, stored_id)
+                self.new_entries.append((account_type_name, transaction_id, fingerprint, occurrence, stored_id, source_file))
+                keep_mask.append(True)
+                stored_ids.append(stored_id)
+
+        kept_df = transactions_df[keep_mask].copy()
+        kept_df['source_id'] = kept_df['id']
+        kept_df['id'] = stored_ids
+        return kept_df, removed_by_id, removed_by_fingerprint
+
+    def save(self, conn, replace_all: bool = False):
+        """Writes the transactions registered during this run (all rows first if replace_all). The caller commits."""
+        if not self.new_entries and not replace_all:
+            return
+        bulk_load(conn, INDEX_TABLE, INDEX_COLUMNS, self.new_entries, on_conflict=ON_CONFLICT_REPLACE,
+                  replace_all=replace_all, commit=False)
+        print(f"Indexed {len(self.new_entries)} new transactions in '{INDEX_TABLE}'.")
+        self.new_entries = []
+
+
+def deduplicate_parsed_files(parsed_files: list, dedup_index: TransactionDedupIndex, source_keys: list) -> list:
+    """
+    Runs every (file_path, account_type_name, DataFrame, parse_seconds) tuple returned by
+    _parse_ofx_file_list through dedup_index, in order, and prints the rows removed per file.
+    source_keys holds the manifest key of each file. Returns the tuples with filtered DataFrames.
+    """
+    deduplicated_files = []
+    total_removed = 0
+    for (file_path, account_type_name, df, parse_seconds), source_key in zip(parsed_files, source_keys):
+        kept_df, removed_by_id, removed_by_fingerprint = dedup_index.filter_file(df, account_type_name, source_key)
+        removed = removed_by_id + removed_by_fingerprint
+        if removed:
+            print(f"De-duplication: removed {removed} of {len(df)} transactions from {source_key} "
+                  f"({removed_by_id} by id, {removed_by_fingerprint} by fingerprint).")
+        total_removed += removed
+        deduplicated_files.append((file_path, account_type_name, kept_df, parse_seconds))
+    print(f"De-duplication: removed {total_removed} duplicate transactions across {len(parsed_files)} file(s).")
+    return deduplicated_files
@@ -0,0 +1,116 @@
+'''
+File-level detection of the charset problems found in Nubank OFX statements.
+
+Most credit card statements declare CHARSET:1252 but are written in UTF-8, so every
+accented memo decodes to mojibake ("CrÃ©dito"). Instead of running the per-memo repair
+heuristic (correct_ofx_char_encoding) on every memo, the raw bytes are inspected once:
+
+- MODE_CLEAN: the declared charset cannot produce mojibake, memos are used as decoded;
+- MODE_TRANSCODED: the file is valid UTF-8 declared as cp1252, so it is decoded as UTF-8
+  a single time and the heuristic's outcome is derived from the correct text;
+- MODE_PER_MEMO: anything else (mixed encodings, character references, fields that
+  strip differently in both charsets, ...) keeps the per-memo heuristic.
+
+All three modes produce exactly the memos the per-memo heuristic produces.
+'''
+import re
+
+from .ofx_reader import UnsupportedOfxError, _detect_encoding, _HEADER_READ_SIZE
+
+MODE_CLEAN = 'clean'
+MODE_TRANSCODED = 'utf-8 declared as cp1252'
+MODE_PER_MEMO = 'per-memo'
+
+# Bytes cp1252 leaves undefined; decoding them fails, so those files keep the old path
+_CP1252_UNDEFINED_RE = re.compile(rb'[\x81\x8d\x8f\x90\x9d]')
+# Character references can put non-ASCII text in a memo independently of the file's bytes
+_NON_ASCII_REFERENCE_RE = re.compile(rb'&(?!amp;|lt;|gt;|quot;|apos;)')
+# Fields that str.strip() trims differently once decoded as UTF-8 or as cp1252: a field
+# ending in byte A0 (cp1252 NBSP, e.g. 'Ã\xa0' for 'à') or starting/ending with
+# non-ASCII Unicode whitespace
+_UNICODE_SPACE = rb'(?:\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)'
+_STRIP_MISMATCH_RE = re.compile(rb'\xa0[ \t\r\n]*<|>[ \t\r\n]*' + _UNICODE_SPACE + rb'|' + _UNICODE_SPACE + rb'[ \t\r\n]*<')
+
+
+def correct_ofx_char_encoding(text: str) -> str:
+    """
+    Attempts to correct a common character encoding issue found in OFX files
+    where text intended as UTF-8 (e.g., "Crédito") is misinterpreted due to
+    an incorrect 'cp1252' (Windows-1252) decoding, resulting in mojibake
+    (e.g., "CrÃ©dito").
+    """
+    if not text:
+        return text
+    try:
+        # Attempt to reverse the incorrect cp1252 decoding then decode as UTF-8
+        original_utf8_bytes = text.encode('cp1252')
+        corrected_text = original_utf8_bytes.decode('utf-8')
+        # Heuristic: if 'Ã' was present and is now gone, it's likely corrected
+        if corrected_text != text and 'Ã' in text and 'Ã©' not in corrected_text.lower() and 'ã' not in corrected_text.lower():  # Avoid over-correction of legitimate extended chars
+            # Basic check to see if it looks more like valid text (less gibberish)
+            if sum(1 for char in corrected_text if ord(char) > 127) < sum(
+                    1 for char in text if ord(char) > 127) or 'Ã' not in corrected_text:
+                # print(f"Corrected: '{text}' -> '{corrected_text}'")
+                return corrected_text
+        return text
+    except UnicodeEncodeError:  # text might already be utf-8
+        return text
+    except UnicodeDecodeError:  # original_utf8_bytes might not be valid utf-8
+        return text
+    except Exception:  # Catch any other unforeseen errors
+        return text
+
+
+def _repair_transcoded_memo(memo: str) -> str:
+    """
+    Returns what correct_ofx_char_encoding gives for the cp1252 mojibake of memo, a memo
+    decoded correctly as UTF-8. The heuristic only repairs text holding 'Ã' (a character
+    in U+00C0-U+00FF) and refuses anything containing 'ã'; otherwise the mojibake is kept.
+    """
+    if not memo or memo.isascii():
+        return memo
+    if 'ã' not in memo.lower() and any('À' <= char <= 'ÿ' for char in memo):
+        return memo
+    return memo.encode('utf-8').decode('cp1252')
+
+
+def detect_ofx_encoding(file_path: str) -> tuple:
+    """
+    Reads the file's bytes once and returns (encoding, mode): the codec to decode the file
+    with and the MODE_* describing how its memos have to be repaired.
+    """
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    try:
+        declared = _detect_encoding(raw[:_HEADER_READ_SIZE])
+    except UnsupportedOfxError:
+        return None, MODE_PER_MEMO
+
+    if _NON_ASCII_REFERENCE_RE.search(raw):
+        return declared, MODE_PER_MEMO
+    if raw.isascii():
+        return declared, MODE_CLEAN
+    if declared == 'utf-8':
+        # 'Ã' is C3 83 in UTF-8; without it the heuristic never changes a memo
+        return declared, MODE_CLEAN if b'\xc3\x83' not in raw else MODE_PER_MEMO
+    if declared != 'cp1252':
+        return declared, MODE_PER_MEMO
+    if b'\xc3' not in raw:
+        # 'Ã' is C3 in cp1252
+        return declared, MODE_CLEAN
+    if _CP1252_UNDEFINED_RE.search(raw) or _STRIP_MISMATCH_RE.search(raw):
+        return declared, MODE_PER_MEMO
+    try:
+        raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return declared, MODE_PER_MEMO
+    return 'utf-8', MODE_TRANSCODED
+
+
+def repair_memos(memos: list, mode: str) -> list:
+    """Repairs the memos of one file according to the mode returned by detect_ofx_encoding."""
+    if mode == MODE_CLEAN:
+        return memos
+    if mode == MODE_TRANSCODED:
+        return [_repair_transcoded_memo(memo) for memo in memos]
+    return [correct_ofx_char_encoding(memo) for memo in memos]
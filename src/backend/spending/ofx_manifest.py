@@ -0,0 +1,130 @@
+'''
+Persistent manifest of the OFX files already ingested into 'ofx_transactions'.
+
+Each statement file is recorded by its path (relative to resources/files), size,
+mtime and SHA-256 content hash, together with how long it took to parse and how
+many transactions it produced. Incremental ingestion uses it to skip files that
+did not change since the last run.
+'''
+import hashlib
+import os
+from datetime import datetime
+
+from sql.bulk_load import bulk_load, placeholder, ON_CONFLICT_REPLACE
+
+MANIFEST_TABLE = 'ofx_file_manifest'
+MANIFEST_COLUMNS = ['file_path', 'account_type', 'file_size', 'file_mtime', 'content_hash',
+                    'parse_seconds', 'transaction_count', 'ingested_at']
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def compute_file_hash(file_path: str) -> str:
+    """Returns the SHA-256 hex digest of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_key(file_path: str, base_resources_files_path: str) -> str:
+    """Manifest key of a file: its path relative to the OFX base directory, with '/' separators."""
+    relative_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(base_resources_files_path))
+    return relative_path.replace(os.sep, '/')
+
+
+def load_ofx_manifest(conn) -> dict:
+    """
+    Loads the manifest as {file_path: {column: value}}.
+    Returns an empty dict if the manifest table does not exist yet.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(MANIFEST_COLUMNS)} FROM {MANIFEST_TABLE}")
+        rows = cursor.fetchall()
+    except Exception as e:
+        print(f"Warning: Could not read '{MANIFEST_TABLE}' ({e}). Treating every OFX file as new.")
+        return {}
+    return {row[0]: dict(zip(MANIFEST_COLUMNS, row)) for row in rows}
+
+
+def diff_ofx_manifest(ofx_files_with_account: list, manifest: dict, base_resources_files_path: str):
+    """
+    Compares the OFX files on disk against the manifest.
+
+    Files whose size and mtime match their manifest entry are skipped without being read.
+    Otherwise the content hash decides: a matching hash only needs its mtime refreshed,
+    a different (or missing) hash marks the file for parsing.
+
+    Returns (changed_files, touched_entries, removed_keys, unchanged_count) where
+    changed_files is a list of (file_path, account_type, fingerprint) and fingerprint is
+    a dict with the manifest key, size, mtime and content hash.
+    """
+    changed_files = []
+    touched_entries = []
+    unchanged_count = 0
+    seen_keys = set()
+
+    for file_path, account_type_name in ofx_files_with_account:
+        key = manifest_key(file_path, base_resources_files_path)
+        seen_keys.add(key)
+        stat = os.stat(file_path)
+        entry = manifest.get(key)
+
+        if entry and entry['file_size'] == stat.st_size and entry['file_mtime'] == stat.st_mtime:
+            unchanged_count += 1
+            continue
+
+        content_hash = compute_file_hash(file_path)
+        fingerprint = {'file_path': key, 'file_size': stat.st_size, 'file_mtime': stat.st_mtime,
+                       'content_hash': content_hash}
+        if entry and entry['content_hash'] == content_hash:
+            # Same bytes, new mtime (e.g. the file was copied again): no need to parse it
+            touched_entries.append({**entry, **fingerprint})
+            unchanged_count += 1
+        else:
+            changed_files.append((file_path, account_type_name, fingerprint))
+
+    removed_keys = sorted(set(manifest) - seen_keys)
+    return changed_files, touched_entries, removed_keys, unchanged_count
+
+
+def build_manifest_entry(fingerprint: dict, account_type_name: str, parse_seconds: float,
+                         transaction_count: int) -> dict:
+    """Builds a manifest row for a file that was just parsed."""
+    return {
+        **fingerprint,
+        'account_type': account_type_name,
+        'parse_seconds': round(parse_seconds, 6),
+        'transaction_count': int(transaction_count),
+        'ingested_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def save_ofx_manifest_entries(conn, entries: list):
+    """Inserts or replaces the given manifest rows. The caller commits."""
+    if not entries:
+        return
+    bulk_load(conn, MANIFEST_TABLE, MANIFEST_COLUMNS, [tuple(entry[col] for col in MANIFEST_COLUMNS) for entry in entries],
+              on_conflict=ON_CONFLICT_REPLACE, commit=False)
+    print(f"Recorded {len(entries)} file(s) in '{MANIFEST_TABLE}'.")
+
+
+def remove_ofx_manifest_entries(conn, keys: list):
+    """Deletes manifest rows for files that no longer exist on disk. The caller commits."""
+    if not keys:
+        return
+    cursor = conn.cursor()
+    cursor.executemany(f"DELETE FROM {MANIFEST_TABLE} WHERE file_path = {placeholder(conn)}",
+                       [(key,) for key in keys])
+    print(f"Removed {len(keys)} missing file(s) from '{MANIFEST_TABLE}'.")
+
+
+def clear_ofx_manifest(conn):
+    """Deletes every manifest row, forcing the next incremental run to parse all files. The caller commits."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {MANIFEST_TABLE}")
+    except Exception as e:
+        print(f"Warning: Could not clear '{MANIFEST_TABLE}': {e}")
@@ -1,10 +1,21 @@
-import glob
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 from ofxparse import OfxParser
 
-from .categorization_rules import CATEGORIZATION_RULES  # Import the rules
+from .categorization_engine import get_default_rule_set, NO_MATCH
+from .categorization_cache import load_memo_cache, store_memo_cache
+from .ofx_reader import read_ofx_transaction_columns
+from .ofx_encoding import detect_ofx_encoding, repair_memos, MODE_PER_MEMO
+from .ofx_cache import load_cached_transactions, store_cached_transactions, evict_ofx_cache
+from .ofx_writer import upsert_ofx_transactions
+from .ofx_manifest import (load_ofx_manifest, diff_ofx_manifest, build_manifest_entry, save_ofx_manifest_entries,
+                           remove_ofx_manifest_entries, clear_ofx_manifest, compute_file_hash)
+from .ofx_dedup import TransactionDedupIndex, deduplicate_parsed_files
 from sql.connection import db_connect # Corrected import: removed 'src.'
 
 # Define column names for consistency (can be shared or defined where needed)
@@ -16,42 +27,37 @@ COLUMN_MEMO = 'memo'
 COLUMN_ACCOUNT_TYPE = 'account_type'  # Kept for categorization logic
 COLUMN_MAIN_CATEGORY = 'main_category'
 COLUMN_SUB_CATEGORY = 'sub_category'
-
+COLUMN_RULE_INDEX = 'rule_index'  # First rule matched by the memo, NO_MATCH (-1) if none
+COLUMN_CATEGORY_CONFIDENCE = 'category_confidence'  # Set only on categories predicted by category_classifier.py
+COLUMN_MERCHANT_ID = 'merchant_id'  # Interned normalized memo, see merchants.py
+COLUMN_SOURCE_ID = 'source_id'  # FITID of a row whose stored id was made unique by ofx_dedup.py
+
+# Parse statements with the lightweight streaming reader (ofx_reader.py) before trying ofxparse
+USE_STREAMING_OFX_READER = True
+# Reuse parsed statements from the on-disk cache (ofx_cache.py), keyed by content hash and OFX_PARSER_VERSION
+USE_OFX_PARSE_CACHE = True
+# Reuse the rule matched by each distinct memo in earlier runs (categorization_cache.py), keyed by the rules fingerprint
+USE_MEMO_CATEGORY_CACHE = True
+# Predict a category for the transactions no rule or user category covers (category_classifier.py)
+USE_CATEGORY_CLASSIFIER = True
+# Bump whenever a change alters the parsed DataFrames; every cached statement is then parsed again
+OFX_PARSER_VERSION = '1'
+# dtype of the 'date' column produced by the ofxparse path, which the streaming reader must match
+_OFX_DATE_DTYPE = pd.to_datetime(pd.Series([datetime(2000, 1, 1)])).dt.normalize().dtype
+
+# Account type subdirectories of resources/files and their corresponding names
+ACCOUNT_TYPE_SUBDIRS = {
+    "credit_card": "Credit Card",
+    "nuconta": "Nuconta"
+    # Add more mappings here if needed
+}
 
 # COLUMN_ACCOUNT_TYPE = 'account_type' # This might be added by the caller if needed
 
-def _correct_ofx_char_encoding(text: str) -> str:
-    """
-    Attempts to correct a common character encoding issue found in OFX files
-    where text intended as UTF-8 (e.g., "Crédito") is misinterpreted due to
-    an incorrect 'cp1252' (Windows-1252) decoding, resulting in mojibake
-    (e.g., "CrÃ©dito").
-    """
-    if not text:
-        return text
-    try:
-        # Attempt to reverse the incorrect cp1252 decoding then decode as UTF-8
-        original_utf8_bytes = text.encode('cp1252')
-        corrected_text = original_utf8_bytes.decode('utf-8')
-        # Heuristic: if 'Ã' was present and is now gone, it's likely corrected
-        if corrected_text != text and 'Ã' in text and 'Ã©' not in corrected_text.lower() and 'ã' not in corrected_text.lower():  # Avoid over-correction of legitimate extended chars
-            # Basic check to see if it looks more like valid text (less gibberish)
-            if sum(1 for char in corrected_text if ord(char) > 127) < sum(
-                    1 for char in text if ord(char) > 127) or 'Ã' not in corrected_text:
-                # print(f"Corrected: '{text}' -> '{corrected_text}'")
-                return corrected_text
-        return text
-    except UnicodeEncodeError:  # text might already be utf-8
-        return text
-    except UnicodeDecodeError:  # original_utf8_bytes might not be valid utf-8
-        return text
-    except Exception:  # Catch any other unforeseen errors
-        return text
-
-
-def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
+def _parse_single_ofx_with_ofxparse(file_path: str) -> pd.DataFrame:
     """
-    Parses a single OFX file and converts its transactions into a Pandas DataFrame.
+    Parses a single OFX file with ofxparse and converts its transactions into a Pandas DataFrame.
+    Memos are returned as decoded by ofxparse (no mojibake repair).
     """
     expected_columns = [COLUMN_ID, COLUMN_DATE, COLUMN_TYPE, COLUMN_AMOUNT, COLUMN_MEMO]
     transactions_list = []
@@ -79,7 +85,7 @@ def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
                             COLUMN_DATE: transaction.date,
                             COLUMN_TYPE: transaction.type,
                             COLUMN_AMOUNT: transaction.amount,
-                            COLUMN_MEMO: _correct_ofx_char_encoding(transaction.memo)
+                            COLUMN_MEMO: transaction.memo
                         })
         elif hasattr(ofx, 'signon') and hasattr(ofx.signon,
                                                 'statements') and ofx.signon.statements:  # Another possible structure
@@ -91,7 +97,7 @@ def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
                             COLUMN_DATE: transaction.date,
                             COLUMN_TYPE: transaction.type,
                             COLUMN_AMOUNT: transaction.amount,
-                            COLUMN_MEMO: _correct_ofx_char_encoding(transaction.memo)
+                            COLUMN_MEMO: transaction.memo
                         })
         if not transactions_list:
             print(f"Warning: No account information and no fallback transactions found in {file_path}.")
@@ -112,7 +118,7 @@ def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
                 COLUMN_DATE: transaction.date,
                 COLUMN_TYPE: transaction.type,
                 COLUMN_AMOUNT: transaction.amount,
-                COLUMN_MEMO: _correct_ofx_char_encoding(transaction.memo)
+                COLUMN_MEMO: transaction.memo
             })
 
     if not transactions_list:
@@ -126,54 +132,158 @@ def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
     return df
 
 
-def parse_ofx_files_to_dataframe(base_resources_files_path: str) -> pd.DataFrame:
+def _transaction_columns_to_dataframe(columns: dict) -> pd.DataFrame:
+    """Builds the per-file DataFrame from the column arrays of the streaming reader."""
+    return pd.DataFrame({
+        COLUMN_ID: columns['id'],
+        COLUMN_DATE: pd.Series(columns['date']).astype(_OFX_DATE_DTYPE),
+        COLUMN_TYPE: columns['type'],
+        COLUMN_AMOUNT: columns['amount'],
+        COLUMN_MEMO: columns['memo'],
+    })
+
+
+def _parse_single_ofx_with_encoding_report(file_path: str) -> tuple:
     """
-    Processes all OFX files from predefined subdirectories (account types)
-    within the given base_resources_files_path, adds 'account_type',
-    and concatenates them into a single DataFrame.
+    Parses a single OFX file and repairs its memos, returning (DataFrame, encoding mode,
+    seconds spent detecting the encoding and repairing memos).
+    Uses the streaming reader and falls back to ofxparse for files it does not handle.
     """
-    all_dfs = []
-    # Define account type subdirectories and their corresponding names
-    account_type_subdirs = {
-        "credit_card": "Credit Card",
-        "nuconta": "Nuconta"
-        # Add more mappings here if needed
-    }
+    if USE_STREAMING_OFX_READER:
+        try:
+            start_time = time.perf_counter()
+            encoding, encoding_mode = detect_ofx_encoding(file_path)
+            encoding_seconds = time.perf_counter() - start_time
 
-    final_columns_expected = [COLUMN_ID, COLUMN_DATE, COLUMN_TYPE, COLUMN_AMOUNT, COLUMN_MEMO, COLUMN_ACCOUNT_TYPE]
+            df = _transaction_columns_to_dataframe(read_ofx_transaction_columns(file_path, encoding))
 
-    if not os.path.isdir(base_resources_files_path):
-        print(f"Error: Base OFX resources directory not found: {base_resources_files_path}")
-        return pd.DataFrame(columns=final_columns_expected)
+            start_time = time.perf_counter()
+            df[COLUMN_MEMO] = repair_memos(df[COLUMN_MEMO].tolist(), encoding_mode)
+            return df, encoding_mode, encoding_seconds + time.perf_counter() - start_time
+        except FileNotFoundError:
+            pass # Reported by the ofxparse path below
+        except Exception as e:
+            print(f"Info: Streaming reader could not handle {file_path} ({e}). Falling back to ofxparse.")
 
-    found_any_files = False
+    df = _parse_single_ofx_with_ofxparse(file_path)
+    start_time = time.perf_counter()
+    if not df.empty:
+        # ofxparse decodes with the declared charset, so only the per-memo heuristic applies
+        df[COLUMN_MEMO] = repair_memos(df[COLUMN_MEMO].tolist(), MODE_PER_MEMO)
+    return df, MODE_PER_MEMO, time.perf_counter() - start_time
+
+
+def _parse_single_ofx_to_dataframe(file_path: str) -> pd.DataFrame:
+    """
+    Parses a single OFX file and converts its transactions into a Pandas DataFrame.
+    Uses the streaming reader and falls back to ofxparse for files it does not handle.
+    """
+    return _parse_single_ofx_with_encoding_report(file_path)[0]
+
+
+def is_ofx_file_name(file_name: str) -> bool:
+    """Tells whether a file name is an OFX statement ('.ofx' in any case, e.g. STATEMENT.OFX)."""
+    return file_name.lower().endswith('.ofx')
+
+
+def _collect_ofx_files(base_resources_files_path: str, account_type_subdirs: dict) -> list:
+    """
+    Lists the OFX files under each account type subdirectory as (file_path, account_type_name)
+    pairs, sorted by path inside each subdirectory so every run sees the files in the same order.
+    """
+    ofx_files_with_account = []
     for subdir_name, account_type_name in account_type_subdirs.items():
         current_path = os.path.join(base_resources_files_path, subdir_name)
         if not os.path.isdir(current_path):
             print(f"Warning: Subdirectory for account type '{account_type_name}' not found: {current_path}")
             continue
 
-        ofx_files = glob.glob(os.path.join(current_path, '*.ofx'))
+        with os.scandir(current_path) as entries:
+            ofx_files = sorted(entry.path for entry in entries if entry.is_file() and is_ofx_file_name(entry.name))
         if not ofx_files:
             print(f"No OFX files found in {current_path} for account type '{account_type_name}'.")
             continue
-        
-        found_any_files = True
+
         print(f"Found {len(ofx_files)} OFX files in {current_path} for account type '{account_type_name}'. Processing...")
-        for file_path in ofx_files:
+        ofx_files_with_account.extend((file_path, account_type_name) for file_path in ofx_files)
+    return ofx_files_with_account
+
+
+def _parse_single_ofx_timed(file_path: str) -> tuple:
+    """
+    Parses a single OFX file and returns (DataFrame, parse time in seconds, encoding mode,
+    encoding repair time in seconds); the parse time includes the encoding repair.
+    With USE_OFX_PARSE_CACHE, a cached result is returned with the 'cached' encoding mode.
+    """
+    start_time = time.perf_counter()
+    content_hash = None
+    if USE_OFX_PARSE_CACHE:
+        try:
+            content_hash = compute_file_hash(file_path)
+        except OSError:
+            pass # Reported by the parsing path below
+        if content_hash:
+            df = load_cached_transactions(content_hash, OFX_PARSER_VERSION)
+            if df is not None:
+                return df, time.perf_counter() - start_time, 'cached', 0.0
+
+    df, encoding_mode, encoding_seconds = _parse_single_ofx_with_encoding_report(file_path)
+    if content_hash:
+        store_cached_transactions(df, content_hash, OFX_PARSER_VERSION)
+    return df, time.perf_counter() - start_time, encoding_mode, encoding_seconds
+
+
+def _parse_ofx_file_list(ofx_files_with_account: list, parallel: bool = False, max_workers: int = None) -> list:
+    """
+    Parses the given (file_path, account_type_name) pairs and returns, in the same order,
+    (file_path, account_type_name, DataFrame, parse_seconds) tuples. Non-empty DataFrames
+    get their 'account_type' column. The encoding mode and repair time of every file are printed.
+
+    With parallel=True the files are parsed on a process pool of max_workers processes
+    (defaults to the CPU count). Per-file errors are printed by the workers, exactly as
+    in the sequential path, and come back as empty DataFrames.
+    """
+    file_paths = [file_path for file_path, _ in ofx_files_with_account]
+    if not file_paths:
+        return []
+
+    if parallel:
+        workers = min(max_workers or os.cpu_count() or 1, len(file_paths))
+        # Small chunks keep the pool balanced when statement sizes vary a lot between months
+        chunksize = max(1, len(file_paths) // (workers * 4))
+        print(f"Parsing {len(file_paths)} OFX files in parallel with {workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_parse_single_ofx_timed, file_paths, chunksize=chunksize))
+    else:
+        results = []
+        for file_path in file_paths:
             print(f"Processing file: {file_path}")
-            df = _parse_single_ofx_to_dataframe(file_path)
-            if not df.empty:
-                df[COLUMN_ACCOUNT_TYPE] = account_type_name # Add account type
-                all_dfs.append(df)
-            else:
-                print(f"Warning: No data parsed from {file_path}")
-
-    if not found_any_files:
-        print(f"No OFX files found in any of the specified subdirectories within {base_resources_files_path}")
-        # Return an empty DataFrame with all expected columns, including account_type
-        return pd.DataFrame(columns=final_columns_expected)
-        
+            results.append(_parse_single_ofx_timed(file_path))
+
+    parsed_files = []
+    total_encoding_seconds = 0.0
+    for (file_path, account_type_name), (df, parse_seconds, encoding_mode, encoding_seconds) in zip(ofx_files_with_account, results):
+        print(f"Encoding repair for {os.path.basename(file_path)} ({account_type_name}): "
+              f"{encoding_mode}, {encoding_seconds * 1000:.2f} ms")
+        total_encoding_seconds += encoding_seconds
+        if not df.empty:
+            df[COLUMN_ACCOUNT_TYPE] = account_type_name # Add account type
+        else:
+            print(f"Warning: No data parsed from {file_path}")
+        parsed_files.append((file_path, account_type_name, df, parse_seconds))
+    print(f"Encoding repair took {total_encoding_seconds * 1000:.2f} ms across {len(parsed_files)} file(s).")
+    if USE_OFX_PARSE_CACHE:
+        cache_hits = sum(1 for _, _, encoding_mode, _ in results if encoding_mode == 'cached')
+        print(f"OFX parse cache: {cache_hits} of {len(results)} file(s) loaded from cache.")
+        evict_ofx_cache(OFX_PARSER_VERSION)
+    return parsed_files
+
+
+def _combine_parsed_files(parsed_files: list) -> pd.DataFrame:
+    """Concatenates the DataFrames returned by _parse_ofx_file_list, enforcing the final column order."""
+    final_columns_expected = [COLUMN_ID, COLUMN_DATE, COLUMN_TYPE, COLUMN_AMOUNT, COLUMN_MEMO, COLUMN_ACCOUNT_TYPE]
+    all_dfs = [df for _, _, df, _ in parsed_files if not df.empty]
+
     if not all_dfs:
         print("No data parsed from any OFX file across all subdirectories.")
         return pd.DataFrame(columns=final_columns_expected)
@@ -184,11 +294,39 @@ def parse_ofx_files_to_dataframe(base_resources_files_path: str) -> pd.DataFrame
         if col not in combined_df.columns:
             combined_df[col] = pd.NA # Or appropriate default
             
-    combined_df = combined_df[final_columns_expected] # Enforce column order and selection
+    # Enforce column order and selection; source_id is only there after de-duplication
+    combined_df = combined_df[final_columns_expected + [col for col in [COLUMN_SOURCE_ID] if col in combined_df.columns]]
     print(f"Successfully combined OFX files from subdirectories into a DataFrame with shape {combined_df.shape}.")
     return combined_df
 
 
+def parse_ofx_files_to_dataframe(base_resources_files_path: str, parallel: bool = False,
+                                 max_workers: int = None) -> pd.DataFrame:
+    """
+    Processes all OFX files from predefined subdirectories (account types)
+    within the given base_resources_files_path, adds 'account_type',
+    and concatenates them into a single DataFrame.
+
+    With parallel=True the files are parsed on a process pool of max_workers
+    processes (defaults to the CPU count). The result is identical to the
+    sequential mode, including the order of the rows.
+    """
+    final_columns_expected = [COLUMN_ID, COLUMN_DATE, COLUMN_TYPE, COLUMN_AMOUNT, COLUMN_MEMO, COLUMN_ACCOUNT_TYPE]
+
+    if not os.path.isdir(base_resources_files_path):
+        print(f"Error: Base OFX resources directory not found: {base_resources_files_path}")
+        return pd.DataFrame(columns=final_columns_expected)
+
+    ofx_files_with_account = _collect_ofx_files(base_resources_files_path, ACCOUNT_TYPE_SUBDIRS)
+    if not ofx_files_with_account:
+        print(f"No OFX files found in any of the specified subdirectories within {base_resources_files_path}")
+        # Return an empty DataFrame with all expected columns, including account_type
+        return pd.DataFrame(columns=final_columns_expected)
+
+    parsed_files = _parse_ofx_file_list(ofx_files_with_account, parallel=parallel, max_workers=max_workers)
+    return _combine_parsed_files(parsed_files)
+
+
 # Moved from spending.py
 def _load_user_defined_categories(user_categories_file: str) -> pd.DataFrame:
     """Loads user-defined categories from a CSV file."""
@@ -202,10 +340,17 @@ def _load_user_defined_categories(user_categories_file: str) -> pd.DataFrame:
 
 
 # Moved from spending.py
-def _categorize_transactions_internal(df: pd.DataFrame, user_categories_file: str = None) -> pd.DataFrame:
+def _categorize_transactions_internal(df: pd.DataFrame, user_categories_file: str = None,
+                                      user_categories_df: pd.DataFrame = None) -> pd.DataFrame:
     """
-    Adds 'main_category' and 'sub_category' columns to the DataFrame.
-    Prioritizes user-defined categories, then uses the global CATEGORIZATION_RULES.
+    Adds 'main_category' and 'sub_category' columns to the DataFrame, plus 'rule_index',
+    the index of the first rule the memo matches (NO_MATCH if none).
+    Prioritizes user-defined categories (user_categories_df, normally the
+    'user_transaction_categories' table, or else the user_categories_file CSV), then uses
+    the global CATEGORIZATION_RULES.
+    Works column-wise: rules are matched over the whole memo column, user categories are
+    joined on id (or, for rows without one, on source_id, their FITID) and the columns are
+    assigned at once.
     This internal version now expects COLUMN_ACCOUNT_TYPE to potentially be present and usable.
     """
     if COLUMN_MEMO not in df.columns and COLUMN_ID not in df.columns:
@@ -217,60 +362,79 @@ def _categorize_transactions_internal(df: pd.DataFrame, user_categories_file: st
 
     df[COLUMN_MAIN_CATEGORY] = 'Não Categorizado'
     df[COLUMN_SUB_CATEGORY] = 'Não Categorizado'
+    if df.empty:
+        df[COLUMN_RULE_INDEX] = pd.Series(dtype='int64')
+        return df
 
-    user_categories_df = _load_user_defined_categories(user_categories_file)
-    user_categories_map = {}
-    if not user_categories_df.empty and COLUMN_ID in user_categories_df.columns:
-        for _, row in user_categories_df.iterrows():
-            user_categories_map[row[COLUMN_ID]] = (row[COLUMN_MAIN_CATEGORY], row[COLUMN_SUB_CATEGORY])
-
-    for index, row in df.iterrows():
-        transaction_id = row.get(COLUMN_ID)
-
-        if transaction_id and transaction_id in user_categories_map:
-            main_cat, sub_cat = user_categories_map[transaction_id]
-            df.loc[index, COLUMN_MAIN_CATEGORY] = main_cat
-            df.loc[index, COLUMN_SUB_CATEGORY] = sub_cat
-            continue
-
-        if COLUMN_MEMO in row:
-            memo = str(row[COLUMN_MEMO]).lower()
-            if not memo or pd.isna(row[COLUMN_MEMO]):
-                continue
-
-            for keywords, category_name in CATEGORIZATION_RULES:
-                all_keywords_found = True
-                for keyword in keywords:
-                    if keyword.lower() not in memo:
-                        all_keywords_found = False
-                        break
-
-                if all_keywords_found:
-                    main_cat, sub_cat = category_name
-                    df.loc[index, COLUMN_MAIN_CATEGORY] = main_cat
-                    df.loc[index, COLUMN_SUB_CATEGORY] = sub_cat
-                    break
+    main_categories = np.full(len(df), 'Não Categorizado', dtype=object)
+    sub_categories = np.full(len(df), 'Não Categorizado', dtype=object)
+    rule_indices = np.full(len(df), NO_MATCH, dtype=np.int64)
+
+    # Rule matches over the memo column; missing and empty memos stay uncategorized
+    if COLUMN_MEMO in df.columns:
+        memos = df[COLUMN_MEMO]
+        has_memo = (memos.notna() & (memos.astype(str) != '')).to_numpy()
+        if has_memo.any():
+            # First matching rule wins, every keyword of a rule required (see categorization_engine)
+            rule_set = get_default_rule_set()
+            memo_cache = load_memo_cache(rule_set.fingerprint) if USE_MEMO_CATEGORY_CACHE else {}
+            cached_memos = len(memo_cache)
+            memo_values = memos[has_memo].astype(str).tolist()
+            memo_rule_indices = rule_set.match_all(memo_values, memo_cache)
+            print(f"Matched {len(memo_cache) - cached_memos} new distinct memos against the rules "
+                  f"({len(memo_values)} transactions, {cached_memos} memos cached).")
+            if USE_MEMO_CATEGORY_CACHE and len(memo_cache) > cached_memos:
+                store_memo_cache(memo_cache, rule_set.fingerprint, keep_memos=[memo.lower() for memo in memo_values])
+            # NO_MATCH (-1) picks the trailing 'Não Categorizado' entry
+            main_by_rule = np.array([main for main, _ in rule_set.categories] + ['Não Categorizado'], dtype=object)
+            sub_by_rule = np.array([sub for _, sub in rule_set.categories] + ['Não Categorizado'], dtype=object)
+            main_categories[has_memo] = main_by_rule[memo_rule_indices]
+            sub_categories[has_memo] = sub_by_rule[memo_rule_indices]
+            rule_indices[has_memo] = memo_rule_indices
+
+    # User-defined categories win over the rules; the last row of a repeated id counts
+    if user_categories_df is None:
+        user_categories_df = _load_user_defined_categories(user_categories_file)
+    if not user_categories_df.empty and COLUMN_ID in user_categories_df.columns and COLUMN_ID in df.columns:
+        user_categories_df = user_categories_df.drop_duplicates(subset=[COLUMN_ID], keep='last')
+        user_ids = pd.Index(user_categories_df[COLUMN_ID])
+        transaction_ids = df[COLUMN_ID].tolist()
+        user_positions = user_ids.get_indexer(transaction_ids)
+        # Empty ids never take a user category
+        user_positions[[not pd.isna(transaction_id) and not transaction_id for transaction_id in transaction_ids]] = -1
+        if COLUMN_SOURCE_ID in df.columns:
+            # Rows stored under a derived id take the category given to their FITID
+            source_ids = df[COLUMN_SOURCE_ID].tolist()
+            source_positions = user_ids.get_indexer(source_ids)
+            source_positions[[not pd.isna(source_id) and not source_id for source_id in source_ids]] = -1
+            user_positions = np.where(user_positions >= 0, user_positions, source_positions)
+        has_user_category = user_positions >= 0
+        matched_rows = user_positions[has_user_category]
+        main_categories[has_user_category] = user_categories_df[COLUMN_MAIN_CATEGORY].to_numpy(dtype=object)[matched_rows]
+        sub_categories[has_user_category] = user_categories_df[COLUMN_SUB_CATEGORY].to_numpy(dtype=object)[matched_rows]
+
+    df[COLUMN_MAIN_CATEGORY] = main_categories
+    df[COLUMN_SUB_CATEGORY] = sub_categories
+    # Kept even when a user category wins, so a rule change can find the rows it may affect
+    df[COLUMN_RULE_INDEX] = rule_indices
     return df
 
 
-def get_categorized_transactions() -> pd.DataFrame: # Removed arguments as paths are now module-level constants
+def _categorize_raw_transactions(raw_transactions_df: pd.DataFrame, user_categories_df: pd.DataFrame = None) -> pd.DataFrame:
     """
-    Parses all OFX files from predefined subdirectories, adds account_type, 
-    categorizes them, and returns a unified DataFrame.
+    Categorizes parsed transactions, returning an empty DataFrame with every final column if there are none.
+    User categories come from user_categories_df when given, from the CSV otherwise.
     """
-    print(f"Starting OFX processing and categorization from base path: {BASE_OFX_FILES_PATH}")
-    # Pass the new base path to the updated parsing function
-    raw_transactions_df = parse_ofx_files_to_dataframe(BASE_OFX_FILES_PATH)
-
     if raw_transactions_df.empty:
         print("No transactions parsed from OFX files. Returning empty DataFrame.")
         empty_df_cols = [COLUMN_ID, COLUMN_DATE, COLUMN_TYPE, COLUMN_AMOUNT, COLUMN_MEMO,
-                         COLUMN_ACCOUNT_TYPE, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY]
+                         COLUMN_ACCOUNT_TYPE, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, COLUMN_RULE_INDEX]
         return pd.DataFrame(columns=empty_df_cols)
 
     print(f"Successfully parsed {len(raw_transactions_df)} raw transactions including account types.")
     print("Categorizing transactions...")
-    categorized_df = _categorize_transactions_internal(raw_transactions_df.copy(), USER_CATEGORIES_CSV_PATH)
+    categorized_df = _categorize_transactions_internal(raw_transactions_df.copy(), USER_CATEGORIES_CSV_PATH,
+                                                       user_categories_df)
 
     if categorized_df.empty:
         print("DataFrame is empty after categorization attempt.")
@@ -279,102 +443,207 @@ def get_categorized_transactions() -> pd.DataFrame: # Removed arguments as paths
     return categorized_df
 
 
+def get_categorized_transactions(parallel: bool = False, max_workers: int = None) -> pd.DataFrame: # Paths are module-level constants
+    """
+    Parses all OFX files from predefined subdirectories, adds account_type, 
+    categorizes them, and returns a unified DataFrame.
+    parallel/max_workers are forwarded to parse_ofx_files_to_dataframe.
+    """
+    print(f"Starting OFX processing and categorization from base path: {BASE_OFX_FILES_PATH}")
+    # Pass the new base path to the updated parsing function
+    raw_transactions_df = parse_ofx_files_to_dataframe(BASE_OFX_FILES_PATH, parallel=parallel, max_workers=max_workers)
+    return _categorize_raw_transactions(raw_transactions_df)
+
+
 # Path definitions
 # Corrected: three levels up to project root, then to /resources/files/
 BASE_OFX_FILES_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resources", "files") 
 USER_CATEGORIES_CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resources", "user_defined_categories.csv")
 
-def parse_ofx_files_and_write_to_db(target_db: str = "local", if_exists_strategy: str = "replace"):
+
+def _upsert_transaction_categories(conn, transactions_df: pd.DataFrame):
+    """Inserts the (main_category, sub_category) pairs used by transactions_df that are not in 'transaction_categories' yet."""
+    if COLUMN_MAIN_CATEGORY not in transactions_df.columns or COLUMN_SUB_CATEGORY not in transactions_df.columns:
+        print("Warning: Main category or sub category columns not found in transactions DataFrame. Cannot populate 'transaction_categories' table.")
+        return
+
+    unique_categories_df = transactions_df[[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY]].drop_duplicates().copy()
+    # Remove rows where main_category or sub_category might be None or empty, if necessary
+    unique_categories_df.dropna(subset=[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY], inplace=True)
+    # Placeholder pairs ('Não Categorizado', 'Erro - Sem Info Suficiente') are kept on purpose:
+    # ofx_transactions references this table with a foreign key, which MySQL enforces.
+
+    if unique_categories_df.empty:
+        print("No valid unique categories found in transactions to upsert.")
+        return
+
+    print(f"Found {len(unique_categories_df)} unique valid category pairs to upsert into 'transaction_categories'.")
+    try:
+        # For SQLite, to_sql with 'append' will raise IntegrityError for duplicate PKs.
+        # For MySQL, INSERT IGNORE or ON DUPLICATE KEY UPDATE would be better for upsert.
+        # Pandas to_sql doesn't directly support INSERT IGNORE.
+        # A common workaround is to iterate and insert, or fetch existing and insert new.
+        # Let's try a safer approach: fetch existing, then insert new ones.
+        
+        existing_categories_df = pd.read_sql("SELECT main_category, sub_category FROM transaction_categories", conn)
+        existing_tuples = set(tuple(x) for x in existing_categories_df.to_numpy())
+        
+        categories_to_insert = []
+        for index, row in unique_categories_df.iterrows():
+            cat_tuple = (row[COLUMN_MAIN_CATEGORY], row[COLUMN_SUB_CATEGORY])
+            if cat_tuple not in existing_tuples:
+                categories_to_insert.append(cat_tuple)
+
+        if categories_to_insert:
+            new_categories_df = pd.DataFrame(categories_to_insert, columns=[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
+            new_categories_df.to_sql(
+                name='transaction_categories',
+                con=conn,
+                if_exists='append',
+                index=False,
+                chunksize=500
+            )
+            print(f"Successfully wrote {len(new_categories_df)} new unique categories to 'transaction_categories' table.")
+        else:
+            print("No new categories to insert into 'transaction_categories'. All found categories already exist.")
+
+    except Exception as cat_e:
+        print(f"Error writing categories to database: {cat_e}")
+        # Decide if you want to proceed if categories fail to write.
+        # For now, we will proceed to write transactions.
+
+
+def _write_categorized_transactions(conn, transactions_df: pd.DataFrame, if_exists_strategy: str):
+    """
+    Writes categorized transactions to 'ofx_transactions', first making sure their categories exist.
+    The table keeps the schema declared in database_setup: 'replace' clears its rows and loads
+    transactions_df, 'upsert' (or 'append') inserts new ids and updates changed rows.
+    """
+    # Step 1: Prepare and upsert categories
+    _upsert_transaction_categories(conn, transactions_df)
+
+    # Step 2: Write transactions to 'ofx_transactions' table
+    print(f"Attempting to write {len(transactions_df)} transactions to database table 'ofx_transactions'...")
+    upsert_ofx_transactions(conn, transactions_df, replace_all=(if_exists_strategy == "replace"))
+    print(f"Successfully wrote {len(transactions_df)} transactions to 'ofx_transactions' table using '{if_exists_strategy}' strategy.")
+
+
+def _count_ofx_transactions(conn) -> int:
+    """Returns the number of rows in 'ofx_transactions', or 0 if the table does not exist."""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM ofx_transactions")
+        return cursor.fetchone()[0]
+    except Exception:
+        return 0
+
+
+def ingest_ofx_files(conn, if_exists_strategy: str = "replace", parallel: bool = False,
+                     max_workers: int = None, incremental: bool = False) -> int:
+    """
+    Parses, categorizes and writes OFX files to 'ofx_transactions' over an open connection,
+    which is left open so long-running callers can reuse it. Returns the number of files parsed.
+
+    Every parsed file is recorded in the 'ofx_file_manifest' table. With incremental=True,
+    files whose size/mtime or content hash match the manifest are skipped and the
+    transactions of new or changed files are upserted (if_exists_strategy is ignored).
+
+    Transactions already ingested from another statement are dropped before categorization
+    (see ofx_dedup.py); a full run rebuilds the 'ofx_transaction_index' from scratch.
+    An incremental run first recategorizes the stored transactions affected by rule changes
+    since the last run (see recategorization.py). Transactions left uncategorized then get
+    a predicted category when the classifier is confident enough (see category_classifier.py).
+    Rows stored under an id derived from a repeated FITID get their own copy of the user
+    category of that FITID (see user_categories.py).
+    Every transaction gets the id of its normalized merchant (see merchants.py); stored rows
+    without one are backfilled. Errors are raised to the caller.
+    """
+    # Imported here: these modules build on this module's categorization helpers
+    from .recategorization import recategorize_stored_transactions, save_rule_snapshot
+    from .category_classifier import classify_uncategorized_transactions
+    from .user_categories import load_user_categories, copy_user_categories_to_derived_ids
+    from .merchants import MerchantRegistry, assign_merchant_ids, backfill_merchant_ids
+
+    manifest = load_ofx_manifest(conn) if incremental else {}
+    dedup_index = TransactionDedupIndex().load(conn)
+    merchant_registry = MerchantRegistry().load(conn)
+    if manifest and _count_ofx_transactions(conn) == 0:
+        print("Warning: 'ofx_transactions' is empty but the file manifest is not. Re-ingesting every OFX file.")
+        manifest = {}
+    elif manifest and len(dedup_index) == 0:
+        print("Warning: the transaction index is empty but the file manifest is not. Re-ingesting every OFX file.")
+        manifest = {}
+    rebuild_index = not manifest
+    if rebuild_index:
+        dedup_index = TransactionDedupIndex()
+
+    if manifest:
+        # Stored rows categorized with an older rule list are brought up to date first
+        recategorize_stored_transactions(conn, commit=False)
+
+    ofx_files_with_account = _collect_ofx_files(BASE_OFX_FILES_PATH, ACCOUNT_TYPE_SUBDIRS)
+    changed_files, touched_entries, removed_keys, unchanged_count = diff_ofx_manifest(
+        ofx_files_with_account, manifest, BASE_OFX_FILES_PATH)
+    if incremental:
+        print(f"Manifest check: {len(changed_files)} new or changed file(s), {unchanged_count} unchanged, "
+              f"{len(removed_keys)} no longer on disk.")
+
+    parsed_files = []
+    if changed_files:
+        parsed_files = _parse_ofx_file_list([(file_path, account_type_name) for file_path, account_type_name, _ in changed_files],
+                                            parallel=parallel, max_workers=max_workers)
+        source_keys = [fingerprint['file_path'] for _, _, fingerprint in changed_files]
+        deduplicated_files = deduplicate_parsed_files(parsed_files, dedup_index, source_keys)
+        if all(df.empty for _, _, df, _ in deduplicated_files):
+            transactions_df = pd.DataFrame()
+        else:
+            transactions_df = _categorize_raw_transactions(_combine_parsed_files(deduplicated_files),
+                                                           load_user_categories(conn))
+
+        if transactions_df.empty:
+            print("No transactions to process or write to the database.")
+        else:
+            print(f"Processed {len(transactions_df)} transactions initially.")
+            transactions_df = assign_merchant_ids(transactions_df, merchant_registry)
+            merchant_registry.save(conn)
+            _write_categorized_transactions(conn, transactions_df, "upsert" if incremental else if_exists_strategy)
+            copy_user_categories_to_derived_ids(conn)
+    else:
+        print("All OFX files are up to date. Nothing to parse.")
+
+    manifest_entries = [
+        build_manifest_entry(fingerprint, account_type_name, parse_seconds, len(df))
+        for (_, account_type_name, fingerprint), (_, _, df, parse_seconds) in zip(changed_files, parsed_files)
+    ]
+    if not incremental:
+        clear_ofx_manifest(conn)
+    save_ofx_manifest_entries(conn, manifest_entries + touched_entries)
+    dedup_index.save(conn, replace_all=rebuild_index)
+    remove_ofx_manifest_entries(conn, removed_keys)
+    backfill_merchant_ids(conn, merchant_registry)
+    if USE_CATEGORY_CLASSIFIER:
+        classify_uncategorized_transactions(conn, commit=False)
+    save_rule_snapshot(conn, get_default_rule_set())
+    conn.commit()
+    return len(changed_files)
+
+
+def parse_ofx_files_and_write_to_db(target_db: str = "local", if_exists_strategy: str = "replace",
+                                    parallel: bool = False, max_workers: int = None, incremental: bool = False):
     """
     Processes OFX files, categorizes transactions, and writes the result to
-    the 'ofx_transactions' table in the specified database.
+    the 'ofx_transactions' table in the specified database (see ingest_ofx_files).
     """
     print(f"Starting OFX processing for database target: {target_db}")
-    # get_categorized_transactions now uses module-level constants for paths
-    transactions_df = get_categorized_transactions()
-
-    if transactions_df.empty:
-        print("No transactions to process or write to the database.")
+    if not os.path.isdir(BASE_OFX_FILES_PATH):
+        print(f"Error: Base OFX resources directory not found: {BASE_OFX_FILES_PATH}")
         return
 
-    print(f"Processed {len(transactions_df)} transactions initially.")
-
     conn = None
     try:
         conn = db_connect(target_db=target_db)
-        cursor = conn.cursor() # Get a cursor for manual operations if needed
-
-        # Step 1: Prepare and upsert categories
-        if COLUMN_MAIN_CATEGORY in transactions_df.columns and COLUMN_SUB_CATEGORY in transactions_df.columns:
-            unique_categories_df = transactions_df[[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY]].drop_duplicates().copy()
-            # Remove rows where main_category or sub_category might be None or empty, if necessary
-            unique_categories_df.dropna(subset=[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY], inplace=True)
-            # Filter out placeholder categories if they are not desired in the categories table
-            placeholder_main = 'Não Categorizado'
-            placeholder_sub = 'Não Categorizado'
-            error_placeholder_main = 'Erro - Sem Info Suficiente' 
-            error_placeholder_sub = 'Erro - Sem Info Suficiente'
-
-            unique_categories_df = unique_categories_df[
-                ~((unique_categories_df[COLUMN_MAIN_CATEGORY] == placeholder_main) & (unique_categories_df[COLUMN_SUB_CATEGORY] == placeholder_sub)) &
-                ~((unique_categories_df[COLUMN_MAIN_CATEGORY] == error_placeholder_main) & (unique_categories_df[COLUMN_SUB_CATEGORY] == error_placeholder_sub))
-            ]
-
-            if not unique_categories_df.empty:
-                print(f"Found {len(unique_categories_df)} unique valid category pairs to upsert into 'transaction_categories'.")
-                try:
-                    # For SQLite, to_sql with 'append' will raise IntegrityError for duplicate PKs.
-                    # For MySQL, INSERT IGNORE or ON DUPLICATE KEY UPDATE would be better for upsert.
-                    # Pandas to_sql doesn't directly support INSERT IGNORE.
-                    # A common workaround is to iterate and insert, or fetch existing and insert new.
-                    # Let's try a safer approach: fetch existing, then insert new ones.
-                    
-                    existing_categories_df = pd.read_sql("SELECT main_category, sub_category FROM transaction_categories", conn)
-                    existing_tuples = set(tuple(x) for x in existing_categories_df.to_numpy())
-                    
-                    categories_to_insert = []
-                    for index, row in unique_categories_df.iterrows():
-                        cat_tuple = (row[COLUMN_MAIN_CATEGORY], row[COLUMN_SUB_CATEGORY])
-                        if cat_tuple not in existing_tuples:
-                            categories_to_insert.append(cat_tuple)
-
-                    if categories_to_insert:
-                        new_categories_df = pd.DataFrame(categories_to_insert, columns=[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
-                        new_categories_df.to_sql(
-                            name='transaction_categories',
-                            con=conn,
-                            if_exists='append',
-                            index=False,
-                            chunksize=500
-                        )
-                        print(f"Successfully wrote {len(new_categories_df)} new unique categories to 'transaction_categories' table.")
-                    else:
-                        print("No new categories to insert into 'transaction_categories'. All found categories already exist.")
-
-                except Exception as cat_e:
-                    print(f"Error writing categories to database: {cat_e}")
-                    # Decide if you want to proceed if categories fail to write.
-                    # For now, we will proceed to write transactions.
-            else:
-                print("No valid unique categories found in transactions to upsert.")
-        else:
-            print("Warning: Main category or sub category columns not found in transactions DataFrame. Cannot populate 'transaction_categories' table.")
-
-        # Step 2: Write transactions to 'ofx_transactions' table
-        print(f"Attempting to write {len(transactions_df)} transactions to database table 'ofx_transactions'...")
-        # Standardize Date format for SQLite compatibility if not already
-        if 'date' in transactions_df.columns:
-            transactions_df['date'] = pd.to_datetime(transactions_df['date']).dt.strftime('%Y-%m-%d')
-
-        transactions_df.to_sql(
-            name='ofx_transactions',
-            con=conn,
-            if_exists=if_exists_strategy, # 'replace', 'append', or 'fail'
-            index=False,
-            chunksize=1000 # Optional: for large DataFrames
-        )
-        print(f"Successfully wrote {len(transactions_df)} transactions to 'ofx_transactions' table using '{if_exists_strategy}' strategy.")
-
+        ingest_ofx_files(conn, if_exists_strategy=if_exists_strategy, parallel=parallel,
+                         max_workers=max_workers, incremental=incremental)
     except Exception as e:
         print(f"Error writing transactions to database: {e}")
     finally:
@@ -383,12 +652,17 @@ def parse_ofx_files_and_write_to_db(target_db: str = "local", if_exists_strategy
             print("Database connection closed.")
 
 # This is the function that spending.py currently calls.
-def parse_ofx_files(target_db: str = "local"): 
+def parse_ofx_files(target_db: str = "local", parallel: bool = False, max_workers: int = None,
+                    incremental: bool = True):
     """
     Main function to process OFX files and store them in the database.
+    Set parallel=True to parse the files on a pool of max_workers processes.
+    By default only new or changed files are parsed and upserted (see 'ofx_file_manifest');
+    incremental=False re-parses everything and replaces the table.
     """
     print("parse_ofx_files called, initiating data processing and DB write...")
-    parse_ofx_files_and_write_to_db(target_db=target_db, if_exists_strategy="replace")
+    parse_ofx_files_and_write_to_db(target_db=target_db, if_exists_strategy="replace",
+                                    parallel=parallel, max_workers=max_workers, incremental=incremental)
     print("parse_ofx_files: OFX data processing and database write attempt completed.")
 
 # Example of how this module could be run directly (for testing)
@@ -0,0 +1,269 @@
+'''
+Lightweight streaming reader for the OFX statements Nubank emits (SGML 1.x and XML 2.x).
+
+Instead of building the ofxparse/BeautifulSoup object tree, the file is decoded and
+tokenized in fixed-size chunks and each <STMTTRN> is turned directly into an
+(id, date, type, amount, memo) tuple. Values are converted with the same rules as
+ofxparse, so the resulting columns match what the ofxparse path produces.
+
+Anything outside that simple shape (several statements, investment statements,
+malformed fields, ...) raises UnsupportedOfxError so the caller can fall back to ofxparse.
+'''
+import codecs
+import html
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+_CHUNK_SIZE = 64 * 1024
+_HEADER_READ_SIZE = 1024 * 10
+
+# Tags are matched the way ofxparse's preprocessor does; '<?...?>' and '<!...>' are skipped
+_TOKEN_RE = re.compile(r'<([/?!]?)([^<>]*)>')
+_TAG_NAME_RE = re.compile(r'^[A-Za-z0-9_.]+$')
+_TZ_RE = re.compile(r"\[(?P<tz>[-+]?\d+\.?\d*)\:\w*\]$")
+_FRACTION_RE = re.compile(r"^[0-9]*\.([0-9]{0,5})")
+
+_STATEMENT_TAGS = {'STMTRS', 'CCSTMTRS'}
+_UNSUPPORTED_TAGS = {'INVSTMTRS', 'ACCTINFORS'}
+_TRANSACTION_FIELDS = {'TRNTYPE', 'DTPOSTED', 'TRNAMT', 'FITID', 'MEMO', 'NAME', 'DTUSER', 'SIC', 'CHECKNUM'}
+
+
+class UnsupportedOfxError(Exception):
+    """Raised when a file is outside what the streaming reader handles; use ofxparse instead."""
+
+
+def _detect_encoding(head: bytes) -> str:
+    """Maps the OFX SGML headers to a Python codec, following ofxparse's rules."""
+    head = head[:head.find(b'<')] if b'<' in head else head
+    headers = {}
+    for line in head.splitlines():
+        if line.strip() == b"":
+            break
+        parts = line.split(b":")
+        if len(parts) != 2:
+            raise UnsupportedOfxError(f"Unexpected header line {line!r}")
+        headers[parts[0].strip().upper().decode('ascii', 'replace')] = parts[1].strip().decode('ascii', 'replace')
+
+    enc_type = headers.get('ENCODING')
+    if not enc_type:
+        return 'ascii'
+    if enc_type == "USASCII":
+        charset = headers.get("CHARSET", "1252")
+        return "iso-8859-1" if charset == "8859-1" else f"cp{charset}"
+    if enc_type in ("UNICODE", "UTF-8"):
+        return "utf-8"
+    raise UnsupportedOfxError(f"Unknown OFX ENCODING header '{enc_type}'")
+
+
+def _iter_text_segments(file_path: str, encoding: str = None):
+    """
+    Yields the decoded file in segments that never cut through a tag: every segment
+    but the first starts with '<' and contains all the text up to the next segment.
+    The charset declared in the headers is used unless encoding is given.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(_HEADER_READ_SIZE)
+        encoding = encoding or _detect_encoding(head)
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)()
+        except LookupError as e:
+            raise UnsupportedOfxError(f"Unknown charset: {e}")
+
+        buffer = decoder.decode(head)
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += decoder.decode(chunk)
+            cut = buffer.rfind('<')
+            if cut > 0:
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        buffer += decoder.decode(b'', final=True)
+        if buffer:
+            yield buffer
+
+
+def _to_float_amount(value: str) -> float:
+    """Converts TRNAMT text with the number-format rules of ofxparse's toDecimal."""
+    d = value.strip()
+    if re.search(r'.*\..*,', d):
+        d = d.replace('.', '')
+    if re.search(r'.*,.*\.', d):
+        d = d.replace(',', '')
+    if '.' not in d and ',' in d:
+        d = d.replace(',', '.')
+    d = d.replace(' ', '').replace('+', '')
+    if d in ('null', '-null'):
+        return 0.0
+    try:
+        return float(d)
+    except ValueError:
+        raise UnsupportedOfxError(f"Invalid transaction amount '{value}'")
+
+
+def _ofx_datetime_to_day(value: str) -> str:
+    """
+    Returns the ISO day ('YYYY-MM-DD') of an OFX date-time, converted to UTC exactly
+    like ofxparse.parseOfxDateTime (e.g. '20201026000000[-3:BRT]' -> '2020-10-26').
+    """
+    tz_match = _TZ_RE.search(value)
+    tz_hours = float(tz_match.group('tz')) if tz_match else 0
+    fraction_match = _FRACTION_RE.search(value)
+    fraction = float("0." + fraction_match.group(1)) if fraction_match else 0
+
+    try:
+        digits = value[:14]
+        if len(digits) == 14 and digits.isdigit():
+            local_date = datetime(int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+                                  int(digits[8:10]), int(digits[10:12]), int(digits[12:14]))
+        else:
+            local_date = datetime.strptime(digits, '%Y%m%d%H%M%S')
+    except ValueError:
+        if value[:8] == "00000000":
+            raise UnsupportedOfxError("Empty transaction date")
+        try:
+            local_date = datetime.strptime(value[:8], '%Y%m%d')
+        except ValueError:
+            raise UnsupportedOfxError(f"Invalid transaction date '{value}'")
+
+    if tz_hours == 0 and fraction == 0:
+        return local_date.strftime('%Y-%m-%d')
+    return (local_date - timedelta(hours=tz_hours) + timedelta(seconds=fraction)).strftime('%Y-%m-%d')
+
+
+def _field_text(fields: dict, name: str):
+    """Returns the stripped text of a transaction field, or None if the tag is absent."""
+    text = fields.get(name)
+    if text is None:
+        return None
+    if '<' in text or '>' in text:
+        raise UnsupportedOfxError(f"Markup inside <{name}>")
+    text = text.strip()
+    if '&' in text:
+        text = html.unescape(text)
+    return text
+
+
+def _build_transaction(fields: dict) -> tuple:
+    """Converts the raw fields of one <STMTTRN> into an (id, date, type, amount, memo) tuple."""
+    for optional_name in ('NAME', 'SIC', 'CHECKNUM'):
+        if optional_name in fields and not _field_text(fields, optional_name):
+            raise UnsupportedOfxError(f"Empty <{optional_name}>")
+    if 'DTUSER' in fields:
+        _ofx_datetime_to_day(_field_text(fields, 'DTUSER'))
+
+    transaction_type = _field_text(fields, 'TRNTYPE')
+    amount = _field_text(fields, 'TRNAMT')
+    posted = _field_text(fields, 'DTPOSTED')
+    transaction_id = _field_text(fields, 'FITID')
+    if not transaction_type or not amount or not posted or not transaction_id:
+        raise UnsupportedOfxError("Transaction without type, amount, date or FITID")
+
+    memo = _field_text(fields, 'MEMO') or ''
+    return transaction_id, _ofx_datetime_to_day(posted), transaction_type.lower(), _to_float_amount(amount), memo
+
+
+def iter_ofx_transactions(file_path: str, encoding: str = None):
+    """
+    Streams the transactions of a single-statement bank or credit card OFX file as
+    (id, date, type, amount, memo) tuples, where date is an ISO day string and amount a float.
+    Memos are returned as found in the file (no mojibake repair). encoding overrides the
+    charset declared in the file's headers.
+    Raises UnsupportedOfxError for files that should go through ofxparse instead.
+    """
+    seen_ofx = False
+    statement_count = 0
+    in_statement = False
+    fields = None          # Fields of the <STMTTRN> being read, None outside transactions
+    open_tag = None        # Last opened tag still waiting for its text
+    text_tag = None        # Leaf tag that received text and may or may not be closed explicitly
+    closed_tags = set()
+    unclosed_tags = set()
+
+    carry = ''
+    for segment in _iter_text_segments(file_path, encoding):
+        # Text after the last tag of a segment belongs to the first tag of the next one
+        segment = carry + segment
+        position = 0
+        for match in _TOKEN_RE.finditer(segment):
+            text = segment[position:match.start()]
+            position = match.end()
+            if open_tag is not None:
+                if fields is not None and open_tag in _TRANSACTION_FIELDS and open_tag not in fields:
+                    fields[open_tag] = text
+                if text.strip():
+                    text_tag = open_tag
+
+            marker, body = match.group(1), match.group(2)
+            if marker in ('?', '!'):
+                continue
+            name = body.strip().upper()
+            if not _TAG_NAME_RE.match(name):
+                raise UnsupportedOfxError(f"Unexpected markup '<{marker}{body}>'")
+
+            if text_tag is not None and not (marker == '/' and text_tag == name):
+                unclosed_tags.add(text_tag)
+            text_tag = None
+
+            if marker == '/':
+                closed_tags.add(name)
+                open_tag = None
+                if name in _STATEMENT_TAGS:
+                    in_statement = False
+                elif name == 'STMTTRN' and fields is not None:
+                    yield _build_transaction(fields)
+                    fields = None
+                continue
+
+            open_tag = name
+            if name == 'OFX':
+                seen_ofx = True
+            elif name in _UNSUPPORTED_TAGS:
+                raise UnsupportedOfxError(f"<{name}> is not supported by the streaming reader")
+            elif name in _STATEMENT_TAGS:
+                statement_count += 1
+                if statement_count > 1:
+                    raise UnsupportedOfxError("More than one statement in the file")
+                in_statement = True
+            elif name == 'STMTTRN' and in_statement:
+                if fields is not None:
+                    raise UnsupportedOfxError("Nested or unclosed <STMTTRN>")
+                fields = {}
+        carry = segment[position:]
+
+    if not seen_ofx or statement_count == 0:
+        raise UnsupportedOfxError("No <OFX> statement found")
+    if fields is not None:
+        raise UnsupportedOfxError("Unclosed <STMTTRN>")
+    if closed_tags & unclosed_tags:
+        # ofxparse only auto-closes tags that are never closed explicitly; mixed usage changes its tree
+        raise UnsupportedOfxError(f"Tags both closed and left open: {sorted(closed_tags & unclosed_tags)}")
+
+
+def read_ofx_transaction_columns(file_path: str, encoding: str = None) -> dict:
+    """
+    Reads a statement with iter_ofx_transactions straight into column arrays:
+    {'id', 'type', 'memo'} as lists of str, 'date' as datetime64[D] and 'amount' as float64.
+    Raises UnsupportedOfxError for files that should go through ofxparse instead,
+    including statements without transactions.
+    """
+    ids, days, types, amounts, memos = [], [], [], [], []
+    for transaction_id, day, transaction_type, amount, memo in iter_ofx_transactions(file_path, encoding):
+        ids.append(transaction_id)
+        days.append(day)
+        types.append(transaction_type)
+        amounts.append(amount)
+        memos.append(memo)
+
+    if not ids:
+        raise UnsupportedOfxError("Statement without transactions")
+    return {
+        'id': ids,
+        'date': np.array(days, dtype='datetime64[D]'),
+        'type': types,
+        'amount': np.array(amounts, dtype='float64'),
+        'memo': memos,
+    }
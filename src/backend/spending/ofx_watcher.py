@@ -0,0 +1,94 @@
+'''
+Long-running ingestion of new OFX statements dropped into resources/files/<account>.
+
+The account subdirectories are polled for *.ofx files. Once the set of files (with
+their sizes and mtimes) stops changing for debounce_seconds, ingest_ofx_files runs in
+incremental mode: only new or changed statements are parsed and upserted into
+'ofx_transactions'. One database connection is kept open between runs and reopened
+only after an error.
+'''
+import os
+import time
+
+from .ofx_parser import ingest_ofx_files, is_ofx_file_name, BASE_OFX_FILES_PATH, ACCOUNT_TYPE_SUBDIRS
+from sql.connection import db_connect
+
+DEFAULT_POLL_SECONDS = 2.0
+DEFAULT_DEBOUNCE_SECONDS = 3.0
+
+
+def snapshot_ofx_files(base_resources_files_path: str = BASE_OFX_FILES_PATH,
+                       account_type_subdirs: dict = ACCOUNT_TYPE_SUBDIRS) -> dict:
+    """Returns {file_path: (size, mtime)} for the OFX files of every account subdirectory, without reading them."""
+    snapshot = {}
+    for subdir_name in account_type_subdirs:
+        current_path = os.path.join(base_resources_files_path, subdir_name)
+        if not os.path.isdir(current_path):
+            continue
+        with os.scandir(current_path) as entries:
+            for entry in entries:
+                if entry.is_file() and is_ofx_file_name(entry.name):
+                    stat = entry.stat()
+                    snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+
+def _describe_changes(previous: dict, current: dict) -> str:
+    added = len(set(current) - set(previous))
+    removed = len(set(previous) - set(current))
+    modified = sum(1 for path in set(current) & set(previous) if current[path] != previous[path])
+    return f"{added} added, {modified} modified, {removed} removed"
+
+
+def watch_ofx_files(target_db: str = "local", poll_seconds: float = DEFAULT_POLL_SECONDS,
+                    debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS, max_polls: int = None):
+    """
+    Ingests pending statements once, then keeps ingesting new or changed ones as they
+    arrive until interrupted (Ctrl+C) or, if given, after max_polls polls.
+    """
+    print(f"Watching {os.path.abspath(BASE_OFX_FILES_PATH)} ({', '.join(ACCOUNT_TYPE_SUBDIRS)}) "
+          f"every {poll_seconds}s, debounce {debounce_seconds}s, target database: {target_db}")
+    conn = None
+    last_snapshot = None
+    changed_at = time.monotonic() - debounce_seconds   # Catch-up run on the first poll
+    polls = 0
+
+    try:
+        while max_polls is None or polls < max_polls:
+            if polls:
+                time.sleep(poll_seconds)
+            polls += 1
+
+            snapshot = snapshot_ofx_files()
+            if last_snapshot is not None and snapshot != last_snapshot:
+                print(f"Change detected in OFX files ({_describe_changes(last_snapshot, snapshot)}). "
+                      f"Waiting for them to settle...")
+                changed_at = time.monotonic()
+            last_snapshot = snapshot
+
+            if changed_at is None or time.monotonic() - changed_at < debounce_seconds:
+                continue
+
+            start_time = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = db_connect(target_db=target_db)
+                parsed_count = ingest_ofx_files(conn, incremental=True)
+                changed_at = None
+                print(f"Ingestion finished in {time.perf_counter() - start_time:.2f}s "
+                      f"({parsed_count} file(s) parsed). Watching for new statements...")
+            except Exception as e:
+                # Retried on the next poll with a fresh connection
+                print(f"Error ingesting OFX files: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+    except KeyboardInterrupt:
+        print("Stopping the OFX watcher.")
+    finally:
+        if conn is not None:
+            conn.close()
+            print("Database connection closed.")
@@ -0,0 +1,110 @@
+'''
+Schema-preserving writer for the 'ofx_transactions' table.
+
+DataFrame.to_sql(if_exists="replace") drops the table created by create_tables_from_ddl,
+losing its primary key on id and its foreign key to transaction_categories. This writer
+keeps the declared table and upserts rows through sql.bulk_load, in batches inside a single
+transaction, on both the SQLite ("local") and MySQL ("remote") connections returned by db_connect.
+'''
+import pandas as pd
+
+from sql.bulk_load import bulk_load, dataframe_to_rows, is_sqlite, ON_CONFLICT_UPDATE
+from sql.schema import get_primary_key_columns, get_table_ddl
+
+OFX_TRANSACTIONS_TABLE = 'ofx_transactions'
+OFX_TRANSACTION_COLUMNS = ['id', 'date', 'type', 'amount', 'memo', 'account_type', 'main_category', 'sub_category',
+                           'rule_index', 'category_confidence', 'merchant_id', 'source_id']
+# Columns added after the table was first declared, with their types, for tables created before them
+_ADDED_COLUMNS = {'rule_index': 'INT', 'category_confidence': 'DOUBLE', 'merchant_id': 'INT',
+                  'source_id': 'VARCHAR(255)'}
+# Remembers the OFX FITID of every stored id (see ofx_dedup.py)
+_TRANSACTION_INDEX_TABLE = 'ofx_transaction_index'
+
+
+def _get_column_names(conn, table_name: str) -> list:
+    """Returns the column names of an existing table."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {table_name} WHERE 1 = 0")
+    cursor.fetchall()
+    return [description[0] for description in cursor.description]
+
+
+def ensure_ofx_transactions_schema(conn):
+    """
+    Makes sure 'ofx_transactions' exists with the schema declared in database_setup.
+
+    A missing table is created. A table left behind by an earlier to_sql(if_exists="replace")
+    (no primary key) is rebuilt: its rows are copied into a freshly created table, keeping the
+    last row for each duplicated id. Columns declared after an existing table was created
+    are added to it.
+    """
+    primary_key = get_primary_key_columns(conn, OFX_TRANSACTIONS_TABLE)
+    if primary_key == ['id']:
+        _add_missing_columns(conn)
+        return
+
+    cursor = conn.cursor()
+    if primary_key is None:
+        print(f"Table '{OFX_TRANSACTIONS_TABLE}' not found. Creating it from the declared DDL...")
+        cursor.execute(get_table_ddl(OFX_TRANSACTIONS_TABLE))
+        conn.commit()
+        return
+
+    legacy_table = f"{OFX_TRANSACTIONS_TABLE}_legacy"
+    legacy_columns = _get_column_names(conn, OFX_TRANSACTIONS_TABLE)
+    column_list = ', '.join(col for col in OFX_TRANSACTION_COLUMNS if col in legacy_columns)
+    print(f"Table '{OFX_TRANSACTIONS_TABLE}' has no primary key on id (created by to_sql?). Rebuilding it from the declared DDL...")
+    if is_sqlite(conn):
+        cursor.execute(f"ALTER TABLE {OFX_TRANSACTIONS_TABLE} RENAME TO {legacy_table}")
+        cursor.execute(get_table_ddl(OFX_TRANSACTIONS_TABLE))
+        cursor.execute(f"INSERT OR REPLACE INTO {OFX_TRANSACTIONS_TABLE} ({column_list}) "
+                       f"SELECT {column_list} FROM {legacy_table} ORDER BY rowid")
+    else:
+        cursor.execute(f"RENAME TABLE {OFX_TRANSACTIONS_TABLE} TO {legacy_table}")
+        cursor.execute(get_table_ddl(OFX_TRANSACTIONS_TABLE))
+        cursor.execute(f"REPLACE INTO {OFX_TRANSACTIONS_TABLE} ({column_list}) SELECT {column_list} FROM {legacy_table}")
+    cursor.execute(f"DROP TABLE {legacy_table}")
+    conn.commit()
+    print(f"Rebuilt '{OFX_TRANSACTIONS_TABLE}' with its declared primary and foreign keys.")
+
+
+def _add_missing_columns(conn):
+    """Adds the columns declared after the table was created (see _ADDED_COLUMNS)."""
+    existing_columns = _get_column_names(conn, OFX_TRANSACTIONS_TABLE)
+    missing_columns = [col for col in _ADDED_COLUMNS if col not in existing_columns]
+    if not missing_columns:
+        return
+    cursor = conn.cursor()
+    for col in missing_columns:
+        print(f"Adding missing column '{col}' to '{OFX_TRANSACTIONS_TABLE}'...")
+        cursor.execute(f"ALTER TABLE {OFX_TRANSACTIONS_TABLE} ADD COLUMN {col} {_ADDED_COLUMNS[col]}")
+    if 'source_id' in missing_columns and get_primary_key_columns(conn, _TRANSACTION_INDEX_TABLE) is not None:
+        # Rows stored before the column existed get their FITID back from the de-duplication index
+        cursor.execute(f"UPDATE {OFX_TRANSACTIONS_TABLE} SET source_id = (SELECT i.id FROM {_TRANSACTION_INDEX_TABLE} i "
+                       f"WHERE i.stored_id = {OFX_TRANSACTIONS_TABLE}.id LIMIT 1)")
+        print(f"Backfilled 'source_id' of {cursor.rowcount} rows from '{_TRANSACTION_INDEX_TABLE}'.")
+    conn.commit()
+
+
+def _to_rows(transactions_df: pd.DataFrame) -> list:
+    """Converts the DataFrame to DB-API parameter tuples, with dates as 'YYYY-MM-DD' and NaN as None."""
+    df = transactions_df.reindex(columns=OFX_TRANSACTION_COLUMNS)
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    df['amount'] = df['amount'].astype(float)
+    return dataframe_to_rows(df)
+
+
+def upsert_ofx_transactions(conn, transactions_df: pd.DataFrame, replace_all: bool = False,
+                            batch_size: int = None) -> int:
+    """
+    Inserts new ids and updates changed rows of 'ofx_transactions' in batches of batch_size
+    rows (the bulk loader's default when None), all inside one transaction. With
+    replace_all=True the existing rows are deleted first (in the same transaction), which
+    replaces the table's content but not its schema.
+    When an id appears more than once in transactions_df, the last occurrence wins.
+    Returns the number of rows written.
+    """
+    ensure_ofx_transactions_schema(conn)
+    rows = _to_rows(transactions_df.drop_duplicates(subset=['id'], keep='last'))
+    return bulk_load(conn, OFX_TRANSACTIONS_TABLE, OFX_TRANSACTION_COLUMNS, rows, on_conflict=ON_CONFLICT_UPDATE,
+                     key_columns=['id'], replace_all=replace_all, batch_size=batch_size)
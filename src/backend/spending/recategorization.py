@@ -0,0 +1,181 @@
+'''
+Incremental recategorization of stored transactions after CATEGORIZATION_RULES changes.
+
+Every ingestion records the rule list it categorized with in 'categorization_rule_snapshot'
+(one row per rule: position, fingerprint of keywords and category, keywords, category), and
+every transaction keeps in 'ofx_transactions.rule_index' the first rule its memo matched.
+When the rules change, the snapshot and the current list are compared rule by rule:
+
+- a transaction that matched a rule before the first changed position still matches it,
+  since every rule up to there is unchanged;
+- a transaction that matched no rule can only match a rule whose keywords are new, so it
+  is re-evaluated only if its memo matches one of those rules;
+- everything else (matched at or after the first changed position, or no rule_index
+  stored yet) is re-evaluated.
+
+The affected rows are categorized again from their stored memo, with no OFX parsing, and
+only the rows whose category or rule index changed are updated in place.
+'''
+import json
+
+import numpy as np
+import pandas as pd
+
+from .categorization_engine import CompiledRuleSet, get_default_rule_set, NO_MATCH
+from .category_classifier import classify_uncategorized_transactions
+from .user_categories import load_user_categories
+from .ofx_parser import (_categorize_transactions_internal, _upsert_transaction_categories,
+                         COLUMN_ID, COLUMN_MEMO, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, COLUMN_RULE_INDEX,
+                         COLUMN_CATEGORY_CONFIDENCE, COLUMN_SOURCE_ID)
+from .ofx_writer import OFX_TRANSACTIONS_TABLE, ensure_ofx_transactions_schema
+from sql.bulk_load import bulk_load, placeholder, ON_CONFLICT_UPDATE
+from sql.connection import db_connect
+from sql.schema import get_table_ddl
+
+SNAPSHOT_TABLE = 'categorization_rule_snapshot'
+SNAPSHOT_COLUMNS = ['position', 'rule_fingerprint', 'keywords', 'main_category', 'sub_category']
+
+
+def load_rule_snapshot(conn):
+    """
+    Returns the rules recorded by the last categorization as a list of (fingerprint, keywords),
+    or None if there is none. A missing table is created.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT rule_fingerprint, keywords FROM {SNAPSHOT_TABLE} ORDER BY position")
+        rows = cursor.fetchall()
+    except Exception as e:
+        print(f"Warning: Could not read '{SNAPSHOT_TABLE}' ({e}). Creating it from the declared DDL...")
+        conn.rollback()
+        cursor.execute(get_table_ddl(SNAPSHOT_TABLE))
+        conn.commit()
+        rows = []
+    if not rows:
+        return None
+    return [(fingerprint, json.loads(keywords)) for fingerprint, keywords in rows]
+
+
+def save_rule_snapshot(conn, rule_set: CompiledRuleSet):
+    """Records rule_set as the rules the stored transactions are categorized with. The caller commits."""
+    rows = [(position, fingerprint, json.dumps(list(keywords), ensure_ascii=False), category[0], category[1])
+            for position, (fingerprint, (keywords, category)) in enumerate(zip(rule_set.rule_fingerprints, rule_set.rules))]
+    bulk_load(conn, SNAPSHOT_TABLE, SNAPSHOT_COLUMNS, rows, replace_all=True, commit=False)
+
+
+def _keyword_set(keywords: list) -> frozenset:
+    """The keywords a rule actually tests: lower-cased, empty ones dropped (they match anything)."""
+    return frozenset(keyword.lower() for keyword in keywords if keyword)
+
+
+def diff_rule_lists(snapshot: list, rule_set: CompiledRuleSet):
+    """
+    Compares the snapshot with rule_set. Returns None if they are identical, otherwise
+    (first changed position, CompiledRuleSet of the rules whose keywords are new).
+    """
+    old_fingerprints = [fingerprint for fingerprint, _ in snapshot]
+    if old_fingerprints == rule_set.rule_fingerprints:
+        return None
+    first_changed = next((position for position, (old, new) in enumerate(zip(old_fingerprints, rule_set.rule_fingerprints))
+                          if old != new), min(len(old_fingerprints), len(rule_set.rule_fingerprints)))
+    old_keyword_sets = {_keyword_set(keywords) for _, keywords in snapshot}
+    added_rules = [rule for rule in rule_set.rules if _keyword_set(rule[0]) not in old_keyword_sets]
+    return first_changed, CompiledRuleSet(added_rules)
+
+
+def _load_candidate_transactions(conn, first_changed: int) -> pd.DataFrame:
+    """Reads the stored transactions that matched no rule, a rule at or after first_changed, or have no rule_index."""
+    query = (f"SELECT {COLUMN_ID}, {COLUMN_MEMO}, {COLUMN_MAIN_CATEGORY}, {COLUMN_SUB_CATEGORY}, {COLUMN_RULE_INDEX}, "
+             f"{COLUMN_SOURCE_ID} FROM {OFX_TRANSACTIONS_TABLE}")
+    if first_changed is None:
+        return pd.read_sql(query, conn)
+    return pd.read_sql(f"{query} WHERE {COLUMN_RULE_INDEX} IS NULL OR {COLUMN_RULE_INDEX} >= {placeholder(conn)} "
+                       f"OR {COLUMN_RULE_INDEX} = {placeholder(conn)}", conn, params=(first_changed, NO_MATCH))
+
+
+def recategorize_stored_transactions(conn, rule_set: CompiledRuleSet = None, dry_run: bool = False,
+                                     commit: bool = True) -> int:
+    """
+    Re-evaluates the stored transactions the rule changes since the last snapshot may affect
+    and updates those whose category or rule index changed. Without a snapshot every stored
+    transaction is re-evaluated. Returns the number of rows updated (or that would be, with
+    dry_run=True).
+    """
+    if rule_set is None:
+        rule_set = get_default_rule_set()
+    ensure_ofx_transactions_schema(conn)
+    snapshot = load_rule_snapshot(conn)
+
+    if snapshot is None:
+        print("No rule snapshot found. Re-evaluating every stored transaction...")
+        first_changed, added_rule_set = None, None
+    else:
+        diff = diff_rule_lists(snapshot, rule_set)
+        if diff is None:
+            print("Categorization rules unchanged since the last run. Nothing to recategorize.")
+            return 0
+        first_changed, added_rule_set = diff
+        print(f"Rules changed from position {first_changed} on ({len(snapshot)} -> {len(rule_set.rules)} rules, "
+              f"{len(added_rule_set.rules)} with new keywords).")
+
+    stored_df = _load_candidate_transactions(conn, first_changed)
+    if added_rule_set is not None and not stored_df.empty:
+        # Unmatched memos can only be claimed by a rule with new keywords
+        unmatched = (stored_df[COLUMN_RULE_INDEX] == NO_MATCH).to_numpy()
+        memos = stored_df.loc[unmatched, COLUMN_MEMO]
+        claimed = np.zeros(len(stored_df), dtype=bool)
+        has_memo = (memos.notna() & (memos.astype(str) != '')).to_numpy()
+        if has_memo.any():
+            claimed[np.flatnonzero(unmatched)[has_memo]] = (
+                added_rule_set.match_all(memos[has_memo].astype(str).tolist()) != NO_MATCH)
+        stored_df = stored_df[~unmatched | claimed]
+    print(f"Re-evaluating {len(stored_df)} potentially affected transactions...")
+    if stored_df.empty:
+        if not dry_run:
+            save_rule_snapshot(conn, rule_set)
+            if commit:
+                conn.commit()
+        return 0
+
+    previous = stored_df[[COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, COLUMN_RULE_INDEX]].reset_index(drop=True)
+    recategorized_df = _categorize_transactions_internal(
+        stored_df[[COLUMN_ID, COLUMN_MEMO, COLUMN_SOURCE_ID]].reset_index(drop=True),
+        user_categories_df=load_user_categories(conn))
+    changed = ((recategorized_df[COLUMN_MAIN_CATEGORY] != previous[COLUMN_MAIN_CATEGORY])
+               | (recategorized_df[COLUMN_SUB_CATEGORY] != previous[COLUMN_SUB_CATEGORY])
+               | (recategorized_df[COLUMN_RULE_INDEX] != previous[COLUMN_RULE_INDEX]))
+    updated_df = recategorized_df[changed.to_numpy()]
+    category_changes = int((updated_df[COLUMN_MAIN_CATEGORY] != previous.loc[changed, COLUMN_MAIN_CATEGORY]).sum())
+    print(f"{len(updated_df)} transactions changed ({category_changes} of them changed main category).")
+    if dry_run:
+        return len(updated_df)
+
+    if not updated_df.empty:
+        _upsert_transaction_categories(conn, updated_df)
+        update_columns = [COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, COLUMN_RULE_INDEX]
+        # A category from the rules replaces any predicted one (see category_classifier.py)
+        rows = [row + (None,) for row in updated_df[update_columns].astype(object).itertuples(index=False, name=None)]
+        update_columns.append(COLUMN_CATEGORY_CONFIDENCE)
+        # Every id exists, so the upsert only ever takes its update branch
+        bulk_load(conn, OFX_TRANSACTIONS_TABLE, update_columns, rows, on_conflict=ON_CONFLICT_UPDATE,
+                  key_columns=[COLUMN_ID], commit=False)
+    save_rule_snapshot(conn, rule_set)
+    if commit:
+        conn.commit()
+    return len(updated_df)
+
+
+def recategorize_spending(target_db: str = "local", dry_run: bool = False):
+    """Opens the target database and recategorizes its stored transactions (see recategorize_stored_transactions)."""
+    conn = None
+    try:
+        conn = db_connect(target_db=target_db)
+        recategorize_stored_transactions(conn, dry_run=dry_run)
+        if not dry_run:
+            classify_uncategorized_transactions(conn)
+    except Exception as e:
+        print(f"Error recategorizing transactions: {e}")
+    finally:
+        if conn:
+            conn.close()
+            print("Database connection closed.")
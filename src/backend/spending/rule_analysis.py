@@ -0,0 +1,271 @@
+'''
+Batch analyzer for CATEGORIZATION_RULES.
+
+Runs a set of memos (normally every stored transaction) through the rule list and reports,
+for each rule:
+- hits: transactions it categorizes (it is the first rule they match) and its distinct memos;
+- shadowed_by: an earlier rule that matches every memo this one matches, so it can never
+  fire (each keyword of the earlier rule is contained in a keyword of this one);
+- covered_by: a later rule with the same category that matches every memo this one
+  matches, so it is a candidate for removal (e.g. ['wise brasil'] before ['wise']);
+- removable: no transaction would change category without it, i.e. every memo it
+  categorizes falls through to a rule with the same category;
+- evaluation cost: the mean time of one substring evaluation of the rule, the number of
+  evaluations the original first-match loop spends on it (every transaction not
+  categorized by an earlier rule evaluates it) and their product, plus the number of
+  mask checks the compiled rule set (categorization_engine.py) spends on it.
+Malformed entries (wrong shape, keywords given as a string, category inside the keyword
+list, empty keywords) are listed separately.
+'''
+import time
+
+import numpy as np
+import pandas as pd
+
+from .categorization_engine import CompiledRuleSet, NO_MATCH
+from .categorization_rules import CATEGORIZATION_RULES
+from sql.connection import db_connect
+
+
+def find_malformed_rules(rules: list) -> list:
+    """Returns (position, problem) for every entry that is not a well-formed (keywords, category) rule."""
+    problems = []
+    for position, rule in enumerate(rules):
+        if not isinstance(rule, (tuple, list)) or len(rule) != 2:
+            problems.append((position, f"expected a (keywords, category) tuple, got {rule!r}"))
+            continue
+        keywords, category = rule
+        if isinstance(rule, list):
+            problems.append((position, f"the category tuple is inside the keyword list {rule!r}: the rule "
+                                       f"is read as keywords={keywords!r}, category={category!r}"))
+        if isinstance(keywords, str):
+            problems.append((position, f"keywords is the string {keywords!r}, so each of its characters is "
+                                       f"matched as a separate keyword"))
+        elif not isinstance(keywords, (list, tuple)):
+            problems.append((position, f"keywords is not a list: {keywords!r}"))
+        else:
+            if any(not isinstance(keyword, str) for keyword in keywords):
+                problems.append((position, f"non-string keyword in {keywords!r}"))
+            elif not any(keywords):
+                problems.append((position, "no non-empty keyword: the rule matches every memo"))
+            elif len({keyword.lower() for keyword in keywords}) != len(keywords):
+                problems.append((position, f"repeated keyword in {keywords!r}"))
+        if (not isinstance(category, tuple) or len(category) != 2
+                or not all(isinstance(name, str) and name for name in category)):
+            problems.append((position, f"category is not a (main_category, sub_category) pair: {category!r}"))
+    return problems
+
+
+def _rule_keywords(keywords) -> frozenset:
+    """The keywords a rule tests as the rule set compiles them: lower-cased and non-empty."""
+    try:
+        return frozenset(keyword.lower() for keyword in keywords if keyword)
+    except (AttributeError, TypeError):
+        return None
+
+
+def _implies(keywords: frozenset, other_keywords: frozenset) -> bool:
+    """True if every memo containing all of other_keywords also contains all of keywords."""
+    return all(any(keyword in other for other in other_keywords) for keyword in keywords)
+
+
+def find_shadowed_rules(rules: list) -> dict:
+    """Returns {position: earlier position} for the rules an earlier rule always matches first."""
+    keyword_sets = [_rule_keywords(keywords) for keywords, _ in rules]
+    shadowed = {}
+    for position, keywords in enumerate(keyword_sets):
+        if keywords is None:
+            continue
+        for earlier in range(position):
+            if keyword_sets[earlier] is not None and _implies(keyword_sets[earlier], keywords):
+                shadowed[position] = earlier
+                break
+    return shadowed
+
+
+def find_covered_rules(rules: list) -> dict:
+    """Returns {position: later position} for the rules a later rule with the same category also matches."""
+    keyword_sets = [_rule_keywords(keywords) for keywords, _ in rules]
+    covered = {}
+    for position, keywords in enumerate(keyword_sets):
+        if keywords is None:
+            continue
+        for later in range(position + 1, len(rules)):
+            if (keyword_sets[later] is not None and rules[later][1] == rules[position][1]
+                    and _implies(keyword_sets[later], keywords)):
+                covered[position] = later
+                break
+    return covered
+
+
+def _matching_rules(rule_set: CompiledRuleSet, memos: list) -> list:
+    """Returns, for each lower-cased memo, the indices of every rule it matches, in rule order."""
+    rule_masks = rule_set.rule_masks
+    matches = []
+    for memo in memos:
+        mask = rule_set.keyword_mask(memo)
+        matches.append([rule_index for rule_index, rule_mask in enumerate(rule_masks) if mask & rule_mask == rule_mask])
+    return matches
+
+
+def _count_compiled_checks(rule_set: CompiledRuleSet, memos: list, weights: np.ndarray) -> np.ndarray:
+    """Counts the mask checks CompiledRuleSet.match_lowered spends on each rule, weighted per memo."""
+    checks = np.zeros(len(rule_set.rules), dtype=np.int64)
+    for memo, weight in zip(memos, weights):
+        mask = rule_set.keyword_mask(memo)
+        best = rule_set._first_unconditional_rule
+        remaining = mask
+        while remaining:
+            lowest_bit = remaining & -remaining
+            remaining ^= lowest_bit
+            for rule_index in rule_set._rules_by_anchor[lowest_bit.bit_length() - 1]:
+                if best is not None and rule_index >= best:
+                    break
+                checks[rule_index] += weight
+                if mask & rule_set.rule_masks[rule_index] == rule_set.rule_masks[rule_index]:
+                    best = rule_index
+                    break
+    return checks
+
+
+def _time_substring_evaluation(rules: list, memos: list) -> np.ndarray:
+    """Returns the mean seconds of one `all(keyword in memo ...)` evaluation of each rule over memos."""
+    seconds = np.zeros(len(rules))
+    if not memos:
+        return seconds
+    for position, (keywords, _) in enumerate(rules):
+        keywords = [keyword.lower() for keyword in keywords if isinstance(keyword, str)]
+        start_time = time.perf_counter()
+        for memo in memos:
+            all(keyword in memo for keyword in keywords)
+        seconds[position] = (time.perf_counter() - start_time) / len(memos)
+    return seconds
+
+
+def analyze_rules(memos: list, rules: list = None, measure_cost: bool = True) -> pd.DataFrame:
+    """
+    Runs memos through rules (CATEGORIZATION_RULES by default) and returns one row of
+    statistics per rule (see the module docstring), indexed by rule position.
+    """
+    if rules is None:
+        rules = CATEGORIZATION_RULES
+    rule_set = CompiledRuleSet(rules)
+    memo_series = pd.Series(memos, dtype=object)
+    memo_series = memo_series[memo_series.notna() & (memo_series.astype(str) != '')].astype(str).str.lower()
+    counts = memo_series.value_counts(sort=False)
+    distinct_memos = counts.index.tolist()
+    weights = counts.to_numpy(dtype=np.int64)
+
+    matches = _matching_rules(rule_set, distinct_memos)
+    first_rules = np.array([rule_indices[0] if rule_indices else NO_MATCH for rule_indices in matches], dtype=np.int64)
+    rule_count = len(rules)
+    hit = first_rules != NO_MATCH
+    hits = np.bincount(first_rules[hit], weights=weights[hit], minlength=rule_count).astype(np.int64)
+    distinct_hits = np.bincount(first_rules[hit], minlength=rule_count)
+
+    # A rule is removable if each memo it categorizes falls through to a rule with the same category
+    removable = hits > 0
+    for rule_indices in matches:
+        if rule_indices and removable[rule_indices[0]]:
+            fallback = rule_indices[1] if len(rule_indices) > 1 else None
+            if fallback is None or rule_set.categories[fallback] != rule_set.categories[rule_indices[0]]:
+                removable[rule_indices[0]] = False
+
+    # The original loop evaluates rule i for every memo whose first match is i or later (or none)
+    reached = np.where(hit, first_rules, rule_count)
+    evaluations = np.cumsum(np.bincount(reached, weights=weights, minlength=rule_count + 1)[::-1])[::-1][:rule_count]
+
+    shadowed = find_shadowed_rules(rules)
+    covered = find_covered_rules(rules)
+    stats = pd.DataFrame({
+        'keywords': [list(keywords) if not isinstance(keywords, str) else keywords for keywords, _ in rules],
+        'main_category': [category[0] if isinstance(category, tuple) and len(category) == 2 else None for _, category in rules],
+        'sub_category': [category[1] if isinstance(category, tuple) and len(category) == 2 else None for _, category in rules],
+        'hits': hits,
+        'distinct_memos': distinct_hits,
+        'shadowed_by': pd.array([shadowed.get(position) for position in range(rule_count)], dtype='Int64'),
+        'covered_by': pd.array([covered.get(position) for position in range(rule_count)], dtype='Int64'),
+        'removable': removable,
+        'loop_evaluations': evaluations.astype(np.int64),
+        'compiled_checks': _count_compiled_checks(rule_set, distinct_memos, weights),
+    })
+    stats.index.name = 'position'
+    if measure_cost:
+        stats['evaluation_us'] = _time_substring_evaluation(rules, distinct_memos) * 1e6
+        stats['loop_cost_ms'] = stats['evaluation_us'] * stats['loop_evaluations'] / 1000
+    stats.attrs['transactions'] = int(weights.sum())
+    stats.attrs['uncategorized'] = int(weights[~hit].sum())
+    return stats
+
+
+def print_rule_report(stats: pd.DataFrame, malformed: list, top: int = 15):
+    """Prints a summary of analyze_rules' statistics and the malformed entries."""
+    def describe(position):
+        row = stats.loc[position]
+        return f"#{position} {row['keywords']!r} -> ({row['main_category']}, {row['sub_category']})"
+
+    transactions = stats.attrs.get('transactions', 0)
+    uncategorized = stats.attrs.get('uncategorized', 0)
+    print(f"\nAnalyzed {len(stats)} rules against {transactions} transactions "
+          f"({uncategorized} uncategorized, {uncategorized / transactions:.1%})." if transactions else
+          f"\nAnalyzed {len(stats)} rules against no transactions.")
+
+    print(f"\nMalformed entries ({len(malformed)}):")
+    for position, problem in malformed:
+        print(f"  #{position} ({stats.loc[position, 'hits']} hits): {problem}")
+
+    shadowed = stats[stats['shadowed_by'].notna()]
+    print(f"\nShadowed rules, never reachable ({len(shadowed)}):")
+    for position, row in shadowed.iterrows():
+        print(f"  {describe(position)} is always matched first by #{row['shadowed_by']}")
+
+    covered = stats[stats['covered_by'].notna() & stats['shadowed_by'].isna()]
+    print(f"\nRules covered by a later rule with the same category ({len(covered)}):")
+    for position, row in covered.iterrows():
+        outcome = "removable" if row['removable'] or row['hits'] == 0 else "NOT removable on this data"
+        print(f"  {describe(position)} is also matched by #{row['covered_by']} ({row['hits']} hits, {outcome})")
+
+    dead = stats[(stats['hits'] == 0) & stats['shadowed_by'].isna()]
+    print(f"\nRules that never fire on this data ({len(dead)}):")
+    for position in dead.index:
+        print(f"  {describe(position)}")
+
+    print(f"\nTop {top} rules by hits:")
+    for position, row in stats.nlargest(top, 'hits').iterrows():
+        print(f"  {row['hits']:>7} hits  {describe(position)}")
+
+    if 'loop_cost_ms' in stats.columns:
+        print(f"\nMost expensive rules in the first-match loop (total {stats['loop_cost_ms'].sum():.1f} ms):")
+        for position, row in stats.nlargest(top, 'loop_cost_ms').iterrows():
+            print(f"  {row['loop_cost_ms']:>8.2f} ms  {row['loop_evaluations']:>7} evaluations x "
+                  f"{row['evaluation_us']:.2f} us  {describe(position)}")
+    print(f"\nCompiled rule set: {stats['compiled_checks'].sum()} rule checks in total "
+          f"vs {stats['loop_evaluations'].sum()} evaluations in the first-match loop.")
+
+
+def load_stored_memos(conn) -> list:
+    """Returns the memo of every row of 'ofx_transactions'."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT memo FROM ofx_transactions")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def analyze_stored_transactions(target_db: str = "local", output_path: str = None, measure_cost: bool = True):
+    """Analyzes CATEGORIZATION_RULES against the stored transactions and prints the report."""
+    conn = None
+    try:
+        conn = db_connect(target_db=target_db)
+        memos = load_stored_memos(conn)
+    except Exception as e:
+        print(f"Error reading transactions from database: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+    stats = analyze_rules(memos, measure_cost=measure_cost)
+    print_rule_report(stats, find_malformed_rules(CATEGORIZATION_RULES))
+    if output_path:
+        stats.to_csv(output_path)
+        print(f"\nPer-rule statistics written to {output_path}")
+    return stats
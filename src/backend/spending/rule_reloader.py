@@ -0,0 +1,139 @@
+'''
+Hot-reloadable compiled rule set for long-running processes (the Streamlit app).
+
+categorization_rules.py is imported once per process, so rules edited while the app runs
+are not seen by get_default_rule_set. ReloadableRuleSet watches the source file instead:
+a daemon thread polls its size/mtime, re-executes it into a throwaway namespace when it
+changes and compiles the new CATEGORIZATION_RULES in the background. The compiled set is
+swapped in with a single reference assignment, so readers (current(), suggest_categories)
+never wait for a compilation and always see either the old or the new rule set whole.
+A source that fails to load (e.g. saved half-edited) keeps the previous rule set.
+
+Ingestion keeps using get_default_rule_set: stored categories only change through a
+pipeline run or recategorize_spending.py.
+'''
+import importlib.util
+import os
+import threading
+
+from .categorization_engine import CompiledRuleSet, get_default_rule_set, rule_fingerprint, NO_MATCH
+
+RULES_SOURCE_PATH = os.path.join(os.path.dirname(__file__), 'categorization_rules.py')
+DEFAULT_RELOAD_POLL_SECONDS = 2.0
+
+
+def load_rules_from_source(source_path: str = RULES_SOURCE_PATH) -> list:
+    """Executes the rules source in a fresh namespace (sys.modules untouched) and returns its CATEGORIZATION_RULES."""
+    spec = importlib.util.spec_from_file_location('_reloaded_categorization_rules', source_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CATEGORIZATION_RULES
+
+
+def _source_stamp(source_path: str):
+    """Returns (size, mtime_ns) of the source, or None if it cannot be read."""
+    try:
+        stat = os.stat(source_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ReloadableRuleSet:
+    """A CompiledRuleSet that follows its source file, recompiled off the caller's thread."""
+
+    def __init__(self, source_path: str = RULES_SOURCE_PATH, initial_rule_set: CompiledRuleSet = None):
+        self.source_path = source_path
+        self._rule_set = initial_rule_set
+        self._stamp = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.reload_count = 0
+
+    def current(self) -> CompiledRuleSet:
+        """Returns the latest compiled rule set, compiling the source synchronously only if there is none yet."""
+        rule_set = self._rule_set
+        if rule_set is None:
+            self.check_for_changes()
+            rule_set = self._rule_set
+        return rule_set
+
+    def check_for_changes(self) -> bool:
+        """
+        Reloads the source if its size or mtime changed since the last check and swaps in the
+        recompiled rules when they differ from the current ones. Returns True if swapped.
+        """
+        stamp = _source_stamp(self.source_path)
+        if stamp is None or stamp == self._stamp:
+            return False
+        try:
+            rules = load_rules_from_source(self.source_path)
+            fingerprints = [rule_fingerprint(keywords, category) for keywords, category in rules]
+        except Exception as e:
+            print(f"Warning: Could not load categorization rules from {self.source_path} ({e}). "
+                  f"Keeping the previous rules.")
+            self._stamp = stamp   # retried once the file changes again
+            return False
+        self._stamp = stamp
+        if self._rule_set is not None and fingerprints == self._rule_set.rule_fingerprints:
+            return False   # touched or reformatted, same rules
+        new_rule_set = CompiledRuleSet(rules)
+        swapped = self._rule_set is not None
+        self._rule_set = new_rule_set
+        if swapped:
+            self.reload_count += 1
+            print(f"Categorization rules reloaded from {self.source_path} ({len(rules)} rules).")
+        return swapped
+
+    def start(self, poll_seconds: float = DEFAULT_RELOAD_POLL_SECONDS):
+        """Starts the background watcher thread (a daemon, so it never keeps the process alive). Returns self."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, args=(poll_seconds,), name='rule-set-reloader',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the watcher thread and waits for it to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self, poll_seconds: float):
+        while not self._stop_event.is_set():
+            try:
+                self.check_for_changes()
+            except Exception as e:
+                print(f"Warning: categorization rule reload failed ({e}).")
+            self._stop_event.wait(poll_seconds)
+
+    def suggest_categories(self, memos: list) -> list:
+        """
+        Returns the (main_category, sub_category) the current rules give each memo, None where
+        no rule matches or the memo is missing or empty (left uncategorized, as in ingestion).
+        """
+        rule_set = self.current()
+        has_memo = [isinstance(memo, str) and memo != '' for memo in memos]
+        rule_indices = rule_set.match_all([memo if valid else '' for memo, valid in zip(memos, has_memo)])
+        return [rule_set.categories[rule_index] if valid and rule_index != NO_MATCH else None
+                for rule_index, valid in zip(rule_indices, has_memo)]
+
+
+_reloadable_rule_set = None
+_reloadable_rule_set_lock = threading.Lock()
+
+
+def get_reloadable_rule_set(poll_seconds: float = DEFAULT_RELOAD_POLL_SECONDS) -> ReloadableRuleSet:
+    """
+    Returns the process-wide ReloadableRuleSet, started on first use. It starts from the
+    already compiled default rule set; the watcher's first poll picks up any edit made
+    since categorization_rules.py was imported.
+    """
+    global _reloadable_rule_set
+    with _reloadable_rule_set_lock:
+        if _reloadable_rule_set is None:
+            _reloadable_rule_set = ReloadableRuleSet(initial_rule_set=get_default_rule_set()).start(poll_seconds)
+        return _reloadable_rule_set
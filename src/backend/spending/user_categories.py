@@ -0,0 +1,125 @@
+'''
+User category overrides, stored in the 'user_transaction_categories' table.
+
+Each row overrides the category of one transaction, keyed by its id. The overrides used
+to live in resources/user_defined_categories.csv; that file is imported once, the first
+time the table is found empty, and is no longer written. Readers apply the overrides
+with a join on id (see USER_CATEGORY_JOIN) instead of merging the CSV row by row, and the
+editor saves all the changes of a click as one batched upsert that also updates the
+affected 'ofx_transactions' rows.
+
+The CSV is keyed by OFX FITID, but a FITID repeated across rows is stored under derived ids
+(see ofx_dedup.py). copy_user_categories_to_derived_ids gives each such row, identified by
+its source_id, its own copy of the FITID's override, so the join on id reaches it and later
+edits update that one row.
+'''
+import contextlib
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from .ofx_parser import (_load_user_defined_categories, _upsert_transaction_categories, USER_CATEGORIES_CSV_PATH,
+                         COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, COLUMN_CATEGORY_CONFIDENCE)
+from .ofx_writer import OFX_TRANSACTIONS_TABLE, ensure_ofx_transactions_schema
+from sql.bulk_load import bulk_load, bulk_transaction, placeholder, ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE
+from sql.schema import get_primary_key_columns, get_table_ddl
+
+USER_CATEGORIES_TABLE = 'user_transaction_categories'
+USER_CATEGORY_COLUMNS = [COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY, 'updated_at']
+# LEFT JOIN giving the override of each 'ofx_transactions t' row as 'u' (NULL columns when there is none)
+USER_CATEGORY_JOIN = f"LEFT JOIN {USER_CATEGORIES_TABLE} u ON u.{COLUMN_ID} = t.{COLUMN_ID}"
+
+
+def _clean_overrides(overrides_df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the last override of each id and drops those without an id or a category."""
+    overrides_df = overrides_df.dropna(subset=[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
+    overrides_df = overrides_df[overrides_df[COLUMN_ID].astype(str) != '']
+    return overrides_df.drop_duplicates(subset=[COLUMN_ID], keep='last')
+
+
+def import_user_categories_csv(conn, csv_path: str = USER_CATEGORIES_CSV_PATH) -> int:
+    """
+    Copies the overrides of the CSV into the table, keeping the ones already in the table.
+    The caller commits. Returns the number of rows read from the CSV.
+    """
+    overrides_df = _clean_overrides(_load_user_defined_categories(csv_path))
+    if overrides_df.empty:
+        return 0
+    print(f"Importing {len(overrides_df)} user-defined categories from {csv_path} into '{USER_CATEGORIES_TABLE}'...")
+    _upsert_transaction_categories(conn, overrides_df)
+    rows = [(str(transaction_id), main, sub, None) for transaction_id, main, sub in
+            overrides_df[[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY]].itertuples(index=False, name=None)]
+    bulk_load(conn, USER_CATEGORIES_TABLE, USER_CATEGORY_COLUMNS, rows, on_conflict=ON_CONFLICT_IGNORE, commit=False)
+    copy_user_categories_to_derived_ids(conn)
+    return len(rows)
+
+
+def copy_user_categories_to_derived_ids(conn) -> int:
+    """
+    Copies the override of each FITID onto the stored rows derived from it (source_id is the
+    FITID, id is not) that have no override of their own. The caller commits. Returns the
+    number of overrides copied.
+    """
+    ensure_ofx_transactions_schema(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO {USER_CATEGORIES_TABLE} ({', '.join(USER_CATEGORY_COLUMNS)})
+        SELECT t.{COLUMN_ID}, u.{COLUMN_MAIN_CATEGORY}, u.{COLUMN_SUB_CATEGORY}, u.updated_at
+        FROM {OFX_TRANSACTIONS_TABLE} t
+        INNER JOIN {USER_CATEGORIES_TABLE} u ON u.{COLUMN_ID} = t.source_id
+        WHERE t.{COLUMN_ID} <> t.source_id
+        AND NOT EXISTS (SELECT 1 FROM {USER_CATEGORIES_TABLE} o WHERE o.{COLUMN_ID} = t.{COLUMN_ID})
+    """)
+    copied = cursor.rowcount
+    if copied > 0:
+        print(f"Copied {copied} user-defined categories onto the de-duplicated ids of their transactions.")
+    return max(copied, 0)
+
+
+def ensure_user_categories_table(conn, csv_path: str = USER_CATEGORIES_CSV_PATH):
+    """Creates the table if it is missing and imports the CSV the first time the table is empty."""
+    cursor = conn.cursor()
+    if get_primary_key_columns(conn, USER_CATEGORIES_TABLE) is None:
+        print(f"Table '{USER_CATEGORIES_TABLE}' not found. Creating it from the declared DDL...")
+        cursor.execute(get_table_ddl(USER_CATEGORIES_TABLE))
+        conn.commit()
+    cursor.execute(f"SELECT COUNT(*) FROM {USER_CATEGORIES_TABLE}")
+    if cursor.fetchone()[0] == 0 and csv_path and os.path.exists(csv_path):
+        if import_user_categories_csv(conn, csv_path):
+            conn.commit()
+
+
+def load_user_categories(conn) -> pd.DataFrame:
+    """Returns every override as a DataFrame with id, main_category and sub_category columns."""
+    ensure_user_categories_table(conn)
+    return pd.read_sql(f"SELECT {COLUMN_ID}, {COLUMN_MAIN_CATEGORY}, {COLUMN_SUB_CATEGORY} FROM {USER_CATEGORIES_TABLE}",
+                       conn)
+
+
+def save_user_categories(conn, overrides: list, commit: bool = True) -> int:
+    """
+    Upserts overrides, a list of (transaction id, main_category, sub_category), in one batch
+    and applies them to the matching 'ofx_transactions' rows. Returns the number of overrides saved.
+    """
+    if not overrides:
+        return 0
+    ensure_user_categories_table(conn)
+    ensure_ofx_transactions_schema(conn)
+    overrides_df = _clean_overrides(pd.DataFrame(overrides, columns=[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY]))
+    _upsert_transaction_categories(conn, overrides_df)
+
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = [(str(transaction_id), main, sub, updated_at) for transaction_id, main, sub in
+            overrides_df.itertuples(index=False, name=None)]
+    with bulk_transaction(conn) if commit else contextlib.nullcontext():
+        bulk_load(conn, USER_CATEGORIES_TABLE, USER_CATEGORY_COLUMNS, rows, on_conflict=ON_CONFLICT_UPDATE,
+                  key_columns=[COLUMN_ID], commit=False)
+        # An override also replaces any category predicted by category_classifier.py
+        conn.cursor().executemany(
+            f"UPDATE {OFX_TRANSACTIONS_TABLE} SET {COLUMN_MAIN_CATEGORY} = {placeholder(conn)}, "
+            f"{COLUMN_SUB_CATEGORY} = {placeholder(conn)}, {COLUMN_CATEGORY_CONFIDENCE} = NULL "
+            f"WHERE {COLUMN_ID} = {placeholder(conn)}",
+            [(main, sub, transaction_id) for transaction_id, main, sub, _ in rows])
+    print(f"Saved {len(rows)} user-defined categories.")
+    return len(rows)
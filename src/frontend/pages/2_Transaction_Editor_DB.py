@@ -12,7 +12,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 src_dir = os.path.join(current_dir, '..', '..')
 sys.path.append(src_dir)
 
-from sql.connection import run_query
+from sql.connection import db_connect
+from backend.spending.user_categories import ensure_user_categories_table, save_user_categories, USER_CATEGORY_JOIN
+from backend.spending.rule_reloader import get_reloadable_rule_set
 
 # Define column names for consistency with the original app
 COLUMN_ID = 'id'
@@ -24,33 +26,21 @@ COLUMN_AMOUNT = 'amount'
 COLUMN_TYPE = 'type'
 COLUMN_ACCOUNT_TYPE = 'account_type'
 COLUMN_COMBINED_CATEGORY_DISPLAY = "Categoria / Sub categoria"
+COLUMN_SUGGESTED_CATEGORY = "suggested_category"
 
 # Fix the path construction to correctly point to resources directory
 # current_dir is pages/, we need to go up 3 levels to get to project root
 # pages -> frontend -> src -> project_root
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..', '..'))
-USER_CATEGORIES_FILE = os.path.join(project_root, 'resources', 'user_defined_categories.csv')
 USER_BUDGET_FILE = os.path.join(project_root, 'resources', 'user_defined_budget.csv')
 
-def load_user_categories():
-    if os.path.exists(USER_CATEGORIES_FILE):
-        try:
-            return pd.read_csv(USER_CATEGORIES_FILE)
-        except pd.errors.EmptyDataError:
-            return pd.DataFrame(columns=[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
-        except Exception as e:
-            st.error(f"Error loading user-defined categories: {e}")
-            return pd.DataFrame(columns=[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
-    return pd.DataFrame(columns=[COLUMN_ID, COLUMN_MAIN_CATEGORY, COLUMN_SUB_CATEGORY])
-
-def save_user_category(transaction_id, main_category, sub_category):
-    user_categories_df = load_user_categories()
-    # Remove existing entry for this transaction_id if it exists
-    user_categories_df = user_categories_df[user_categories_df[COLUMN_ID] != transaction_id]
-    # Append new entry
-    new_entry = pd.DataFrame([{COLUMN_ID: transaction_id, COLUMN_MAIN_CATEGORY: main_category, COLUMN_SUB_CATEGORY: sub_category}])
-    user_categories_df = pd.concat([user_categories_df, new_entry], ignore_index=True)
-    user_categories_df.to_csv(USER_CATEGORIES_FILE, index=False)
+def save_user_categories_batch(changes):
+    """Saves the (transaction_id, main_category, sub_category) changes of one save click in a single batch."""
+    conn = db_connect(target_db="local")
+    try:
+        save_user_categories(conn, changes)
+    finally:
+        conn.close()
 
 def load_user_budget():
     budget_dict = {}
@@ -86,20 +76,29 @@ def save_user_budget(budget_dict):
         st.error(f"Erro ao salvar o arquivo de orçamento: {e}")
         st.toast("Falha ao salvar o orçamento.", icon="❌")
 
-@st.cache_data
+# Short TTL so statements ingested by watch_spending.py show up without restarting the app
+@st.cache_data(ttl=30)
 def load_all_transactions_data_from_db(filter_start_date: date):
     """
-    Load transactions from the local database and merge with user-defined categories from CSV.
+    Load transactions from the local database, with user-defined categories joined over the stored ones.
     """
     try:
-        # Load transactions from database
-        query = """
-        SELECT id, date, type, amount, memo, account_type, main_category, sub_category
-        FROM ofx_transactions
-        ORDER BY date DESC
+        # User-defined categories override the stored ones through the join
+        query = f"""
+        SELECT t.id, t.date, t.type, t.amount, t.memo, t.account_type,
+               COALESCE(u.main_category, t.main_category) AS main_category,
+               COALESCE(u.sub_category, t.sub_category) AS sub_category
+        FROM ofx_transactions t
+        {USER_CATEGORY_JOIN}
+        ORDER BY t.date DESC
         """
         
-        transactions_df = run_query(query, target_db="local")
+        conn = db_connect(target_db="local")
+        try:
+            ensure_user_categories_table(conn)
+            transactions_df = pd.read_sql(query, conn)
+        finally:
+            conn.close()
         
         if transactions_df.empty:
             st.warning("Nenhuma transação encontrada no banco de dados.")
@@ -116,22 +115,6 @@ def load_all_transactions_data_from_db(filter_start_date: date):
         if COLUMN_AMOUNT in transactions_df.columns:
             transactions_df[COLUMN_AMOUNT] = pd.to_numeric(transactions_df[COLUMN_AMOUNT], errors='coerce').fillna(0.0)
         
-        # Load user-defined categories from CSV and override database categories
-        user_categories_df = load_user_categories()
-        if not user_categories_df.empty:
-            # Create a mapping of transaction_id to user-defined categories
-            user_categories_map = {}
-            for _, row in user_categories_df.iterrows():
-                user_categories_map[row[COLUMN_ID]] = (row[COLUMN_MAIN_CATEGORY], row[COLUMN_SUB_CATEGORY])
-            
-            # Override categories for transactions that have user-defined categories
-            for index, row in transactions_df.iterrows():
-                transaction_id = row[COLUMN_ID]
-                if transaction_id in user_categories_map:
-                    main_cat, sub_cat = user_categories_map[transaction_id]
-                    transactions_df.loc[index, COLUMN_MAIN_CATEGORY] = main_cat
-                    transactions_df.loc[index, COLUMN_SUB_CATEGORY] = sub_cat
-        
         # Apply date filter
         if COLUMN_DATE in transactions_df.columns:
             end_date_filter = date.today()
@@ -588,9 +571,18 @@ if not raw_transactions_df.empty:
                 COLUMN_MEMO, 
                 COLUMN_AMOUNT, 
                 COLUMN_COMBINED_CATEGORY_DISPLAY,
+                COLUMN_SUGGESTED_CATEGORY,
                 COLUMN_ACCOUNT_TYPE,
                 COLUMN_TYPE
             ]
+
+            # Suggested categories come from the live rules, recompiled in the background when
+            # categorization_rules.py changes, so they are computed on every rerun
+            if not editor_df.empty and COLUMN_MEMO in editor_df.columns:
+                editor_df[COLUMN_SUGGESTED_CATEGORY] = [
+                    f"{category[0]} / {category[1]}" if category else ""
+                    for category in get_reloadable_rule_set().suggest_categories(editor_df[COLUMN_MEMO].tolist())
+                ]
             
             if not editor_df.empty:
                 existing_cols_for_display = [col for col in ordered_columns_for_display if col in editor_df.columns]
@@ -628,6 +620,7 @@ if not raw_transactions_df.empty:
                     required=False,
                     width="large"
                 ),
+                COLUMN_SUGGESTED_CATEGORY: st.column_config.TextColumn("Sugestão (regras)", disabled=True),
                 COLUMN_ACCOUNT_TYPE: st.column_config.TextColumn("Conta", disabled=True),
                 COLUMN_TYPE: st.column_config.TextColumn("Tipo", disabled=True)
             }
@@ -646,7 +639,7 @@ if not raw_transactions_df.empty:
                     edited_rows_data = st.session_state[editor_key]["edited_rows"]
                     
                     if edited_rows_data:
-                        actually_saved_something = False
+                        changes_to_save = []
                         for row_idx_str, changed_cols_dict in edited_rows_data.items():
                             row_idx = int(row_idx_str)
                             
@@ -673,10 +666,10 @@ if not raw_transactions_df.empty:
                             # Save if categories have actually changed
                             if (new_main_cat_val != original_main_cat_val or 
                                 new_sub_cat_val != original_sub_cat_val):
-                                save_user_category(transaction_id_val, new_main_cat_val, new_sub_cat_val)
-                                actually_saved_something = True
+                                changes_to_save.append((transaction_id_val, new_main_cat_val, new_sub_cat_val))
                         
-                        if actually_saved_something:
+                        if changes_to_save:
+                            save_user_categories_batch(changes_to_save)
                             load_all_transactions_data_from_db.clear()
                             st.toast("Todas as alterações foram salvas com sucesso!", icon="✅")
                             st.session_state[editor_key]["edited_rows"] = {} 
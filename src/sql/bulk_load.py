@@ -0,0 +1,144 @@
+'''
+Shared bulk loader used by every pipeline writer.
+
+bulk_load writes a list of row tuples into one table using the fastest path of the
+connection returned by db_connect:
+
+- SQLite ("local"): one transaction, executemany over large batches, and the table's
+  secondary indexes dropped while the table is being reloaded and rebuilt once at the end;
+- MySQL ("remote"): multi-row INSERT statements inside an explicit transaction (db_connect
+  opens MySQL connections in autocommit mode, which would commit every statement).
+
+Conflicts on the table's keys are handled with the on_conflict modes below, translated to
+each backend's syntax. Every load prints its row count and rows per second.
+'''
+import contextlib
+import sqlite3
+import time
+
+import pandas as pd
+
+ON_CONFLICT_ERROR = 'error'     # Plain INSERT
+ON_CONFLICT_IGNORE = 'ignore'   # Keep the existing row
+ON_CONFLICT_REPLACE = 'replace' # Delete the existing row and insert the new one
+ON_CONFLICT_UPDATE = 'update'   # Update the non-key columns of the existing row
+
+SQLITE_BATCH_SIZE = 5000
+MYSQL_BATCH_SIZE = 500
+
+
+def is_sqlite(conn) -> bool:
+    return isinstance(conn, sqlite3.Connection)
+
+
+def placeholder(conn) -> str:
+    """Returns the DB-API parameter placeholder of the connection's backend."""
+    return '?' if is_sqlite(conn) else '%s'
+
+
+@contextlib.contextmanager
+def bulk_transaction(conn):
+    """Runs the block in a single transaction, committed at the end and rolled back on error."""
+    if not is_sqlite(conn) and not conn.in_transaction:
+        conn.start_transaction()
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def dataframe_to_rows(df: pd.DataFrame, columns: list = None) -> list:
+    """Converts a DataFrame to parameter tuples of plain Python values, with NaN/NaT as None."""
+    if columns is not None:
+        df = df[columns]
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def _build_insert_sql(conn, table: str, columns: list, row_count: int, on_conflict: str,
+                      key_columns: list) -> str:
+    column_list = ', '.join(columns)
+    row_placeholders = f"({', '.join([placeholder(conn)] * len(columns))})"
+    update_columns = [col for col in columns if col not in (key_columns or [])]
+
+    if is_sqlite(conn):
+        if on_conflict == ON_CONFLICT_UPDATE and (sqlite3.sqlite_version_info < (3, 24, 0) or not update_columns):
+            # No UPSERT clause before SQLite 3.24
+            on_conflict = ON_CONFLICT_REPLACE
+        if on_conflict == ON_CONFLICT_UPDATE:
+            assignments = ', '.join(f"{col} = excluded.{col}" for col in update_columns)
+            # Rows whose values did not change are left untouched
+            changed = ' OR '.join(f"{table}.{col} IS NOT excluded.{col}" for col in update_columns)
+            return (f"INSERT INTO {table} ({column_list}) VALUES {row_placeholders} "
+                    f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {assignments} WHERE {changed}")
+        verb = {ON_CONFLICT_ERROR: "INSERT", ON_CONFLICT_IGNORE: "INSERT OR IGNORE",
+                ON_CONFLICT_REPLACE: "INSERT OR REPLACE"}[on_conflict]
+        return f"{verb} INTO {table} ({column_list}) VALUES {row_placeholders}"
+
+    values = ', '.join([row_placeholders] * row_count)
+    if on_conflict == ON_CONFLICT_UPDATE and update_columns:
+        assignments = ', '.join(f"{col} = VALUES({col})" for col in update_columns)
+        return f"INSERT INTO {table} ({column_list}) VALUES {values} ON DUPLICATE KEY UPDATE {assignments}"
+    verb = {ON_CONFLICT_ERROR: "INSERT", ON_CONFLICT_IGNORE: "INSERT IGNORE",
+            ON_CONFLICT_REPLACE: "REPLACE", ON_CONFLICT_UPDATE: "INSERT IGNORE"}[on_conflict]
+    return f"{verb} INTO {table} ({column_list}) VALUES {values}"
+
+
+def _drop_secondary_indexes(cursor, table: str) -> list:
+    """Drops the SQLite indexes declared with CREATE INDEX on table and returns their definitions."""
+    # Indexes backing PRIMARY KEY / UNIQUE constraints have no sql and cannot be dropped
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                   (table,))
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def bulk_load(conn, table: str, columns: list, rows: list, on_conflict: str = ON_CONFLICT_ERROR,
+              key_columns: list = None, replace_all: bool = False, defer_indexes: bool = None,
+              batch_size: int = None, commit: bool = True) -> int:
+    """
+    Writes rows (tuples ordered like columns) into table and returns the number of rows sent.
+
+    on_conflict is one of the ON_CONFLICT_* modes; ON_CONFLICT_UPDATE needs key_columns (the
+    conflict target on SQLite). With replace_all=True the table is emptied first, in the same
+    transaction. defer_indexes (SQLite only) drops the table's secondary indexes during the
+    load and recreates them afterwards; by default it is on when replace_all is set.
+    With commit=False the caller owns the transaction (see bulk_transaction) and commits.
+    """
+    if on_conflict == ON_CONFLICT_UPDATE and not key_columns:
+        raise ValueError("bulk_load with on_conflict='update' needs key_columns.")
+    sqlite = is_sqlite(conn)
+    if batch_size is None:
+        batch_size = SQLITE_BATCH_SIZE if sqlite else MYSQL_BATCH_SIZE
+    if defer_indexes is None:
+        defer_indexes = replace_all
+
+    start_time = time.perf_counter()
+    transaction = bulk_transaction(conn) if commit else contextlib.nullcontext()
+    with transaction:
+        cursor = conn.cursor()
+        if replace_all:
+            cursor.execute(f"DELETE FROM {table}")
+        deferred_indexes = _drop_secondary_indexes(cursor, table) if sqlite and defer_indexes and rows else []
+
+        for batch_start in range(0, len(rows), batch_size):
+            batch = rows[batch_start:batch_start + batch_size]
+            if sqlite:
+                cursor.executemany(_build_insert_sql(conn, table, columns, 1, on_conflict, key_columns), batch)
+            else:
+                cursor.execute(_build_insert_sql(conn, table, columns, len(batch), on_conflict, key_columns),
+                               [value for row in batch for value in row])
+
+        for index_sql in deferred_indexes:
+            cursor.execute(index_sql)
+
+    elapsed = time.perf_counter() - start_time
+    rate = f"{len(rows) / elapsed:,.0f} rows/s" if elapsed > 0 and rows else "n/a"
+    print(f"Loaded {len(rows)} rows into '{table}' in {elapsed:.3f}s ({rate}, {on_conflict}"
+          f"{', table cleared first' if replace_all else ''}"
+          f"{f', {len(deferred_indexes)} index(es) rebuilt' if deferred_indexes else ''}).")
+    return len(rows)
@@ -201,8 +201,68 @@ CREATE TABLE ofx_transactions (
     account_type VARCHAR(50),
     main_category VARCHAR(100),
     sub_category VARCHAR(100),
+    rule_index INT,
+    category_confidence DOUBLE,
+    merchant_id INT,
+    source_id VARCHAR(255),
     FOREIGN KEY (main_category, sub_category) REFERENCES transaction_categories(main_category, sub_category)
 );
+
+DROP TABLE ofx_file_manifest;
+CREATE TABLE ofx_file_manifest (
+    file_path VARCHAR(255) PRIMARY KEY,
+    account_type VARCHAR(50),
+    file_size BIGINT,
+    file_mtime DOUBLE,
+    content_hash CHAR(64),
+    parse_seconds DOUBLE,
+    transaction_count INT,
+    ingested_at DATETIME
+);
+
+DROP TABLE ofx_transaction_index;
+CREATE TABLE ofx_transaction_index (
+    account_type VARCHAR(50) NOT NULL,
+    id VARCHAR(255) NOT NULL,
+    fingerprint CHAR(40) NOT NULL,
+    occurrence INT NOT NULL,
+    stored_id VARCHAR(255) NOT NULL,
+    source_file VARCHAR(255),
+    PRIMARY KEY (account_type, id, fingerprint, occurrence)
+);
+
+DROP TABLE categorization_rule_snapshot;
+CREATE TABLE categorization_rule_snapshot (
+    position INT PRIMARY KEY,
+    rule_fingerprint CHAR(64) NOT NULL,
+    keywords TEXT,
+    main_category VARCHAR(100),
+    sub_category VARCHAR(100)
+);
+
+DROP TABLE user_transaction_categories;
+CREATE TABLE user_transaction_categories (
+    id VARCHAR(255) PRIMARY KEY,
+    main_category VARCHAR(100) NOT NULL,
+    sub_category VARCHAR(100) NOT NULL,
+    updated_at DATETIME,
+    FOREIGN KEY (main_category, sub_category) REFERENCES transaction_categories(main_category, sub_category)
+);
+
+DROP TABLE merchants;
+CREATE TABLE merchants (
+    merchant_id INT PRIMARY KEY,
+    merchant_key VARCHAR(255) NOT NULL UNIQUE
+);
+
+DROP TABLE preprocess_source_digest;
+CREATE TABLE preprocess_source_digest (
+    source_table VARCHAR(50) NOT NULL,
+    source_key VARCHAR(100) NOT NULL,
+    date DATE NOT NULL,
+    digest BIGINT NOT NULL,
+    PRIMARY KEY (source_table, source_key, date)
+);
 '''
 
 def get_embedded_ddl_statements():
@@ -198,8 +198,68 @@ CREATE TABLE ofx_transactions (
     account_type VARCHAR(50),
     main_category VARCHAR(100),
     sub_category VARCHAR(100),
+    rule_index INT,
+    category_confidence DOUBLE,
+    merchant_id INT,
+    source_id VARCHAR(255),
     FOREIGN KEY (main_category, sub_category) REFERENCES transaction_categories(main_category, sub_category)
 );
+
+DROP TABLE IF EXISTS ofx_file_manifest;
+CREATE TABLE ofx_file_manifest (
+    file_path VARCHAR(255) PRIMARY KEY,
+    account_type VARCHAR(50),
+    file_size BIGINT,
+    file_mtime DOUBLE,
+    content_hash CHAR(64),
+    parse_seconds DOUBLE,
+    transaction_count INT,
+    ingested_at DATETIME
+);
+
+DROP TABLE IF EXISTS ofx_transaction_index;
+CREATE TABLE ofx_transaction_index (
+    account_type VARCHAR(50) NOT NULL,
+    id VARCHAR(255) NOT NULL,
+    fingerprint CHAR(40) NOT NULL,
+    occurrence INT NOT NULL,
+    stored_id VARCHAR(255) NOT NULL,
+    source_file VARCHAR(255),
+    PRIMARY KEY (account_type, id, fingerprint, occurrence)
+);
+
+DROP TABLE IF EXISTS categorization_rule_snapshot;
+CREATE TABLE categorization_rule_snapshot (
+    position INT PRIMARY KEY,
+    rule_fingerprint CHAR(64) NOT NULL,
+    keywords TEXT,
+    main_category VARCHAR(100),
+    sub_category VARCHAR(100)
+);
+
+DROP TABLE IF EXISTS user_transaction_categories;
+CREATE TABLE user_transaction_categories (
+    id VARCHAR(255) PRIMARY KEY,
+    main_category VARCHAR(100) NOT NULL,
+    sub_category VARCHAR(100) NOT NULL,
+    updated_at DATETIME,
+    FOREIGN KEY (main_category, sub_category) REFERENCES transaction_categories(main_category, sub_category)
+);
+
+DROP TABLE IF EXISTS merchants;
+CREATE TABLE merchants (
+    merchant_id INT PRIMARY KEY,
+    merchant_key VARCHAR(255) NOT NULL UNIQUE
+);
+
+DROP TABLE IF EXISTS preprocess_source_digest;
+CREATE TABLE preprocess_source_digest (
+    source_table VARCHAR(50) NOT NULL,
+    source_key VARCHAR(100) NOT NULL,
+    date DATE NOT NULL,
+    digest BIGINT NOT NULL,
+    PRIMARY KEY (source_table, source_key, date)
+);
 '''
 
 def _get_ddl_statements_from_string(ddl_string):
@@ -216,6 +276,12 @@ def create_tables_from_ddl(target_db_arg="local"):
     """Creates tables in the specified database using embedded DDL statements.
     
     Special handling: Preserves asset_price table data by skipping DROP statements for this table.
+    The spending tables (ofx_transactions, transaction_categories, ofx_file_manifest,
+    ofx_transaction_index, categorization_rule_snapshot) are preserved as well, so incremental
+    OFX ingestion only has to load new statement files, and so are the user category
+    overrides in user_transaction_categories and the merchant ids in merchants.
+    The derived investment tables and preprocess_source_digest are kept too, so
+    preprocess_data only recomputes the rows affected by source changes.
     """
     if not db_connect:
         print("Error: db_connect function not available. Cannot create tables.")
@@ -237,23 +303,22 @@ def create_tables_from_ddl(target_db_arg="local"):
 
         print(f"Found {len(sql_statements)} SQL statements to execute for table creation.")
 
-        preserved_tables = ['asset_price']  # Tables to preserve data for
+        preserved_tables = ['asset_price', 'ofx_transactions', 'transaction_categories', 'ofx_file_manifest', 'ofx_transaction_index', 'categorization_rule_snapshot', 'user_transaction_categories', 'merchants',
+                            'dates', 'daily_asset_price', 'variable_income_daily_balance', 'fixed_income_daily_balance', 'fgts_daily_balance',
+                            'daily_balance', 'operations', 'financial_returns', 'summary_returns', 'preprocess_source_digest']  # Tables to preserve data for
         skipped_drops = []
 
         for stmt_index, sql in enumerate(sql_statements):
             sql_lower = sql.lower().strip()
             
-            # Check if this is a DROP statement for a preserved table
-            skip_statement = False
-            for preserved_table in preserved_tables:
-                if (sql_lower.startswith("drop table if exists") or sql_lower.startswith("drop table")) and preserved_table in sql_lower:
-                    print(f"⚠️  SKIPPING DROP for preserved table '{preserved_table}': {sql[:60]}...")
-                    skipped_drops.append(preserved_table)
-                    skip_statement = True
-                    break
-            
-            if skip_statement:
-                continue
+            # Check if this is a DROP statement for a preserved table. The exact table name is
+            # compared: 'operations' must not also match 'fixed_income_operations'
+            if sql_lower.startswith("drop table"):
+                dropped_table = sql_lower.split()[-1].strip('`;')
+                if dropped_table in preserved_tables:
+                    print(f"⚠️  SKIPPING DROP for preserved table '{dropped_table}': {sql[:60]}...")
+                    skipped_drops.append(dropped_table)
+                    continue
                 
             print(f"Executing DDL statement {stmt_index + 1}/{len(sql_statements)}: {sql[:100]}{'...' if len(sql) > 100 else ''}")
             try:
@@ -0,0 +1,37 @@
+'''
+Schema lookups shared by the writers that create their tables on demand: the declared
+CREATE TABLE statement of a table, and the primary key of an existing one, on both the
+SQLite ("local") and MySQL ("remote") connections returned by db_connect.
+'''
+from sql.bulk_load import is_sqlite
+
+
+def get_table_ddl(table_name: str) -> str:
+    """Returns the CREATE TABLE statement for table_name from the embedded DDL in database_setup."""
+    # Imported here: database_setup is only needed when the table has to be (re)created
+    from sql.database_setup import ALL_DDL_STATEMENTS, _get_ddl_statements_from_string
+    for statement in _get_ddl_statements_from_string(ALL_DDL_STATEMENTS):
+        if statement.lower().startswith(f"create table {table_name.lower()} "):
+            return statement
+    raise ValueError(f"No CREATE TABLE statement found for '{table_name}'.")
+
+
+def get_primary_key_columns(conn, table_name: str):
+    """Returns the primary key columns of table_name, or None if the table does not exist."""
+    cursor = conn.cursor()
+    if is_sqlite(conn):
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns = cursor.fetchall()
+        if not columns:
+            return None
+        # PRAGMA table_info rows: (cid, name, type, notnull, dflt_value, pk)
+        return [column[1] for column in sorted(columns, key=lambda c: c[5]) if column[5] > 0]
+
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+        (table_name,))
+    if cursor.fetchone()[0] == 0:
+        return None
+    cursor.execute(f"SHOW KEYS FROM {table_name} WHERE Key_name = 'PRIMARY'")
+    # SHOW KEYS rows: (Table, Non_unique, Key_name, Seq_in_index, Column_name, ...)
+    return [row[4] for row in sorted(cursor.fetchall(), key=lambda r: r[3])]
@@ -0,0 +1,64 @@
+import datetime
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from backend.investments.preprocessing import preprocess_data
+from sql.database_setup import ALL_DDL_STATEMENTS, _get_ddl_statements_from_string
+
+CDI_FACTOR = 1.0004
+
+
+def _cdi_days(start: datetime.date, end: datetime.date) -> list:
+    return [start + datetime.timedelta(days=offset) for offset in range((end - start).days)
+            if (start + datetime.timedelta(days=offset)).weekday() < 5]
+
+
+def _database_with_two_due_dates(path: str) -> sqlite3.Connection:
+    """One CDB held in lots with two due dates, the second one with lots at two tax rates."""
+    conn = sqlite3.connect(path)
+    for statement in _get_ddl_statements_from_string(ALL_DDL_STATEMENTS):
+        conn.execute(statement)
+    conn.executemany("INSERT INTO index_series VALUES ('cdi', ?, ?)",
+                     [(day.isoformat(), CDI_FACTOR) for day in _cdi_days(datetime.date(2023, 1, 2), datetime.date(2024, 6, 1))])
+    conn.executemany("INSERT INTO fixed_income_operations VALUES (?, 'buy', 1, ?, ?, 'cdi', ?, 0.0, 1.0, ?, 0)", [
+        ('CDB X', '2023-02-01', '2024-01-15', 1000.0, 0.15),
+        ('CDB X', '2023-03-01', '2024-03-15', 2000.0, 0.15),
+        ('CDB X', '2023-04-03', '2024-03-15', 500.0, 0.2),
+    ])
+    # daily_balance keeps the fixed income days up to the last equity day
+    conn.execute("INSERT INTO asset_price VALUES ('BRL=X', '2023-01-02', 5.0, 5.0)")
+    conn.execute("INSERT INTO variable_income_operations VALUES ('NU', 'buy', '2023-01-10', 10, 5.0, 'BRL')")
+    conn.commit()
+    return conn
+
+
+def _net_value(value: float, purchase_date: str, on_date: str, tax_rate: float) -> float:
+    index_days = len(_cdi_days(datetime.date.fromisoformat(purchase_date), datetime.date.fromisoformat(on_date)
+                               + datetime.timedelta(days=1)))
+    gross_value = value * CDI_FACTOR ** index_days
+    return gross_value - (gross_value - value) * tax_rate
+
+
+def test_asset_with_lots_of_two_due_dates_sums_into_daily_balance(tmp_path):
+    conn = _database_with_two_due_dates(str(tmp_path / 'test.db'))
+    preprocess_data(conn)
+
+    series = conn.execute("SELECT due_date, deposit_value, net_value FROM fixed_income_daily_balance "
+                          "WHERE asset = 'CDB X' AND date = '2023-05-02' ORDER BY due_date").fetchall()
+    assert [(due_date, deposit_value) for due_date, deposit_value, _ in series] == [('2024-01-15', 1000.0),
+                                                                                   ('2024-03-15', 2500.0)]
+    expected = [_net_value(1000.0, '2023-02-01', '2023-05-02', 0.15),
+                _net_value(2000.0, '2023-03-01', '2023-05-02', 0.15) + _net_value(500.0, '2023-04-03', '2023-05-02', 0.2)]
+    assert [net_value for _, _, net_value in series] == pytest.approx(expected)
+
+    balances = dict(conn.execute("SELECT date, value FROM daily_balance WHERE asset = 'CDB X' AND type = 'fixed_income' "
+                                 "AND date IN ('2023-05-02', '2024-02-01')").fetchall())
+    assert balances['2023-05-02'] == pytest.approx(sum(expected))
+    # Only the later due date is still held
+    assert balances['2024-02-01'] == pytest.approx(
+        _net_value(2000.0, '2023-03-01', '2024-02-01', 0.15) + _net_value(500.0, '2023-04-03', '2024-02-01', 0.2))
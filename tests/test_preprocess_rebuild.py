@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from backend.investments.preprocessing import preprocess_data
+from sql.database_setup import ALL_DDL_STATEMENTS, _get_ddl_statements_from_string
+
+FULL_REBUILD_MESSAGE = "Rebuilding every derived table..."
+
+
+def _database_with_one_fgts_company(path: str) -> sqlite3.Connection:
+    """fgts_daily_balance only sums months with several companies, so it stays empty here."""
+    conn = sqlite3.connect(path)
+    for statement in _get_ddl_statements_from_string(ALL_DDL_STATEMENTS):
+        conn.execute(statement)
+    conn.executemany("INSERT INTO fgts_operations VALUES (?, 'Company A', 'deposit', 100.0, ?)",
+                     [('2023-01-05', 100.0), ('2023-02-05', 200.0)])
+    conn.execute("INSERT INTO asset_price VALUES ('BRL=X', '2023-01-02', 5.0, 5.0)")
+    conn.execute("INSERT INTO variable_income_operations VALUES ('NU', 'buy', '2023-01-10', 10, 5.0, 'BRL')")
+    conn.commit()
+    return conn
+
+
+def test_table_built_empty_does_not_trigger_a_full_rebuild(tmp_path, capsys):
+    conn = _database_with_one_fgts_company(str(tmp_path / 'test.db'))
+    preprocess_data(conn)
+    assert FULL_REBUILD_MESSAGE in capsys.readouterr().out
+    assert conn.execute("SELECT COUNT(*) FROM fgts_daily_balance").fetchone()[0] == 0
+
+    preprocess_data(conn)
+    assert FULL_REBUILD_MESSAGE not in capsys.readouterr().out
+
+
+def test_table_cleared_since_it_was_built_triggers_a_full_rebuild(tmp_path, capsys):
+    conn = _database_with_one_fgts_company(str(tmp_path / 'test.db'))
+    preprocess_data(conn)
+    conn.execute("DELETE FROM variable_income_daily_balance")
+    conn.commit()
+    capsys.readouterr()
+
+    preprocess_data(conn)
+    assert FULL_REBUILD_MESSAGE in capsys.readouterr().out
+    assert conn.execute("SELECT COUNT(*) FROM variable_income_daily_balance").fetchone()[0] > 0
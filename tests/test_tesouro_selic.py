@@ -0,0 +1,107 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from backend.investments.tesouro_selic import tesouro_selic_daily_balances
+
+DUE_DATE = '2030-03-01'
+
+
+def _cdi_dates(start: str, count: int) -> np.ndarray:
+    days = []
+    day = datetime.date.fromisoformat(start)
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return np.array(days)
+
+
+def _old_loop_balances(cdi_dates: np.ndarray, cdi_factors: np.ndarray, operations: list) -> list:
+    """
+    The day-by-day loop tesouro_selic_daily_balances replaced, with the SQL that fed it: each
+    operation covers the CDI days from its purchase date to the next purchase date (the
+    last one, to its due date). Returns (date, due date, deposit value, balance) rows.
+    """
+    rows = []
+    for position, (purchase_date, due_date, quotas, value) in enumerate(operations):
+        next_date = operations[position + 1][0] if position + 1 < len(operations) else due_date
+        rows.extend((cdi_date, due_date, factor, quotas, value) for cdi_date, factor in zip(cdi_dates, cdi_factors)
+                    if purchase_date <= cdi_date < next_date)
+
+    balances = []
+    quota_balance = balance = previous_purchase_value = None
+    for row_index, (cdi_date, due_date, factor, quotas, value) in enumerate(rows):
+        if row_index == 0:
+            quota_balance, balance, previous_purchase_value = quotas, value, value
+        else:
+            if previous_purchase_value != value:
+                balance = balance + value
+                previous_purchase_value = value
+                quota_balance += quotas
+            balance = balance * factor if quota_balance > 0 else 0
+        if balance > 0:
+            balances.append((cdi_date, due_date, previous_purchase_value, balance))
+    return balances
+
+
+def _balances(cdi_dates: np.ndarray, cdi_factors: np.ndarray, operations: list) -> list:
+    positions, due_dates, deposit_values, balances = tesouro_selic_daily_balances(cdi_dates, cdi_factors, operations)
+    return list(zip(cdi_dates[positions].tolist(), due_dates.tolist(), deposit_values.tolist(), balances.tolist()))
+
+
+def _random_history(random: np.random.Generator, cdi_dates: np.ndarray) -> list:
+    """Buys and sells on distinct CDI days, with distinct values, sometimes selling every quota."""
+    days = np.sort(random.choice(len(cdi_dates) - 1, size=random.integers(1, 12), replace=False))
+    operations = []
+    quota_balance = 0.0
+    for day in days:
+        if quota_balance > 0 and random.random() < 0.3:
+            quotas = quota_balance if random.random() < 0.5 else round(quota_balance * random.random(), 6)
+            sign = -1
+        else:
+            quotas = round(random.uniform(0.1, 5.0), 6)
+            sign = 1
+        quota_balance += sign * quotas
+        operations.append((cdi_dates[day], DUE_DATE, sign * quotas, sign * round(quotas * random.uniform(9000, 15000), 2)))
+    return operations
+
+
+def test_matches_the_old_loop_on_random_histories():
+    random = np.random.default_rng(23)
+    cdi_dates = _cdi_dates('2020-01-02', 400)
+    for _ in range(300):
+        cdi_factors = 1 + random.uniform(0.0001, 0.0005, size=len(cdi_dates))
+        operations = _random_history(random, cdi_dates)
+        expected = _old_loop_balances(cdi_dates, cdi_factors, operations)
+        actual = _balances(cdi_dates, cdi_factors, operations)
+        assert [row[:3] for row in actual] == [row[:3] for row in expected]
+        assert [row[3] for row in actual] == pytest.approx([row[3] for row in expected], rel=1e-9)
+
+
+def test_second_purchase_of_the_same_value_is_added():
+    # The old loop only noticed a new operation when its value differed from the last one
+    cdi_dates = _cdi_dates('2024-01-01', 5)
+    cdi_factors = np.full(len(cdi_dates), 1.001)
+    operations = [(cdi_dates[0], DUE_DATE, 1.0, 100.0), (cdi_dates[2], DUE_DATE, 1.0, 100.0)]
+
+    third_day = _balances(cdi_dates, cdi_factors, operations)[2]
+    assert third_day[2] == 100.0
+    assert third_day[3] == pytest.approx(100 * 1.001 ** 2 + 100 * 1.001)
+    assert _old_loop_balances(cdi_dates, cdi_factors, operations)[2][3] == pytest.approx(100 * 1.001 ** 2)
+
+
+def test_operations_on_the_same_cdi_day_are_combined():
+    # A Saturday purchase enters on Monday with the Monday one; the old query covered no CDI day for it
+    cdi_dates = _cdi_dates('2024-01-08', 5)
+    cdi_factors = np.full(len(cdi_dates), 1.001)
+    operations = [('2024-01-06', DUE_DATE, 1.0, 100.0), ('2024-01-08', DUE_DATE, 0.5, 50.0)]
+
+    balances = _balances(cdi_dates, cdi_factors, operations)
+    assert balances[:2] == [('2024-01-08', DUE_DATE, 150.0, 150.0), ('2024-01-09', DUE_DATE, 150.0, pytest.approx(150 * 1.001))]
+    assert _old_loop_balances(cdi_dates, cdi_factors, operations)[0] == ('2024-01-08', DUE_DATE, 50.0, 50.0)
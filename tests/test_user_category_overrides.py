@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import backend.spending.ofx_parser as ofx_parser
+from backend.spending.ofx_dedup import TransactionDedupIndex
+from backend.spending.user_categories import USER_CATEGORY_JOIN, ensure_user_categories_table, save_user_categories
+from sql.database_setup import ALL_DDL_STATEMENTS, _get_ddl_statements_from_string
+
+FITID = '681fcd1b-0000-4000-8000-000000000001'
+
+
+def _installments_df() -> pd.DataFrame:
+    """Two installments of one purchase: Nubank gives both the same FITID."""
+    return pd.DataFrame({
+        'id': [FITID, FITID],
+        'date': pd.to_datetime(['2024-01-10', '2024-02-10']),
+        'type': ['debit', 'debit'],
+        'amount': [-50.0, -50.0],
+        'memo': ['Loja X - Parcela 1/2', 'Loja X - Parcela 2/2'],
+        'account_type': ['Credit Card', 'Credit Card'],
+    })
+
+
+def test_override_reaches_every_row_of_a_repeated_fitid(monkeypatch):
+    monkeypatch.setattr(ofx_parser, 'USE_MEMO_CATEGORY_CACHE', False)
+    kept_df, removed_by_id, removed_by_fingerprint = TransactionDedupIndex().filter_file(
+        _installments_df(), 'Credit Card', 'credit_card/statement.ofx')
+    assert (removed_by_id, removed_by_fingerprint) == (0, 0)
+    assert kept_df['id'].nunique() == 2
+    assert kept_df['source_id'].tolist() == [FITID, FITID]
+
+    user_categories_df = pd.DataFrame({'id': [FITID], 'main_category': ['Roupas'], 'sub_category': ['Geral']})
+    categorized_df = ofx_parser._categorize_transactions_internal(kept_df.copy(), user_categories_df=user_categories_df)
+    assert categorized_df['main_category'].tolist() == ['Roupas', 'Roupas']
+    assert categorized_df['sub_category'].tolist() == ['Geral', 'Geral']
+
+
+def test_imported_override_joins_to_derived_ids_and_edits_keep_one_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(ofx_parser, 'USE_MEMO_CATEGORY_CACHE', False)
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    for statement in _get_ddl_statements_from_string(ALL_DDL_STATEMENTS):
+        conn.execute(statement)
+    kept_df, _, _ = TransactionDedupIndex().filter_file(_installments_df(), 'Credit Card', 'credit_card/statement.ofx')
+    categorized_df = ofx_parser._categorize_transactions_internal(kept_df.copy(), user_categories_df=pd.DataFrame())
+    ofx_parser._write_categorized_transactions(conn, categorized_df, 'replace')
+    csv_path = tmp_path / 'user_defined_categories.csv'
+    csv_path.write_text(f"id,main_category,sub_category\n{FITID},Roupas,Geral\n")
+
+    ensure_user_categories_table(conn, str(csv_path))
+    joined = conn.execute(f"SELECT t.id, u.main_category FROM ofx_transactions t {USER_CATEGORY_JOIN}").fetchall()
+    assert sorted(main_category for _, main_category in joined) == ['Roupas', 'Roupas']
+
+    derived_id = next(transaction_id for transaction_id, _ in joined if transaction_id != FITID)
+    save_user_categories(conn, [(derived_id, 'Lazer', 'Geral')])
+    assert conn.execute("SELECT COUNT(*) FROM user_transaction_categories WHERE id = ?", (derived_id,)).fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM user_transaction_categories").fetchone()[0] == 2
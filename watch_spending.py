@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Watches resources/files/<account> and ingests new OFX statements as they arrive.
+
+Usage: python watch_spending.py [--target_db local|remote] [--poll SECONDS] [--debounce SECONDS]
+
+Only new or changed statements are parsed and upserted into 'ofx_transactions';
+investments data is left untouched (use run.py for the full pipeline). Stop with Ctrl+C.
+"""
+
+import argparse
+import os
+import sys
+
+# Add src to path to use existing connection system
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from backend.spending.ofx_watcher import watch_ofx_files, DEFAULT_POLL_SECONDS, DEFAULT_DEBOUNCE_SECONDS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest new OFX statements as they are dropped into resources/files.")
+    parser.add_argument("--target_db", type=str, default="local", choices=["local", "remote"],
+                        help="The target database ('local' for SQLite, 'remote' for MySQL). Default is 'local'.")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS,
+                        help=f"Seconds between directory scans. Default is {DEFAULT_POLL_SECONDS}.")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE_SECONDS,
+                        help=f"Seconds the files must stay unchanged before ingesting. Default is {DEFAULT_DEBOUNCE_SECONDS}.")
+    args = parser.parse_args()
+
+    watch_ofx_files(target_db=args.target_db, poll_seconds=args.poll, debounce_seconds=args.debounce)